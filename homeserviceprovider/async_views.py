@@ -0,0 +1,41 @@
+"""
+Async-native counterparts of DRF's read-only API views.
+
+Under ASGI a sync DRF view holds a worker thread for the whole request. An
+AsyncAPIView authenticates, checks the user's role and queries with the
+async ORM on the event loop instead. ASYNC_READ_VIEWS picks the async
+implementations in the URLconfs; each shares its serialization with the
+sync view it stands in for, so both return identical payloads.
+"""
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+
+from users.authentication import aauthenticate
+
+
+class AsyncAPIView(View):
+    # Roles allowed in; None admits any authenticated user
+    roles = None
+    renderer_class = JSONRenderer
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await aauthenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+        except (AuthenticationFailed, NotAuthenticated) as exc:
+            response = self.render_error(exc)
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        if self.roles is not None and user.role not in self.roles:
+            return self.render_error(PermissionDenied())
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+    def render(self, data, status=200):
+        return HttpResponse(self.renderer_class().render(data), status=status, content_type='application/json')
+
+    def render_error(self, exc):
+        return self.render({'detail': exc.detail}, status=exc.status_code)
@@ -0,0 +1,207 @@
+"""
+Per-request SQL instrumentation.
+
+Every database connection carries an execute wrapper that reports to the
+RequestQueryStats of the current request, found through a context variable
+so queries run by the async ORM on worker threads are counted too.
+QueryInstrumentationMiddleware counts each request's queries, sums their
+time and fingerprints the SQL (placeholders only, so the same statement with
+different parameters has one fingerprint). Each response gets a Server-Timing header, statements
+repeated at least QUERY_N_PLUS_ONE_THRESHOLD times are reported as likely
+N+1 queries, and per-view histograms are kept in memory for QueryStatsView.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from users.permissions import IsAdmin
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+PLACEHOLDER_LIST = re.compile(r'%s(?:, %s)+')
+
+
+def fingerprint(sql):
+    # IN (...) lists of different lengths are still the same statement
+    return PLACEHOLDER_LIST.sub('%s, ...', sql)
+
+
+class RequestQueryStats:
+    """
+    Execute wrapper collecting the queries run while it is installed.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def repeated(self, threshold):
+        repeated = Counter()
+        for sql, count in self.statements.items():
+            repeated[fingerprint(sql)] += count
+        return {sql: count for sql, count in repeated.items() if count >= threshold}
+
+
+current_stats = ContextVar('current_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # First in line, so scoped execute_wrapper() blocks that pop() their own wrapper never remove it
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+for open_connection in connections.all(initialized_only=True):
+    install_query_recorder(open_connection)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def as_dict(self):
+        labels = [f'<={bucket}' for bucket in self.buckets] + [f'>{self.buckets[-1]}']
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.total, 3)}
+
+
+class ViewQueryStats:
+    def __init__(self):
+        self.requests = 0
+        self.n_plus_one = 0
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time = Histogram(DB_TIME_BUCKETS_MS)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'n_plus_one_requests': self.n_plus_one,
+            'queries': self.queries.as_dict(),
+            'db_time_ms': self.db_time.as_dict(),
+        }
+
+
+class QueryStatsRegistry:
+    def __init__(self):
+        self._views = defaultdict(ViewQueryStats)
+        self._lock = threading.Lock()
+
+    def record(self, view_name, stats, repeated):
+        with self._lock:
+            view = self._views[view_name]
+            view.requests += 1
+            view.n_plus_one += bool(repeated)
+            view.queries.observe(stats.count)
+            view.db_time.observe(stats.duration * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: view.as_dict() for name, view in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = QueryStatsRegistry()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Sync and async capable, so async views are not pushed onto a worker
+    thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestQueryStats()
+        started = time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.process_stats(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestQueryStats()
+        started = time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.process_stats(request, response, stats, started)
+
+    def process_stats(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view_name = (match.view_name or match._func_path) if match else 'unresolved'
+        repeated = stats.repeated(self.threshold)
+        if repeated:
+            logger.warning(
+                "Likely N+1 queries in %s: %s", view_name,
+                '; '.join(f'{count}x {sql[:200]}' for sql, count in repeated.items())
+            )
+            response['X-Repeated-Queries'] = str(max(repeated.values()))
+        registry.record(view_name, stats, repeated)
+
+        response['Server-Timing'] = (
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries", app;dur={elapsed * 1000:.2f}'
+        )
+        return response
+
+
+class QueryStatsView(APIView):
+    """
+    Per-view query count and database time histograms since process start (admin only).
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(registry.snapshot())
@@ -0,0 +1,19 @@
+from django.db.models import CharField, Lookup
+
+
+@CharField.register_lookup
+class Prefix(Lookup):
+    """
+    Case-sensitive prefix match written as a range, so the column's B-tree index can serve it
+    (LIKE and istartswith can't use one on SQLite, nor on PostgreSQL outside the C collation).
+    """
+    lookup_name = 'prefix'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        prefix = self.rhs
+        if not prefix:
+            return f'{lhs} IS NOT NULL', lhs_params
+        # The smallest string above every string starting with prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return f'{lhs} >= %s AND {lhs} < %s', [*lhs_params, prefix, *lhs_params, upper]
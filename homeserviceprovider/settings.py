@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'homeserviceprovider.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,9 +85,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock at BEGIN and wait for it, so concurrent wallet
+        # updates serialize instead of failing with "database is locked".
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file-backed test database honours the busy timeout, which the
+        # shared-cache in-memory one does not; threaded tests rely on it.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+
+# Catalog versions and auth principals are invalidated through the cache, so every
+# web, ASGI and Celery process must share one. The local-memory fallback is only
+# fit for development and tests (see `manage.py check --deploy`).
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,7 +165,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         # or JWT:
         # 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
@@ -140,9 +174,39 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Requests repeating one SQL statement this many times are reported as likely N+1 queries
+QUERY_N_PLUS_ONE_THRESHOLD = 5
+
+# Serve hot list endpoints from .values() rows instead of per-instance ModelSerializers
+FAST_LIST_SERIALIZATION = True
+
+# Serve the read-heavy order, catalog and wallet endpoints from async-native views (for ASGI deployments)
+ASYNC_READ_VIEWS = False
+
+# Weights of the features scored by ?ordering=rank on available orders (see orders.ranking)
+ORDER_RANKING_WEIGHTS = {
+    'price_gap': 0.35,
+    'expiry': 0.15,
+    'schedule': 0.15,
+    'proposals': 0.15,
+    'distance': 0.2,
+}
+
 CELERY_BEAT_SCHEDULE = {
     'expire-orders-every-hour': {
         'task': 'orders.tasks.expire_orders_task',
         'schedule': crontab(minute="0", hour='*'),  # Every hour
     },
+    'merge-price-observations-every-minute': {
+        'task': 'orders.tasks.merge_price_observations_task',
+        'schedule': crontab(),  # Every minute
+    },
+    'settle-ledger-every-minute': {
+        'task': 'users.tasks.settle_ledger_task',
+        'schedule': crontab(),  # Every minute
+    },
+    'checkpoint-wallets-daily': {
+        'task': 'users.tasks.create_wallet_checkpoints_task',
+        'schedule': crontab(minute="30", hour='3'),  # Every day at 03:30
+    },
 }
@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from services.models import MainService, SubService
+from users.models import User
+from .instrumentation import QueryInstrumentationMiddleware, fingerprint, registry
+
+
+class QueryInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        main_service = MainService.objects.create(name='Cleaning')
+        for i in range(6):
+            SubService.objects.create(main_service=main_service, name=f'Sub {i}', base_price=Decimal('10.00'))
+
+    def setUp(self):
+        registry.reset()
+
+    def run_middleware(self, view):
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        return QueryInstrumentationMiddleware(view)(request)
+
+    def test_flags_repeated_statements(self):
+        def n_plus_one_view(request):
+            # SubService.__str__ fetches its main service every time
+            return HttpResponse(', '.join(str(sub) for sub in SubService.objects.all()))
+
+        response = self.run_middleware(n_plus_one_view)
+
+        self.assertIn('desc="7 queries"', response['Server-Timing'])
+        self.assertEqual(response['X-Repeated-Queries'], '6')
+        self.assertEqual(registry.snapshot()['unresolved']['n_plus_one_requests'], 1)
+
+    def test_clean_request_is_not_flagged(self):
+        response = self.run_middleware(lambda request: HttpResponse(len(SubService.objects.all())))
+
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertNotIn('X-Repeated-Queries', response)
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(fingerprint('SELECT 1 WHERE id IN (%s, %s, %s)'), fingerprint('SELECT 1 WHERE id IN (%s, %s)'))
+
+    def test_stats_endpoint_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='customer', password='pass', role='customer'))
+        client.get(reverse('main-service_list'))
+
+        self.assertEqual(client.get(reverse('query-stats')).status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(username='admin', password='pass', role='admin'))
+        stats = client.get(reverse('query-stats')).data
+
+        self.assertEqual(stats['main-service_list']['requests'], 1)
@@ -19,9 +19,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from .instrumentation import QueryStatsView
+
 urlpatterns = [
     path('api/users/', include('users.urls')),  # This should point to users' URLs
     path('api/orders/', include('orders.urls')),
+    path('api/query-stats/', QueryStatsView.as_view(), name='query-stats'),
     path('admin/', admin.site.urls),
 ]
 
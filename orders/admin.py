@@ -1,18 +1,90 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+
+from homeserviceprovider import lookups  # noqa: F401 (registers __prefix)
+from homeserviceprovider.paginators import EstimatedCountPaginator
+from services.models import SubService
+from .catalog import CATALOG_TIMEOUT, get_catalog_version
 from .models import Order, Proposal
+from .search import matching_order_ids
+
+
+def username_prefix(term):
+    return get_user_model().objects.filter(username__prefix=term).values('pk')
+
+
+def id_match(field, term):
+    return Q(**{field: term}) if term.isdigit() else Q(pk__in=[])
+
+
+class SubServiceListFilter(admin.SimpleListFilter):
+    """
+    Sub-service filter whose choices come from one cached query, refreshed with the service catalog.
+    """
+    title = 'sub service'
+    parameter_name = 'sub_service'
+
+    def lookups(self, request, model_admin):
+        key = f'admin:sub-service-choices:{get_catalog_version()}'
+        choices = cache.get(key)
+        if choices is None:
+            choices = [
+                (str(pk), f"{name} ({main_service})")
+                for pk, name, main_service in SubService.objects.order_by('main_service__name', 'name')
+                .values_list('pk', 'name', 'main_service__name')
+            ]
+            cache.set(key, choices, CATALOG_TIMEOUT)
+        return choices
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(sub_service_id=self.value())
+        return queryset
+
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'customer', 'sub_service', 'status', 'scheduled_date', 'created_at')
-    list_filter = ('status', 'sub_service', 'created_at')
-    search_fields = ('customer__username', 'sub_service__name', 'description')
-    ordering = ('-created_at',)
+    list_filter = ('status', SubServiceListFilter, 'created_at')
+    list_select_related = ('customer', 'sub_service__main_service')
+    # Searched by get_search_results; listed here for the search box
+    search_fields = ('=id', 'customer__username__prefix', 'sub_service__name__prefix', 'description')
+    raw_id_fields = ('customer', 'sub_service', 'selected_proposal')
+    # Follows creation order through the primary key, so pages never sort the table
+    ordering = ('-id',)
     readonly_fields = ('created_at',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # Every branch is an indexed lookup on the order table's own columns, so the OR never scans it
+        return queryset.filter(
+            id_match('pk', term)
+            | Q(customer__in=username_prefix(term))
+            | Q(sub_service__in=SubService.objects.filter(name__prefix=term).values('pk'))
+            | Q(pk__in=matching_order_ids(term, queryset.db))
+        ), False
 
 @admin.register(Proposal)
 class ProposalAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'specialist', 'proposed_price', 'estimated_duration', 'created_at')
     list_filter = ('created_at',)
-    search_fields = ('order__id', 'specialist__username')
-    ordering = ('-created_at',)
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    list_select_related = ('order__customer', 'specialist')
+    # Searched by get_search_results; listed here for the search box
+    search_fields = ('=order__id', 'specialist__username__prefix')
+    raw_id_fields = ('order', 'specialist')
+    ordering = ('-id',)
+    readonly_fields = ('created_at',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(id_match('order_id', term) | Q(specialist__in=username_prefix(term))), False
@@ -0,0 +1,95 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from services.models import MainService
+from .serializers import MainServiceSerializer
+
+CATALOG_VERSION_KEY = 'orders:catalog:version'
+CATALOG_BODY_KEY = 'orders:catalog:body:{version}'
+# The version must outlive every body cached under it; bodies of old versions just age out
+CATALOG_VERSION_TIMEOUT = None
+CATALOG_TIMEOUT = 60 * 60 * 24
+
+
+def initial_version():
+    # Clock-based, so a version key lost to eviction never restarts below a version still cached
+    return time.time_ns()
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = initial_version()
+        cache.add(CATALOG_VERSION_KEY, version, timeout=CATALOG_VERSION_TIMEOUT)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidate the cached catalog. Old bodies are simply never looked up again.
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, initial_version(), timeout=CATALOG_VERSION_TIMEOUT)
+
+
+async def aget_catalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        version = initial_version()
+        await cache.aadd(CATALOG_VERSION_KEY, version, timeout=CATALOG_VERSION_TIMEOUT)
+        version = await cache.aget(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def catalog_queryset():
+    return MainService.objects.prefetch_related('sub_services').order_by('id')
+
+
+def render_catalog(main_services):
+    """
+    The catalog JSON body for the given main services and its strong ETag.
+    """
+    body = JSONRenderer().render(MainServiceSerializer(main_services, many=True).data)
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()
+    return etag, body
+
+
+def build_catalog():
+    """
+    Render the catalog JSON body and its strong ETag.
+    """
+    return render_catalog(catalog_queryset())
+
+
+async def abuild_catalog():
+    return render_catalog([main_service async for main_service in catalog_queryset()])
+
+
+def get_catalog():
+    """
+    Return (etag, body) for the current catalog version, rebuilding it on a miss.
+    """
+    key = CATALOG_BODY_KEY.format(version=get_catalog_version())
+    cached = cache.get(key)
+    if cached is None:
+        cached = build_catalog()
+        cache.set(key, cached, timeout=CATALOG_TIMEOUT)
+    return cached
+
+
+async def aget_catalog():
+    """
+    Async get_catalog(), sharing its cache entries.
+    """
+    key = CATALOG_BODY_KEY.format(version=await aget_catalog_version())
+    cached = await cache.aget(key)
+    if cached is None:
+        cached = await abuild_catalog()
+        await cache.aset(key, cached, timeout=CATALOG_TIMEOUT)
+    return cached
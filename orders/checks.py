@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cache invalidation only reaches the process that made it unless every process shares the cache.
+    """
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        "The default cache is local to each process, so catalog and authentication cache "
+        "invalidations never reach other web or Celery workers.",
+        hint="Set REDIS_URL (or configure CACHES) to a cache shared by every process.",
+        id='homeserviceprovider.W001',
+    )]
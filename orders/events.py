@@ -0,0 +1,145 @@
+"""
+In-process pub/sub of order events for the available-orders stream.
+
+Events are published from whichever thread commits the change (order
+creation signals, expire_orders) and fanned out to subscribers living on the
+ASGI event loop. The hub keeps the last HISTORY_SIZE events so a reconnecting
+client can resume after its Last-Event-ID. Every subscriber has a bounded
+queue; one that falls QUEUE_SIZE events behind is cut off and told to
+reconnect, so a slow client never holds up publishers or buffers without
+limit.
+
+The hub only sees events published in its own process: run expire_orders
+in the web process (e.g. the expiry scheduler) for expirations to be streamed.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from rest_framework.renderers import JSONRenderer
+
+from .serializers import OrderSerializer
+
+HISTORY_SIZE = 1000
+QUEUE_SIZE = 100
+
+ORDER_CREATED = 'order.created'
+ORDER_EXPIRED = 'order.expired'
+
+
+@dataclass(frozen=True)
+class OrderEvent:
+    id: int
+    type: str
+    sub_service_id: int
+    data: str
+
+    def encode(self):
+        return f'id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n'
+
+
+class Subscription:
+    def __init__(self, sub_service_ids, queue_size):
+        self.sub_service_ids = frozenset(sub_service_ids)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.lagged = False
+        self.missed = False
+
+    def offer(self, event):
+        # Called from any thread; the queue itself is only touched on the subscriber's loop
+        if event.sub_service_id in self.sub_service_ids:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self):
+        """
+        The next event, or None once the subscriber has lagged and drained its queue.
+        """
+        if self.lagged and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+
+class OrderEventHub:
+    def __init__(self, history_size=HISTORY_SIZE, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, sub_service_id, data):
+        with self._lock:
+            self._last_id += 1
+            event = OrderEvent(self._last_id, event_type, sub_service_id, data)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.offer(event)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                self.unsubscribe(subscription)
+        return event
+
+    def publish_created(self, order):
+        self.publish(ORDER_CREATED, order.sub_service_id, JSONRenderer().render(OrderSerializer(order).data).decode())
+
+    def publish_expired(self, orders):
+        """
+        Publish an expiry for each (order_id, sub_service_id) pair.
+        """
+        for order_id, sub_service_id in orders:
+            self.publish(ORDER_EXPIRED, sub_service_id, json.dumps({'id': order_id, 'sub_service': sub_service_id}))
+
+    def subscribe(self, sub_service_ids, last_event_id=None):
+        """
+        Register a subscriber on the running event loop.
+
+        Returns the subscription and the buffered events after last_event_id
+        it should replay first; subscription.missed is set when some of
+        those are no longer in the history.
+        """
+        subscription = Subscription(sub_service_ids, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if last_event_id is None:
+                return subscription, []
+            oldest = self._history[0].id if self._history else self._last_id + 1
+            # Ids beyond ours come from before a restart, so the gap is unknown too
+            subscription.missed = last_event_id < oldest - 1 or last_event_id > self._last_id
+            replay = [
+                event for event in self._history
+                if event.id > last_event_id and event.sub_service_id in subscription.sub_service_ids
+            ]
+        return subscription, replay
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def clear(self):
+        with self._lock:
+            self._history.clear()
+            self._subscribers.clear()
+
+
+hub = OrderEventHub()
@@ -0,0 +1,76 @@
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .events import hub
+from .models import Order, OrderStatus, Proposal
+from .state import transition_many
+
+
+@dataclass
+class ExpiryResult:
+    expired: int = 0
+    batches: int = 0
+    last_pk: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self):
+        return self.expired / self.elapsed if self.elapsed else 0.0
+
+
+def expirable_orders(now=None):
+    """
+    Orders past visible_until that are still waiting and never got a proposal.
+    """
+    now = now or timezone.now()
+    return Order.objects.filter(
+        status=OrderStatus.WAITING_FOR_PROPOSALS,
+        visible_until__lte=now,
+    ).filter(~Exists(Proposal.objects.filter(order=OuterRef('pk'))))
+
+
+def expire_orders(batch_size=1000, sleep=0, start_pk=0, now=None, order_ids=None):
+    """
+    Expire stale orders in primary-key batches.
+
+    Each batch is a short transaction over at most batch_size rows, with an
+    optional pause in between so writers are not starved. Batches go through
+    orders.state, so every expiry is logged as an OrderTransition. Every
+    batch re-checks its conditions, so an interrupted run can be resumed from
+    result.last_pk (or simply restarted) without expiring anything twice.
+    """
+    now = now or timezone.now()
+    result = ExpiryResult(last_pk=start_pk)
+    started = time.monotonic()
+    candidates = expirable_orders(now)
+    if order_ids is not None:
+        candidates = candidates.filter(pk__in=order_ids)
+
+    while True:
+        with transaction.atomic():
+            # Locked, so a concurrent run waits and then skips whatever this batch expired
+            batch = list(
+                candidates.filter(pk__gt=result.last_pk).order_by('pk').select_for_update()
+                .values_list('pk', 'sub_service_id')[:batch_size]
+            )
+            if not batch:
+                break
+            batch_ids = [pk for pk, _ in batch]
+            expired = set(transition_many(batch_ids, OrderStatus.EXPIRED, candidates))
+        # Only announce the orders this batch expired; some may have got a proposal under us
+        hub.publish_expired([(pk, sub_service_id) for pk, sub_service_id in batch if pk in expired])
+        result.expired += len(expired)
+        result.batches += 1
+        result.last_pk = batch_ids[-1]
+        # A short batch means the candidates ran out; orders lost to a race don't count
+        if len(batch_ids) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    result.elapsed = time.monotonic() - started
+    return result
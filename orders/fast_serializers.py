@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.utils import timezone
+from django.utils.duration import duration_string
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if timezone.is_aware(value):
+            value = value.astimezone(field_timezone)
+        else:
+            value = timezone.make_aware(value, field_timezone)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+def _decimal_converter(field):
+    if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize:
+        return field.to_representation
+    quantize = field.quantize
+    return lambda value: '{:f}'.format(quantize(value))
+
+
+def _choice_converter(field):
+    choices = field.choice_strings_to_values
+    return lambda value: choices.get(str(value), value)
+
+
+def _identity(field):
+    return lambda value: value
+
+
+CONVERTERS = [
+    (serializers.DateTimeField, _datetime_converter),
+    (serializers.DecimalField, _decimal_converter),
+    (serializers.DurationField, lambda field: duration_string),
+    (serializers.ChoiceField, _choice_converter),
+    (serializers.PrimaryKeyRelatedField, _identity),
+    (serializers.IntegerField, _identity),
+    (serializers.CharField, lambda field: str),
+]
+
+
+class FastSerializer:
+    """
+    Read-only serializer for .values() rows that produces the same data as a
+    flat ModelSerializer without per-instance field introspection.
+
+    Field sources and converters are resolved once; serialize() is then a
+    tight loop over plain dicts. Fields with no dedicated converter fall back
+    to the DRF field's own to_representation.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def fields(self):
+        return [field for field in self.serializer_class().fields.values() if not field.write_only]
+
+    @cached_property
+    def names(self):
+        return [field.field_name for field in self.fields]
+
+    @cached_property
+    def columns(self):
+        return [field.source for field in self.fields]
+
+    def get_converters(self):
+        # Built per call so datetime fields honour the currently active timezone
+        converters = []
+        for field in self.fields:
+            factory = next((factory for cls, factory in CONVERTERS if isinstance(field, cls)), None)
+            converters.append(factory(field) if factory else field.to_representation)
+        return converters
+
+    def values(self, queryset, ordering=()):
+        """
+        queryset.values() with the serialized columns plus any ordering fields a paginator reads from the rows.
+        """
+        columns = list(self.columns)
+        columns += [field.lstrip('-') for field in ordering if field.lstrip('-') not in columns]
+        return queryset.values(*columns)
+
+    def serialize(self, rows):
+        plan = list(zip(self.names, self.columns, self.get_converters()))
+        return [
+            {name: None if row[column] is None else convert(row[column]) for name, column, convert in plan}
+            for row in rows
+        ]
+
+
+class FastListModelMixin:
+    """
+    List view mixin that serves list() through a FastSerializer over .values()
+    while settings.FAST_LIST_SERIALIZATION is on.
+    """
+    fast_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_serializer is None or not getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            return super().list(request, *args, **kwargs)
+
+        # Cursor pagination reads its ordering fields from the rows too
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        queryset = self.fast_serializer.values(self.filter_queryset(self.get_queryset()), ordering)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.fast_serializer.serialize(page))
+        return Response(self.fast_serializer.serialize(queryset))
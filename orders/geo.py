@@ -0,0 +1,96 @@
+"""
+Geohash cells and vectorized distances for location-aware order matching.
+
+Orders store the geohash of their location at GEO_CELL_PRECISION. A radius
+query first prunes candidates to the 3x3 block of cells (at the finest
+precision whose cells are at least the radius across) around the centre,
+using index range scans on the cell prefix, then computes exact haversine
+distances for the survivors in one NumPy pass.
+"""
+import numpy as np
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEO_CELL_PRECISION = 6
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+# Sorts after every base32 character, so prefix ranges are [prefix, prefix + '~')
+PREFIX_END = '~'
+
+
+def encode(latitude, longitude, precision=GEO_CELL_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    cell, bits, bit_count, even = [], 0, 0, True
+    while len(cell) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            cell.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(cell)
+
+
+def cell_for(latitude, longitude):
+    """
+    The geo_cell stored for a location, or None unless both coordinates are set.
+    """
+    if latitude is None or longitude is None:
+        return None
+    return encode(float(latitude), float(longitude))
+
+
+def cell_size_degrees(precision):
+    """
+    (height, width) of a geohash cell in degrees.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_precision(latitude, radius_km):
+    """
+    Finest precision whose cells are at least radius_km tall and wide at this latitude.
+    """
+    lon_km_per_degree = KM_PER_DEGREE * max(np.cos(np.radians(latitude)), 0.01)
+    for precision in range(GEO_CELL_PRECISION, 0, -1):
+        height, width = cell_size_degrees(precision)
+        if height * KM_PER_DEGREE >= radius_km and width * lon_km_per_degree >= radius_km:
+            return precision
+    return 0
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells together contain every point within radius_km.
+    An empty prefix means the radius is too large to prune by cell.
+    """
+    precision = covering_precision(latitude, radius_km)
+    if precision == 0:
+        return {''}
+    height, width = cell_size_degrees(precision)
+    cells = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            lat = min(max(latitude + dy * height, -90.0), 90.0 - 1e-9)
+            lon = (longitude + dx * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+    return cells
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distances in km from one point to arrays of points.
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    lon2 = np.radians(np.asarray(longitudes, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from orders.expiry import expire_orders
+
+
+class Command(BaseCommand):
+    help = "Expire orders with no proposals after the visible_until time has passed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Orders updated per batch.")
+        parser.add_argument('--sleep', type=float, default=0, help="Seconds to pause between batches.")
+        parser.add_argument('--start-pk', type=int, default=0, help="Resume after this order id.")
+
+    def handle(self, *args, **options):
+        result = expire_orders(
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            start_pk=options['start_pk'],
+        )
+        self.stdout.write(
+            f"Expired {result.expired} orders due to lack of proposals "
+            f"in {result.batches} batches ({result.rate:.0f} orders/s, last id {result.last_pk})."
+        )
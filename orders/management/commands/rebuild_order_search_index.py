@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.search import create_search_index, reindex_orders
+
+
+class Command(BaseCommand):
+    help = "Rebuild the order full-text search index, fully or from a given order id."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-pk', type=int, default=0, help="Only reindex orders after this id.")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Orders reindexed per batch.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        create_search_index()
+        indexed = reindex_orders(start_pk=options['start_pk'], batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Indexed {indexed} orders in {elapsed:.1f}s.")
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.pricing import rebuild_price_sketches
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-sub-service price sketches from all proposals and selections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = rebuild_price_sketches(chunk_size=options['chunk_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Rebuilt {written} price sketches in {elapsed:.1f}s.")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.scheduler import scheduler
+
+
+class Command(BaseCommand):
+    help = "Run the order expiry scheduler, expiring orders within seconds of their visible_until."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Orders expired per UPDATE.")
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help="Seconds between scans for orders created by other processes.")
+
+    def handle(self, *args, **options):
+        scheduler.batch_size = options['batch_size']
+        poll_interval = options['poll_interval']
+
+        loaded = scheduler.load()
+        self.stdout.write(f"Scheduled {loaded} waiting orders.")
+        try:
+            while True:
+                expired = scheduler.run_pending()
+                if expired:
+                    self.stdout.write(f"Expired {expired} orders.")
+                scheduler.load()
+
+                sleep = poll_interval
+                next_deadline = scheduler.next_deadline()
+                if next_deadline is not None:
+                    sleep = min(sleep, max((next_deadline - scheduler.clock()).total_seconds(), 0))
+                time.sleep(sleep)
+        except KeyboardInterrupt:
+            pass
@@ -1,9 +1,16 @@
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
-from services.models import SubService
+from services.models import SpecialistService, SubService
 from django.utils import timezone
 from datetime import timedelta
 
+from . import geo
+
 
 class OrderStatus(models.TextChoices):
     WAITING_FOR_PROPOSALS = 'waiting_for_proposals', 'Waiting for specialist proposals'
@@ -16,6 +23,83 @@ class OrderStatus(models.TextChoices):
     EXPIRED = 'expired', 'Expired'
 
 
+class OrderQuerySet(models.QuerySet):
+    def available_for(self, specialist, now=None):
+        """
+        Open orders matching the specialist's sub-services.
+
+        The sub-service ids are resolved through a subquery on the M2M through
+        table, so the whole match runs as a single SQL statement served by the
+        (status, sub_service, visible_until) index.
+        """
+        now = now or timezone.now()
+        # Cached principals already carry the ids (see users.authentication)
+        sub_service_ids = getattr(specialist, 'sub_service_ids', None)
+        if sub_service_ids is None:
+            sub_service_ids = SpecialistService.sub_service.through.objects.filter(
+                specialistservice__specialist=specialist
+            ).values('subservice_id')
+        return self.filter(
+            status=OrderStatus.WAITING_FOR_PROPOSALS,
+            sub_service_id__in=sub_service_ids,
+            visible_until__gte=now,
+            selected_proposal__isnull=True,
+        )
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """
+        Orders located within radius_km of the point.
+
+        Candidates are pruned by geohash cell in SQL and their exact distances
+        computed in one vectorized pass; the result filters on the surviving ids.
+        """
+        latitude, longitude, radius_km = float(latitude), float(longitude), float(radius_km)
+        cells = Q()
+        for prefix in geo.covering_cells(latitude, longitude, radius_km):
+            cells |= Q(geo_cell__gte=prefix, geo_cell__lt=prefix + geo.PREFIX_END)
+        candidates = list(self.filter(cells).values_list('pk', 'latitude', 'longitude'))
+        if not candidates:
+            return self.none()
+        ids, latitudes, longitudes = zip(*candidates)
+        distances = geo.haversine_km(latitude, longitude, latitudes, longitudes)
+        return self.filter(pk__in=[pk for pk, distance in zip(ids, distances) if distance <= radius_km])
+
+    # geo_cell is derived from the location, so every bulk write path keeps it in sync
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.sync_geo_cell()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {'latitude', 'longitude'} & set(fields):
+            objs = list(objs)
+            for obj in objs:
+                obj.sync_geo_cell()
+            fields = [*fields, 'geo_cell'] if 'geo_cell' not in fields else fields
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        location = {'latitude', 'longitude'} & kwargs.keys()
+        if location and 'geo_cell' not in kwargs:
+            if len(location) < 2 or any(hasattr(kwargs[name], 'resolve_expression') for name in location):
+                raise ValueError("Update latitude and longitude together, as plain values, so geo_cell can follow.")
+            kwargs['geo_cell'] = geo.cell_for(kwargs['latitude'], kwargs['longitude'])
+        return super().update(**kwargs)
+
+    def record_proposal(self, order_id, proposed_price, created_at):
+        """
+        Fold a new proposal into the order's denormalized proposal counters in one UPDATE.
+        """
+        price = Value(proposed_price, output_field=models.DecimalField(max_digits=10, decimal_places=2))
+        return self.filter(pk=order_id).update(
+            proposal_count=F('proposal_count') + 1,
+            min_proposed_price=Coalesce(Least('min_proposed_price', price), price),
+            last_proposal_at=Greatest(Coalesce('last_proposal_at', Value(created_at)), Value(created_at)),
+        )
+
+
 class Order(models.Model):
     customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
     sub_service = models.ForeignKey(SubService, on_delete=models.CASCADE, related_name='orders')
@@ -29,12 +113,54 @@ class Order(models.Model):
     scheduled_date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
     address = models.TextField(blank=True, null=True)
-    visible_until = models.DateTimeField(default=timezone.now() + timedelta(hours=24))
+    visible_until = models.DateTimeField(blank=True)
+    selected_proposal = models.OneToOneField(
+        'Proposal', on_delete=models.SET_NULL, related_name='selected_for', blank=True, null=True
+    )
+    # Maintained by OrderQuerySet.record_proposal so reads never aggregate proposals
+    proposal_count = models.PositiveIntegerField(default=0)
+    min_proposed_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    last_proposal_at = models.DateTimeField(blank=True, null=True)
+    latitude = models.DecimalField(
+        max_digits=9, decimal_places=6, blank=True, null=True,
+        validators=[MinValueValidator(Decimal('-90')), MaxValueValidator(Decimal('90'))]
+    )
+    longitude = models.DecimalField(
+        max_digits=9, decimal_places=6, blank=True, null=True,
+        validators=[MinValueValidator(Decimal('-180')), MaxValueValidator(Decimal('180'))]
+    )
+    # Geohash of (latitude, longitude), kept in sync by save() and OrderQuerySet's bulk writes
+    geo_cell = models.CharField(max_length=12, blank=True, null=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'sub_service', 'visible_until', 'id'], name='order_matching_idx'),
+            models.Index(fields=['status', 'sub_service', 'geo_cell'], name='order_geo_matching_idx'),
+        ]
+        constraints = [
+            # A location is both coordinates or neither, and a located order always has its cell
+            models.CheckConstraint(
+                condition=Q(latitude__isnull=True, longitude__isnull=True, geo_cell__isnull=True)
+                | Q(latitude__isnull=False, longitude__isnull=False, geo_cell__isnull=False),
+                name='order_location_complete',
+            ),
+        ]
+
+    def sync_geo_cell(self):
+        self.geo_cell = geo.cell_for(self.latitude, self.longitude)
+
+    def clean(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValidationError("Set both latitude and longitude, or neither.")
+        self.sync_geo_cell()
 
     def save(self, *args, **kwargs):
         # Set visible_until based on sub-service's expiration_hours
         if not self.visible_until:
             self.visible_until = timezone.now() + timedelta(hours=self.sub_service.expiration_hours)
+        self.sync_geo_cell()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -49,4 +175,59 @@ class Proposal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Proposal #{self.id} for Order #{self.order.id} by {self.specialist.username}"
+        return f"Proposal #{self.id} for Order #{self.order_id} by {self.specialist.username}"
+
+
+class OrderTransition(models.Model):
+    """
+    Append-only log of the status changes applied through orders.state.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='transitions')
+    status = models.CharField(max_length=30, choices=OrderStatus.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order #{self.order_id} -> {self.status}"
+
+
+class PriceKind(models.TextChoices):
+    PROPOSED = 'proposed', 'Proposed prices'
+    ACCEPTED = 'accepted', 'Accepted prices'
+
+
+class PriceSketch(models.Model):
+    """
+    Streaming quantile sketch of one sub-service's prices; see orders.pricing.
+    """
+    sub_service = models.ForeignKey(SubService, on_delete=models.CASCADE, related_name='price_sketches')
+    kind = models.CharField(max_length=10, choices=PriceKind.choices)
+    count = models.PositiveIntegerField(default=0)
+    # Bucket index -> number of prices in it
+    buckets = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sub_service', 'kind'], name='unique_price_sketch'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.sub_service_id}"
+
+
+class PriceObservation(models.Model):
+    """
+    A price staged by a proposal or selection and folded into its sketch by the next merge.
+
+    Observations are only ever inserted and then deleted by the merge, so
+    proposals never contend for a busy sub-service's sketch row.
+    """
+    sub_service = models.ForeignKey(SubService, on_delete=models.CASCADE, related_name='price_observations')
+    kind = models.CharField(max_length=10, choices=PriceKind.choices)
+    # The proposal made, or the one selected; lets a rebuild skip prices still waiting for a merge
+    proposal = models.ForeignKey(Proposal, on_delete=models.CASCADE, related_name='price_observations')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.price} for {self.sub_service_id}"
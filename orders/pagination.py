@@ -0,0 +1,26 @@
+from asgiref.sync import sync_to_async
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class AvailableOrdersPagination(CursorPagination):
+    """
+    Keyset pagination for the specialist matching feed, ordered the same way
+    as the order matching index so each page is a bounded index range scan.
+    """
+    ordering = ('visible_until', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        DRF's paginate_queryset(), run off the event loop so async views get
+        exactly the pages and links the sync view does.
+        """
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+
+class ProposalPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,198 @@
+"""
+Per-sub-service price statistics from streaming quantile sketches.
+
+Each sketch is a log-bucketed histogram: a price p lands in bucket
+ceil(log_gamma(p)) with gamma = (1 + a) / (1 - a), so any quantile read back
+from it is within relative error a of the exact one. Sketches are stored as
+a small {bucket: count} map per sub-service and kind.
+
+Proposals and selections stage their prices as PriceObservation rows, and
+merge_price_observations() folds them into the sketches in batches: one
+UPDATE per sketch a batch touches, however many prices it covers.
+"""
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from services.models import SubService
+from .models import Order, PriceKind, PriceObservation, PriceSketch, Proposal
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Bucket for zero prices, which have no logarithm
+ZERO_BUCKET = 'zero'
+QUANTILES = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+CENT = Decimal('0.01')
+PRICE_STATS_KEY = 'orders:price-stats:{sub_service_id}'
+PRICE_STATS_TIMEOUT = 60 * 60
+# Price observations folded per merge transaction
+MERGE_BATCH_SIZE = 1000
+
+
+def bucket_for(price):
+    price = float(price)
+    if price <= 0:
+        return ZERO_BUCKET
+    return str(math.ceil(math.log(price) / LOG_GAMMA))
+
+
+def bucket_value(bucket):
+    """
+    The value reported for a bucket: the point with equal relative error to both its bounds.
+    """
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** int(bucket) / (GAMMA + 1)
+
+
+def add_prices(buckets, prices):
+    for price in prices:
+        bucket = bucket_for(price)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    return buckets
+
+
+def quantile(buckets, count, q):
+    """
+    Approximate value at rank floor(q * (count - 1)), or None for an empty sketch.
+    """
+    if not count:
+        return None
+    rank = math.floor(q * (count - 1))
+    seen = 0
+    for bucket in sorted(buckets, key=lambda bucket: -math.inf if bucket == ZERO_BUCKET else int(bucket)):
+        seen += buckets[bucket]
+        if seen > rank:
+            return Decimal(bucket_value(bucket)).quantize(CENT)
+    return None
+
+
+def summarize(sketch):
+    count = sketch.count if sketch else 0
+    buckets = sketch.buckets if sketch else {}
+    return {'count': count, **{name: quantile(buckets, count, q) for name, q in QUANTILES.items()}}
+
+
+def invalidate_price_stats(sub_service_id):
+    cache.delete(PRICE_STATS_KEY.format(sub_service_id=sub_service_id))
+
+
+def record_price(sub_service_id, kind, proposal):
+    """
+    Stage the proposal's price for the sub-service's sketch.
+    """
+    PriceObservation.objects.create(sub_service_id=sub_service_id, kind=kind, proposal=proposal,
+                                    price=proposal.proposed_price)
+
+
+def merge_batch(batch_size=MERGE_BATCH_SIZE):
+    """
+    Fold up to batch_size staged prices into their sketches. Returns the number merged.
+    """
+    with transaction.atomic():
+        # Concurrent merges take disjoint batches where the database can skip locked rows
+        observations = list(
+            PriceObservation.objects.select_for_update(skip_locked=True).order_by('pk')
+            .values_list('pk', 'sub_service_id', 'kind', 'price')[:batch_size]
+        )
+        if not observations:
+            return 0
+
+        prices = defaultdict(list)
+        for _, sub_service_id, kind, price in observations:
+            prices[sub_service_id, kind].append(price)
+        sub_service_ids = sorted({sub_service_id for sub_service_id, _ in prices})
+        # Serializes with rebuild_price_sketches(), which locks every sub-service
+        list(SubService.objects.select_for_update().filter(pk__in=sub_service_ids).order_by('pk').values_list('pk'))
+
+        # Insert-or-ignore keeps the query count fixed whether or not the sketches exist yet
+        PriceSketch.objects.bulk_create([
+            PriceSketch(sub_service_id=sub_service_id, kind=kind) for sub_service_id, kind in prices
+        ], ignore_conflicts=True)
+        sketches = list(PriceSketch.objects.select_for_update().filter(sub_service_id__in=sub_service_ids))
+        updated_at = timezone.now()
+        changed = []
+        for sketch in sketches:
+            new_prices = prices.get((sketch.sub_service_id, sketch.kind))
+            if new_prices:
+                add_prices(sketch.buckets, new_prices)
+                sketch.count += len(new_prices)
+                sketch.updated_at = updated_at
+                changed.append(sketch)
+        PriceSketch.objects.bulk_update(changed, ['buckets', 'count', 'updated_at'])
+        PriceObservation.objects.filter(pk__in=[observation[0] for observation in observations]).delete()
+        for sub_service_id in sub_service_ids:
+            transaction.on_commit(lambda sub_service_id=sub_service_id: invalidate_price_stats(sub_service_id))
+    return len(observations)
+
+
+def merge_price_observations(batch_size=MERGE_BATCH_SIZE):
+    """
+    Merge every staged price, one batch per transaction. Returns the number merged.
+    """
+    merged = 0
+    while count := merge_batch(batch_size):
+        merged += count
+        if count < batch_size:
+            break
+    return merged
+
+
+def get_price_stats(sub_service_id):
+    """
+    p10/p50/p90 and counts of proposed and accepted prices, served from cache.
+    """
+    key = PRICE_STATS_KEY.format(sub_service_id=sub_service_id)
+    stats = cache.get(key)
+    if stats is None:
+        sketches = {sketch.kind: sketch for sketch in PriceSketch.objects.filter(sub_service_id=sub_service_id)}
+        stats = {kind: summarize(sketches.get(kind)) for kind in PriceKind.values}
+        cache.set(key, stats, timeout=PRICE_STATS_TIMEOUT)
+    return stats
+
+
+def rebuild_price_sketches(chunk_size=2000):
+    """
+    Recompute every sketch from the stored proposals and selections.
+    Returns the number of sketches written.
+
+    Prices still staged as observations are left out and left for the next
+    merge, so each one is counted exactly once.
+    """
+    buckets = defaultdict(dict)
+    counts = defaultdict(int)
+    pending = PriceObservation.objects.filter(proposal=OuterRef('pk'))
+    sources = {
+        PriceKind.PROPOSED: Proposal.objects.filter(~Exists(pending.filter(kind=PriceKind.PROPOSED))).values_list(
+            'order__sub_service_id', 'proposed_price'
+        ),
+        PriceKind.ACCEPTED: Order.objects.filter(selected_proposal__isnull=False).filter(~Exists(
+            pending.filter(kind=PriceKind.ACCEPTED).filter(proposal=OuterRef('selected_proposal'))
+        )).values_list('sub_service_id', 'selected_proposal__proposed_price'),
+    }
+
+    with transaction.atomic():
+        # Merges wait until the new sketches are in; sub-services created meanwhile are left to them
+        locked = set(SubService.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+        for kind, rows in sources.items():
+            for sub_service_id, price in rows.iterator(chunk_size=chunk_size):
+                if sub_service_id in locked:
+                    add_prices(buckets[sub_service_id, kind], [price])
+                    counts[sub_service_id, kind] += 1
+
+        stale = set(PriceSketch.objects.filter(sub_service_id__in=locked).values_list('sub_service_id', flat=True))
+        PriceSketch.objects.filter(sub_service_id__in=locked).delete()
+        PriceSketch.objects.bulk_create([
+            PriceSketch(sub_service_id=sub_service_id, kind=kind, count=counts[sub_service_id, kind],
+                        buckets=sketch_buckets)
+            for (sub_service_id, kind), sketch_buckets in buckets.items()
+        ], batch_size=chunk_size)
+        for sub_service_id in stale | {sub_service_id for sub_service_id, _ in buckets}:
+            transaction.on_commit(lambda sub_service_id=sub_service_id: invalidate_price_stats(sub_service_id))
+    return len(buckets)
@@ -0,0 +1,122 @@
+"""
+Vectorized ranking of candidate orders for a specialist.
+
+The candidate columns are fetched in one query and every feature is scored
+in a single NumPy pass: each feature is oriented so that larger is better,
+min-max normalized across the candidates, and combined with the configured
+weights. Only the top k are then sorted, via argpartition.
+
+Features:
+    price_gap  -- suggested_price above the sub-service's base_price, relative to it
+    expiry     -- closing soon (time to visible_until)
+    schedule   -- scheduled soon (time to scheduled_date)
+    proposals  -- few competing proposals
+    distance   -- close to the origin point; only scored when one is given
+"""
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import geo
+
+DEFAULT_WEIGHTS = {
+    'price_gap': 0.35,
+    'expiry': 0.15,
+    'schedule': 0.15,
+    'proposals': 0.15,
+    'distance': 0.2,
+}
+CANDIDATE_COLUMNS = (
+    'pk', 'suggested_price', 'sub_service__base_price', 'visible_until', 'scheduled_date', 'proposal_count',
+    'latitude', 'longitude',
+)
+
+
+def get_weights(overrides=None):
+    weights = {**DEFAULT_WEIGHTS, **getattr(settings, 'ORDER_RANKING_WEIGHTS', {}), **(overrides or {})}
+    unknown = set(weights) - set(DEFAULT_WEIGHTS)
+    if unknown:
+        raise ValueError(f"Unknown ranking features: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def fetch_candidates(queryset):
+    """
+    The candidate columns of queryset as NumPy arrays keyed by feature input.
+    """
+    rows = list(queryset.order_by().values_list(*CANDIDATE_COLUMNS))
+    if not rows:
+        return {column: np.empty(0) for column in CANDIDATE_COLUMNS}
+    columns = dict(zip(CANDIDATE_COLUMNS, zip(*rows)))
+    return {
+        'pk': np.array(columns['pk'], dtype=np.int64),
+        'suggested_price': np.array(columns['suggested_price'], dtype=float),
+        'sub_service__base_price': np.array(columns['sub_service__base_price'], dtype=float),
+        'visible_until': np.array([value.timestamp() for value in columns['visible_until']]),
+        'scheduled_date': np.array([value.timestamp() for value in columns['scheduled_date']]),
+        'proposal_count': np.array(columns['proposal_count'], dtype=float),
+        # Missing coordinates become NaN and score as the farthest
+        'latitude': np.array(columns['latitude'], dtype=float),
+        'longitude': np.array(columns['longitude'], dtype=float),
+    }
+
+
+def normalize(values):
+    """
+    Min-max scale to [0, 1]; constant columns and NaNs score 0.
+    """
+    if not values.size or np.isnan(values).all():
+        return np.zeros_like(values)
+    low, high = np.nanmin(values), np.nanmax(values)
+    span = high - low
+    if span == 0:
+        return np.zeros_like(values)
+    return np.nan_to_num((values - low) / span)
+
+
+def score(candidates, weights, now=None, origin=None):
+    """
+    One score per candidate; higher is better.
+    """
+    now = (now or timezone.now()).timestamp()
+    base_price = candidates['sub_service__base_price']
+    features = {
+        'price_gap': np.divide(candidates['suggested_price'] - base_price, base_price,
+                               out=np.zeros_like(base_price), where=base_price > 0),
+        'expiry': now - candidates['visible_until'],
+        'schedule': now - candidates['scheduled_date'],
+        'proposals': -candidates['proposal_count'],
+    }
+    if origin is not None:
+        latitude, longitude = origin
+        features['distance'] = -geo.haversine_km(
+            float(latitude), float(longitude), candidates['latitude'], candidates['longitude']
+        )
+    names = list(features)
+    matrix = np.vstack([normalize(features[name]) for name in names])
+    return np.array([weights[name] for name in names]) @ matrix
+
+
+def top_k(scores, ids, k):
+    """
+    Indices of the k best scores, best first; ties go to the lower id.
+    """
+    if k <= 0 or not scores.size:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        # Widen the partition to every score tied with the kth so ties break by id
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.lexsort((ids[candidates], -scores[candidates]))][:k]
+
+
+def rank_orders(queryset, k, now=None, origin=None, weights=None):
+    """
+    [(order_id, score), ...] for the k best orders in queryset, best first.
+    """
+    candidates = fetch_candidates(queryset)
+    scores = score(candidates, get_weights(weights), now=now, origin=origin)
+    best = top_k(scores, candidates['pk'], k)
+    return list(zip(candidates['pk'][best].tolist(), scores[best].tolist()))
@@ -0,0 +1,97 @@
+import heapq
+import threading
+
+from django.utils import timezone
+
+from .expiry import expire_orders
+from .models import Order, OrderStatus
+
+
+class ExpiryScheduler:
+    """
+    In-process min-heap of order deadlines that expires orders as soon as
+    their visible_until passes, instead of waiting for the next hourly sweep.
+
+    The heap is kept current by polling: load() picks up new waiting orders
+    by pk, and nothing else feeds it, since orders change state through
+    update() in whichever process handles the request. Entries for orders
+    that have since moved on are left in place; firing goes through
+    expire_orders(), which re-checks every condition in its UPDATE, so a
+    stale entry can never expire the wrong order. Anything the heap misses
+    is still caught by the hourly expire_orders_task sweep.
+
+    Cancelled or rescheduled entries are skipped when popped.
+    """
+
+    def __init__(self, clock=timezone.now, batch_size=100):
+        self.clock = clock
+        self.batch_size = batch_size
+        self.last_seen_pk = 0
+        self._heap = []
+        self._deadlines = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, order_id, deadline):
+        with self._lock:
+            self._deadlines[order_id] = deadline
+            heapq.heappush(self._heap, (deadline, order_id))
+
+    def cancel(self, order_id):
+        with self._lock:
+            self._deadlines.pop(order_id, None)
+
+    def load(self):
+        """
+        Pick up waiting orders created since the last load (all of them on the first call).
+        """
+        orders = Order.objects.filter(
+            status=OrderStatus.WAITING_FOR_PROPOSALS, pk__gt=self.last_seen_pk
+        ).order_by('pk').values_list('pk', 'visible_until')
+        loaded = 0
+        for order_id, visible_until in orders.iterator(chunk_size=2000):
+            self.schedule(order_id, visible_until)
+            self.last_seen_pk = order_id
+            loaded += 1
+        return loaded
+
+    def next_deadline(self):
+        with self._lock:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        due = []
+        with self._lock:
+            while True:
+                self._discard_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                deadline, order_id = heapq.heappop(self._heap)
+                del self._deadlines[order_id]
+                due.append(order_id)
+        return due
+
+    def run_pending(self):
+        """
+        Expire every order whose deadline has passed, batch_size orders per UPDATE.
+        """
+        now = self.clock()
+        due = self.pop_due(now)
+        expired = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            expired += expire_orders(batch_size=len(batch), now=now, order_ids=batch).expired
+        return expired
+
+    def _discard_stale(self):
+        while self._heap:
+            deadline, order_id = self._heap[0]
+            if self._deadlines.get(order_id) == deadline:
+                break
+            heapq.heappop(self._heap)
+
+
+scheduler = ExpiryScheduler()
@@ -0,0 +1,107 @@
+"""
+Full-text search over order descriptions and addresses.
+
+On SQLite the text lives in an FTS5 table kept in sync with orders_order by
+triggers, so bulk inserts and queryset updates are covered as well as
+save(). Other databases fall back to icontains filtering.
+"""
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Order
+
+FTS_TABLE = 'orders_order_fts'
+ORDER_TABLE = Order._meta.db_table
+
+SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(description, address)",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {ORDER_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, address) VALUES (new.id, new.description, new.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF description, address ON {ORDER_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, description, address) VALUES (new.id, new.description, new.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {ORDER_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+
+def fts_enabled(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_index(using='default'):
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def reindex_orders(start_pk=0, end_pk=None, batch_size=10000, using='default'):
+    """
+    Re-copy orders with start_pk < id <= end_pk into the index in batches, returning the number indexed.
+    """
+    if not fts_enabled(using):
+        return 0
+    if end_pk is None:
+        end_pk = Order.objects.using(using).order_by('-pk').values_list('pk', flat=True).first() or 0
+    indexed = 0
+    with connections[using].cursor() as cursor:
+        for low in range(start_pk, end_pk, batch_size):
+            high = min(low + batch_size, end_pk)
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid > %s AND rowid <= %s", [low, high])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, description, address) "
+                f"SELECT id, description, address FROM {ORDER_TABLE} WHERE id > %s AND id <= %s",
+                [low, high],
+            )
+            indexed += cursor.rowcount
+        # Drop index rows whose orders no longer exist past the last batch
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid > %s", [end_pk])
+    return indexed
+
+
+def fts_query(text):
+    # Quote every term so user input can never be parsed as FTS5 query syntax
+    return ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+def matching_order_ids(text, using='default'):
+    """
+    Subquery of the ids of orders whose description or address matches text, for filter(pk__in=...).
+    Empty without the full-text index, since a substring scan is what the index is there to avoid.
+    """
+    if not fts_enabled(using) or not text.split():
+        return Order.objects.none().values('pk')
+    return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [fts_query(text)])
+
+
+def search_orders(queryset, text, limit=20, offset=0):
+    """
+    Search within queryset, returning [(order, rank, snippet)] best match first.
+
+    rank is the bm25 score (lower is better) and snippet highlights matches
+    with [brackets]; both are None on the icontains fallback.
+    """
+    if not text.split():
+        return []
+    using = queryset.db
+    if not fts_enabled(using):
+        orders = queryset.filter(Q(description__icontains=text) | Q(address__icontains=text)).order_by('pk')
+        return [(order, None, None) for order in orders[offset:offset + limit]]
+
+    candidates_sql, candidates_params = queryset.order_by().values('pk').query.sql_with_params()
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}), snippet({FTS_TABLE}, -1, '[', ']', '...', 12) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({candidates_sql}) "
+            f"ORDER BY bm25({FTS_TABLE}), rowid LIMIT %s OFFSET %s",
+            [fts_query(text), *candidates_params, limit, offset],
+        )
+        matches = cursor.fetchall()
+    orders = queryset.model._default_manager.using(using).in_bulk([pk for pk, rank, snippet in matches])
+    return [(orders[pk], rank, snippet) for pk, rank, snippet in matches if pk in orders]
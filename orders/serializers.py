@@ -1,14 +1,32 @@
 from rest_framework import serializers
 from .models import Order, Proposal
 from services.models import MainService, SubService
+from users.models import User
 
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'customer', 'sub_service', 'description', 'suggested_price', 'scheduled_date', 'address',
-                  'status', 'created_at']
-        read_only_fields = ['id', 'customer', 'status', 'created_at']
+                  'status', 'created_at', 'proposal_count', 'min_proposed_price', 'last_proposal_at', 'latitude',
+                  'longitude']
+        read_only_fields = ['id', 'customer', 'status', 'created_at', 'proposal_count', 'min_proposed_price',
+                            'last_proposal_at']
+
+    def validate(self, data):
+        latitude = data.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = data.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("Set both latitude and longitude, or neither.")
+        return data
+
+
+class OrderSearchResultSerializer(OrderSerializer):
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+    snippet = serializers.CharField(source='search_snippet', read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ['rank', 'snippet']
 
 
 class ProposalSerializer(serializers.ModelSerializer):
@@ -18,6 +36,46 @@ class ProposalSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'order', 'specialist', 'created_at']
 
 
+class SpecialistSummarySerializer(serializers.ModelSerializer):
+    profile_picture = serializers.ImageField(source='profile.profile_picture', read_only=True, default=None)
+    bio = serializers.CharField(source='profile.bio', read_only=True, default=None)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_picture', 'bio']
+
+
+class ProposalComparisonSerializer(serializers.ModelSerializer):
+    specialist = SpecialistSummarySerializer(read_only=True)
+    price_rank = serializers.IntegerField(read_only=True)
+    duration_rank = serializers.IntegerField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Proposal
+        fields = ['id', 'specialist', 'proposed_price', 'estimated_duration', 'created_at', 'price_rank',
+                  'duration_rank', 'score']
+
+
+class ProposalStatsSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    median_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+
+
+class PriceQuantilesSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    p10 = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    p50 = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    p90 = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+
+
+class SubServicePriceStatsSerializer(serializers.Serializer):
+    proposed = PriceQuantilesSerializer()
+    accepted = PriceQuantilesSerializer()
+
+
 class SubServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = SubService
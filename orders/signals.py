@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from services.models import MainService, SubService
+from .catalog import bump_catalog_version
+from .events import hub
+from .models import Order
+from .search import create_search_index
+
+
+@receiver([post_save, post_delete], sender=MainService)
+@receiver([post_save, post_delete], sender=SubService)
+def invalidate_catalog(sender, **kwargs):
+    # Bump after commit so a concurrent rebuild can't cache pre-commit data under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: hub.publish_created(instance))
+
+
+@receiver(post_migrate)
+def create_order_search_index(sender, using='default', **kwargs):
+    if sender.label == 'orders':
+        create_search_index(using)
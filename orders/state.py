@@ -0,0 +1,54 @@
+from django.db import transaction
+
+from .models import Order, OrderStatus, OrderTransition
+
+# Target status -> statuses it may be entered from
+ALLOWED_TRANSITIONS = {
+    OrderStatus.WAITING_FOR_SELECTION: {OrderStatus.WAITING_FOR_PROPOSALS},
+    OrderStatus.WAITING_FOR_ARRIVAL: {OrderStatus.WAITING_FOR_PROPOSALS, OrderStatus.WAITING_FOR_SELECTION},
+    OrderStatus.STARTED: {OrderStatus.WAITING_FOR_ARRIVAL},
+    OrderStatus.COMPLETED: {OrderStatus.WAITING_FOR_ARRIVAL, OrderStatus.STARTED},
+    OrderStatus.PAID: {OrderStatus.COMPLETED},
+    OrderStatus.CANCELLED: {
+        OrderStatus.WAITING_FOR_PROPOSALS, OrderStatus.WAITING_FOR_SELECTION, OrderStatus.WAITING_FOR_ARRIVAL,
+    },
+    OrderStatus.EXPIRED: {OrderStatus.WAITING_FOR_PROPOSALS},
+}
+
+
+def can_transition(current, target):
+    return current in ALLOWED_TRANSITIONS[target]
+
+
+def transition(order_id, target, **fields):
+    """
+    Move an order to target status if its current status allows it.
+
+    The check and the write are one conditional UPDATE, so of two concurrent
+    callers exactly one wins; the loser gets False and nothing is written.
+    Extra keyword arguments are written in the same UPDATE.
+    """
+    with transaction.atomic(savepoint=False):
+        won = Order.objects.filter(pk=order_id, status__in=ALLOWED_TRANSITIONS[target]).update(
+            status=target, **fields
+        )
+        if won:
+            OrderTransition.objects.create(order_id=order_id, status=target)
+    return bool(won)
+
+
+def transition_many(order_ids, target, queryset=None):
+    """
+    transition() for a batch: one conditional UPDATE and one INSERT of the log rows.
+
+    queryset narrows the update with the caller's own conditions. Callers
+    lock the rows first (select_for_update), so the orders now in target
+    status are exactly the ones this call moved. Returns their ids.
+    """
+    queryset = Order.objects.all() if queryset is None else queryset
+    with transaction.atomic(savepoint=False):
+        moved = queryset.filter(pk__in=order_ids, status__in=ALLOWED_TRANSITIONS[target]).update(status=target)
+        if moved < len(order_ids):
+            order_ids = list(Order.objects.filter(pk__in=order_ids, status=target).values_list('pk', flat=True))
+        OrderTransition.objects.bulk_create([OrderTransition(order_id=pk, status=target) for pk in order_ids])
+    return order_ids
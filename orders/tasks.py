@@ -0,0 +1,15 @@
+from celery import shared_task
+
+from .expiry import expire_orders
+from .pricing import merge_price_observations
+
+
+@shared_task
+def expire_orders_task(batch_size=1000):
+    result = expire_orders(batch_size=batch_size)
+    return {'expired': result.expired, 'batches': result.batches, 'last_pk': result.last_pk}
+
+
+@shared_task
+def merge_price_observations_task():
+    return merge_price_observations()
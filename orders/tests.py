@@ -1,3 +1,1629 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import timeit
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F, Q, QuerySet
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.test import APIClient
+
+from homeserviceprovider import lookups  # noqa: F401 (registers __prefix)
+from homeserviceprovider.asgi import application
+from homeserviceprovider.instrumentation import QueryInstrumentationMiddleware
+from homeserviceprovider.paginators import EstimatedCountPaginator
+from services.models import MainService, SubService, SpecialistService
+from users.authentication import local_principals
+from users.ledger import COMMISSION_ACCOUNT, apply_entries, reconcile, settle_batch, settle_ledger
+from users.models import LedgerEntry, LedgerEntryKind, PlatformAccount, Profile, Transaction, User, Wallet
+from users.tasks import settle_ledger_task
+from . import geo, pricing, ranking
+from .catalog import CATALOG_VERSION_KEY, bump_catalog_version
+from .checks import check_shared_cache
+from .events import ORDER_CREATED, ORDER_EXPIRED, OrderEventHub, hub
+from .expiry import expire_orders
+from .fast_serializers import FastSerializer
+from .models import Order, OrderStatus, OrderTransition, PriceKind, PriceObservation, PriceSketch, Proposal
+from .scheduler import ExpiryScheduler
+from .renderers import FastJSONRenderer
+from .serializers import OrderSerializer
+from .state import transition, transition_many
+from .tasks import expire_orders_task, merge_price_observations_task
+from .utils import process_payment
+from .views import AsyncAvailableOrdersView, AsyncMainServiceListView, AvailableOrdersView, AvailableOrderStreamView
+
+
+# Wall-clock comparisons are noisy on shared machines, so they only run with RUN_BENCHMARKS set
+benchmark = skipUnless(os.environ.get('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run wall-clock benchmarks')
+
+
+class OrdersTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.main_service = MainService.objects.create(name='Cleaning')
+        cls.sub_service = SubService.objects.create(
+            main_service=cls.main_service, name='Windows', base_price=Decimal('50.00')
+        )
+        cls.other_sub_service = SubService.objects.create(
+            main_service=cls.main_service, name='Carpets', base_price=Decimal('80.00')
+        )
+        cls.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        cls.specialist = User.objects.create_user(username='specialist', password='pass', role='specialist')
+        specialist_service = SpecialistService.objects.create(
+            specialist=cls.specialist, main_service=cls.main_service
+        )
+        specialist_service.sub_service.set([cls.sub_service])
+
+    def create_order(self, sub_service=None, **kwargs):
+        kwargs.setdefault('visible_until', timezone.now() + timedelta(hours=24))
+        kwargs.setdefault('description', 'Clean the windows')
+        kwargs.setdefault('suggested_price', Decimal('60.00'))
+        kwargs.setdefault('scheduled_date', timezone.now() + timedelta(days=2))
+        return Order.objects.create(customer=self.customer, sub_service=sub_service or self.sub_service, **kwargs)
+
+
+class AvailableOrdersViewTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('available-orders')
+
+    def test_lists_only_open_matching_orders(self):
+        visible = self.create_order()
+        self.create_order(sub_service=self.other_sub_service)
+        self.create_order(visible_until=timezone.now() - timedelta(minutes=1))
+        self.create_order(status=OrderStatus.EXPIRED)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in response.data['results']], [visible.id])
+
+    def test_keyset_pagination_walks_every_order_once(self):
+        now = timezone.now()
+        orders = [self.create_order(visible_until=now + timedelta(hours=i % 3 + 1)) for i in range(7)]
+
+        seen = []
+        url = f'{self.url}?page_size=3'
+        while url:
+            response = self.client.get(url)
+            seen.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+
+        expected = sorted(orders, key=lambda order: (order.visible_until, order.id))
+        self.assertEqual(seen, [order.id for order in expected])
+
+    def test_matching_runs_as_single_query(self):
+        for _ in range(5):
+            self.create_order()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(queries), 1)
+
+
+class MainServiceListViewTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.url = reverse('main-service_list')
+
+    def test_catalog_lists_sub_services(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        catalog = json.loads(response.content)
+        self.assertEqual(catalog[0]['name'], 'Cleaning')
+        self.assertEqual({sub['name'] for sub in catalog[0]['sub_services']}, {'Windows', 'Carpets'})
+
+    def test_steady_state_costs_no_queries(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_catalog_changes_invalidate_cache(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubService.objects.create(main_service=self.main_service, name='Gutters', base_price=Decimal('30.00'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Gutters', response.content.decode())
+
+    def test_evicted_version_never_revives_an_old_body(self):
+        etag = self.client.get(self.url)['ETag']
+
+        SubService.objects.filter(pk=self.sub_service.pk).update(name='Skylights')
+        cache.delete(CATALOG_VERSION_KEY)
+
+        self.assertNotEqual(self.client.get(self.url)['ETag'], etag)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['homeserviceprovider.W001'])
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0',
+        }}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class ProcessPaymentTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('100.00'))
+        self.customer_wallet = Wallet.objects.get(user=self.customer)
+        self.specialist_wallet = Wallet.objects.get(user=self.specialist)
+
+    def test_moves_specialist_share_and_records_transactions(self):
+        self.assertTrue(process_payment(self.customer, self.specialist, Decimal('50.00'), 'order-1'))
+
+        self.customer_wallet.refresh_from_db()
+        self.assertEqual(self.customer_wallet.balance, Decimal('50.00'))
+        self.assertEqual(Transaction.objects.filter(idempotency_key='order-1').count(), 1)
+
+        self.assertEqual(settle_ledger(), 2)
+        self.specialist_wallet.refresh_from_db()
+        self.assertEqual(self.specialist_wallet.balance, Decimal('35.00'))
+        self.assertEqual(Transaction.objects.filter(idempotency_key='order-1').count(), 2)
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, Decimal('15.00'))
+
+    def test_insufficient_balance_leaves_wallets_untouched(self):
+        with self.assertRaises(ValueError):
+            process_payment(self.customer, self.specialist, Decimal('150.00'), 'order-1')
+
+        self.customer_wallet.refresh_from_db()
+        self.assertEqual(self.customer_wallet.balance, Decimal('100.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_replayed_idempotency_key_is_a_no_op(self):
+        process_payment(self.customer, self.specialist, Decimal('50.00'), 'order-1')
+
+        self.assertFalse(process_payment(self.customer, self.specialist, Decimal('50.00'), 'order-1'))
+
+        self.customer_wallet.refresh_from_db()
+        self.assertEqual(self.customer_wallet.balance, Decimal('50.00'))
+
+    def test_users_without_a_wallet_get_an_empty_one(self):
+        self.specialist_wallet.delete()
+
+        self.assertTrue(process_payment(self.customer, self.specialist, Decimal('50.00'), 'order-1'))
+        settle_ledger()
+        self.assertEqual(Wallet.objects.get(user=self.specialist).balance, Decimal('35.00'))
+
+        self.customer_wallet.delete()
+        with self.assertRaises(ValueError):
+            process_payment(self.customer, self.specialist, Decimal('50.00'), 'order-2')
+
+
+class ProcessPaymentConcurrencyTests(OrdersTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('100.00'))
+        self.customer_wallet = Wallet.objects.get(user=self.customer)
+        self.specialist_wallet = Wallet.objects.get(user=self.specialist)
+
+    def test_concurrent_payments_never_overdraw(self):
+        attempts = 40
+        outcomes = []
+
+        def pay(worker):
+            barrier.wait()
+            try:
+                for i in range(worker, attempts, 8):
+                    try:
+                        process_payment(self.customer, self.specialist, Decimal('3.00'), f'order-{i}')
+                        outcomes.append(True)
+                    except ValueError:
+                        outcomes.append(False)
+            finally:
+                connections.close_all()
+
+        def settle():
+            # Settlements interleaved with the payments must neither miss nor repeat an entry
+            barrier.wait()
+            try:
+                for _ in range(5):
+                    settle_batch(batch_size=7)
+            finally:
+                connections.close_all()
+
+        barrier = threading.Barrier(9)
+        threads = [threading.Thread(target=pay, args=(worker,)) for worker in range(8)]
+        threads.append(threading.Thread(target=settle))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        settle_ledger()
+
+        paid = outcomes.count(True)
+        self.customer_wallet.refresh_from_db()
+        self.specialist_wallet.refresh_from_db()
+        self.assertEqual(len(outcomes), attempts)
+        self.assertEqual(paid, 33)
+        self.assertEqual(self.customer_wallet.balance, Decimal('100.00') - paid * Decimal('3.00'))
+        self.assertEqual(self.specialist_wallet.balance, paid * Decimal('2.10'))
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, paid * Decimal('0.90'))
+        self.assertEqual(reconcile([self.specialist_wallet.pk]), [])
+
+
+class LedgerSettlementThroughputTests(OrdersTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        self.specialists = [self.specialist] + [
+            User.objects.create_user(username=f'specialist-{i}', password='pass', role='specialist') for i in range(4)
+        ]
+        PlatformAccount.objects.create(name=COMMISSION_ACCOUNT)
+
+    def stage(self, prefix, payments):
+        wallet_ids = list(Wallet.objects.filter(user__in=self.specialists).values_list('pk', flat=True))
+        LedgerEntry.objects.bulk_create([
+            entry
+            for i in range(payments)
+            for entry in (
+                LedgerEntry(kind=LedgerEntryKind.PAYOUT, wallet_id=wallet_ids[i % len(wallet_ids)],
+                            amount=Decimal('7.01'), idempotency_key=f'{prefix}-{i}'),
+                LedgerEntry(kind=LedgerEntryKind.COMMISSION, amount=Decimal('3.00'), idempotency_key=f'{prefix}-{i}'),
+            )
+        ], batch_size=100)
+        return list(LedgerEntry.objects.filter(settled_at__isnull=True).order_by('pk').values_list(
+            'pk', 'kind', 'wallet_id', 'amount', 'idempotency_key'
+        ))
+
+    def settle_both_ways(self, payments):
+        """
+        Settle the given number of payments one committed transaction each, then as many again with
+        settle_ledger(). Returns the payments per second credited by each, per-payment first.
+        """
+        entries = self.stage('hot', payments)
+        started = time.perf_counter()
+        # Each payment staged a payout and a commission
+        for payment in zip(entries[::2], entries[1::2]):
+            with transaction.atomic():
+                apply_entries(payment, timezone.now())
+        per_payment_rate = payments / (time.perf_counter() - started)
+
+        self.stage('batched', payments)
+        started = time.perf_counter()
+        self.assertEqual(settle_ledger(), payments * 2)
+        batched_rate = payments / (time.perf_counter() - started)
+
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, payments * 2 * Decimal('3.00'))
+        self.assertEqual(set(Wallet.objects.filter(user__in=self.specialists).values_list('balance', flat=True)),
+                         {payments * 2 // len(self.specialists) * Decimal('7.01')})
+        return per_payment_rate, batched_rate
+
+    def test_both_ways_credit_the_same_balances(self):
+        self.settle_both_ways(20)
+
+    @benchmark
+    def test_batched_settlement_outpaces_per_payment_updates(self):
+        # Batched settlement measures about 30x per-payment hot-row updates on SQLite; 5x is the floor
+        per_payment_rate, batched_rate = self.settle_both_ways(1000)
+
+        self.assertGreater(batched_rate, per_payment_rate * 5,
+                           f'batched {batched_rate:.0f} payments/s vs per-payment {per_payment_rate:.0f} payments/s')
+
+
+class LedgerSettlementTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('100000.00'))
+        self.specialists = [self.specialist] + [
+            User.objects.create_user(username=f'specialist-{i}', password='pass', role='specialist') for i in range(4)
+        ]
+
+    def pay(self, count, amount=Decimal('10.01')):
+        for i in range(count):
+            process_payment(self.customer, self.specialists[i % len(self.specialists)], amount,
+                            f'order-{Transaction.objects.count()}')
+
+    def test_entries_balance_every_debit(self):
+        self.pay(3)
+
+        self.assertEqual(LedgerEntry.objects.filter(kind=LedgerEntryKind.PAYOUT).count(), 3)
+        debits = Transaction.objects.filter(amount__lt=0).values_list('amount', flat=True)
+        self.assertEqual(sum(LedgerEntry.objects.values_list('amount', flat=True)), -sum(debits))
+        # 70% of 10.01 rounds to 7.01, leaving 3.00 of commission
+        self.assertEqual(set(LedgerEntry.objects.filter(kind=LedgerEntryKind.COMMISSION)
+                             .values_list('amount', flat=True)), {Decimal('3.00')})
+
+    def test_settlement_is_batched_and_applied_once(self):
+        self.pay(10)
+
+        self.assertEqual(settle_ledger_task(), 20)
+        self.assertEqual(settle_ledger(), 0)
+        self.assertFalse(LedgerEntry.objects.filter(settled_at__isnull=True).exists())
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, Decimal('30.00'))
+        self.assertEqual(Wallet.objects.get(user=self.specialist).balance, Decimal('14.02'))
+        # The customer's opening balance was set directly, so only the specialists' wallets reconcile
+        self.assertEqual(reconcile(list(Wallet.objects.exclude(user=self.customer).values_list('pk', flat=True))), [])
+
+    def test_settlement_queries_do_not_grow_with_payments(self):
+        # The platform account and the specialists' wallets are written once per batch, not once per payment.
+        # 150 payouts still fit one SQLite INSERT; larger batches split by parameter count only
+        PlatformAccount.objects.create(name=COMMISSION_ACCOUNT)
+        budgets = []
+        for count in (5, 150):
+            self.pay(count)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(settle_batch(batch_size=1000), count * 2)
+            budgets.append(len(queries))
+            self.assertEqual(sum('"users_platformaccount"' in query['sql'] for query in queries), 1)
+
+        self.assertEqual(budgets[0], budgets[1])
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, Decimal('465.00'))
+
+    def test_failing_entry_is_set_aside(self):
+        self.pay(5)
+        payout = LedgerEntry.objects.filter(kind=LedgerEntryKind.PAYOUT).order_by('pk')[2]
+        # A payout whose earnings were already recorded by hand can't be inserted again
+        Transaction.objects.create(wallet_id=payout.wallet_id, amount=payout.amount, description="Manual payout",
+                                   idempotency_key=payout.idempotency_key)
+
+        self.assertEqual(settle_ledger(batch_size=4), 10)
+        self.assertEqual(settle_ledger(), 0)
+
+        self.assertEqual(list(LedgerEntry.objects.filter(failed_at__isnull=False)), [payout])
+        self.assertEqual(LedgerEntry.objects.filter(settled_at__isnull=False).count(), 9)
+        self.assertEqual(PlatformAccount.objects.get(name=COMMISSION_ACCOUNT).balance, Decimal('15.00'))
+        self.assertEqual(Transaction.objects.filter(description="Earnings from service").count(), 4)
+
+
+class ExpireOrdersTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        past = timezone.now() - timedelta(minutes=5)
+        self.stale = [self.create_order(visible_until=past) for _ in range(5)]
+        self.with_proposal = self.create_order(visible_until=past)
+        Proposal.objects.create(
+            order=self.with_proposal, specialist=self.specialist,
+            proposed_price=Decimal('55.00'), estimated_duration=timedelta(hours=2)
+        )
+        self.open = self.create_order()
+
+    def assertExpired(self, orders, expired=True):
+        statuses = set(Order.objects.filter(pk__in=[order.pk for order in orders]).values_list('status', flat=True))
+        self.assertEqual(statuses, {OrderStatus.EXPIRED if expired else OrderStatus.WAITING_FOR_PROPOSALS})
+
+    def test_expires_stale_orders_in_batches(self):
+        result = expire_orders(batch_size=2)
+
+        self.assertEqual(result.expired, 5)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(result.last_pk, self.stale[-1].pk)
+        self.assertExpired(self.stale)
+        self.assertExpired([self.with_proposal, self.open], expired=False)
+        self.assertEqual(
+            sorted(OrderTransition.objects.filter(status=OrderStatus.EXPIRED).values_list('order_id', flat=True)),
+            [order.pk for order in self.stale],
+        )
+
+    def test_race_in_a_full_batch_does_not_end_the_run(self):
+        past = timezone.now() - timedelta(minutes=5)
+        self.stale += [self.create_order(visible_until=past) for _ in range(5)]
+        raced = self.stale[1]
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # A proposal lands between the batch being read and expired
+            if not Proposal.objects.filter(order=raced).exists():
+                Proposal.objects.create(order=raced, specialist=self.specialist, proposed_price=Decimal('55.00'),
+                                        estimated_duration=timedelta(hours=2))
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            result = expire_orders(batch_size=5)
+
+        self.assertEqual(result.expired, 9)
+        self.assertEqual(result.batches, 2)
+        self.assertExpired([order for order in self.stale if order != raced])
+        self.assertExpired([raced], expired=False)
+        self.assertFalse(OrderTransition.objects.filter(order=raced).exists())
+        self.assertEqual(OrderTransition.objects.filter(status=OrderStatus.EXPIRED).count(), 9)
+
+    def test_resumes_after_last_pk(self):
+        result = expire_orders(batch_size=2, start_pk=self.stale[2].pk)
+
+        self.assertEqual(result.expired, 2)
+        self.assertExpired(self.stale[3:])
+        self.assertExpired(self.stale[:3], expired=False)
+
+    def test_command_reports_throughput(self):
+        out = StringIO()
+        call_command('expire_orders', '--batch-size=3', stdout=out)
+
+        self.assertIn('Expired 5 orders', out.getvalue())
+        self.assertIn('orders/s', out.getvalue())
+
+    def test_celery_task_runs_eagerly(self):
+        result = expire_orders_task.apply(kwargs={'batch_size': 2}).get()
+
+        self.assertEqual(result['expired'], 5)
+        self.assertExpired(self.stale)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+
+class ExpirySchedulerTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.clock = FakeClock(timezone.now())
+        self.scheduler = ExpiryScheduler(clock=self.clock, batch_size=2)
+
+    def test_fires_only_orders_past_their_deadline(self):
+        soon = [self.create_order(visible_until=self.clock.now + timedelta(seconds=30)) for _ in range(3)]
+        later = self.create_order(visible_until=self.clock.now + timedelta(hours=1))
+        self.assertEqual(self.scheduler.load(), 4)
+
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.clock.advance(seconds=31)
+
+        self.assertEqual(self.scheduler.run_pending(), 3)
+        self.assertEqual(
+            set(Order.objects.filter(status=OrderStatus.EXPIRED).values_list('pk', flat=True)),
+            {order.pk for order in soon}
+        )
+        self.assertEqual(self.scheduler.next_deadline(), later.visible_until)
+
+    def test_cancelled_and_rescheduled_orders_are_skipped(self):
+        cancelled = self.create_order(visible_until=self.clock.now + timedelta(seconds=10))
+        moved = self.create_order(visible_until=self.clock.now + timedelta(seconds=10))
+        self.scheduler.load()
+
+        self.scheduler.cancel(cancelled.pk)
+        self.scheduler.schedule(moved.pk, self.clock.now + timedelta(minutes=10))
+        self.clock.advance(seconds=11)
+
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_load_only_picks_up_new_orders(self):
+        self.create_order()
+        self.scheduler.load()
+        self.create_order()
+
+        self.assertEqual(self.scheduler.load(), 1)
+        self.assertEqual(len(self.scheduler), 2)
+
+    def test_orders_moved_on_after_loading_are_not_expired(self):
+        order = self.create_order(visible_until=self.clock.now + timedelta(seconds=5))
+        self.scheduler.load()
+        transition(order.pk, OrderStatus.WAITING_FOR_SELECTION)
+        self.clock.advance(seconds=6)
+
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, OrderStatus.WAITING_FOR_SELECTION)
+        self.assertIsNone(self.scheduler.next_deadline())
+
+
+class OrderStateTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.order = self.create_order()
+        self.proposal = Proposal.objects.create(
+            order=self.order, specialist=self.specialist,
+            proposed_price=Decimal('55.00'), estimated_duration=timedelta(hours=2)
+        )
+
+    def test_transition_applies_once(self):
+        self.assertTrue(transition(self.order.pk, OrderStatus.WAITING_FOR_SELECTION))
+        self.assertFalse(transition(self.order.pk, OrderStatus.WAITING_FOR_SELECTION))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, OrderStatus.WAITING_FOR_SELECTION)
+        self.assertEqual(
+            list(OrderTransition.objects.values_list('status', flat=True)), [OrderStatus.WAITING_FOR_SELECTION]
+        )
+
+    def test_transition_many_enforces_allowed_transitions(self):
+        waiting = self.create_order()
+        transition(self.order.pk, OrderStatus.WAITING_FOR_SELECTION)
+
+        moved = transition_many([self.order.pk, waiting.pk], OrderStatus.EXPIRED)
+
+        self.assertEqual(moved, [waiting.pk])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, OrderStatus.WAITING_FOR_SELECTION)
+        self.assertEqual(list(OrderTransition.objects.filter(status=OrderStatus.EXPIRED).values_list(
+            'order_id', flat=True)), [waiting.pk])
+
+    def test_select_proposal_wins_only_once(self):
+        url = reverse('select-proposal', args=[self.order.pk])
+
+        first = self.client.put(url, {'proposal_id': self.proposal.pk})
+        second = self.client.put(url, {'proposal_id': self.proposal.pk})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 409)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.selected_proposal, self.proposal)
+        self.assertEqual(self.order.status, OrderStatus.WAITING_FOR_ARRIVAL)
+
+    def test_select_proposal_from_another_order_is_rejected(self):
+        other = self.create_order()
+        response = self.client.put(reverse('select-proposal', args=[other.pk]), {'proposal_id': self.proposal.pk})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_complete_pays_once(self):
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('100.00'))
+        transition(self.order.pk, OrderStatus.WAITING_FOR_ARRIVAL, selected_proposal=self.proposal)
+        url = reverse('complete-order', args=[self.order.pk])
+
+        first = self.client.put(url)
+        second = self.client.put(url)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, OrderStatus.PAID)
+        self.assertEqual(Wallet.objects.get(user=self.customer).balance, Decimal('40.00'))
+
+    def test_failed_payment_rolls_back_completion(self):
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('10.00'))
+        transition(self.order.pk, OrderStatus.WAITING_FOR_ARRIVAL, selected_proposal=self.proposal)
+
+        response = self.client.put(reverse('complete-order', args=[self.order.pk]))
+
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, OrderStatus.WAITING_FOR_ARRIVAL)
+
+    def test_customer_without_a_wallet_cannot_pay(self):
+        Wallet.objects.filter(user=self.customer).delete()
+        transition(self.order.pk, OrderStatus.WAITING_FOR_ARRIVAL, selected_proposal=self.proposal)
+
+        response = self.client.put(reverse('complete-order', args=[self.order.pk]))
+
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, OrderStatus.WAITING_FOR_ARRIVAL)
+
+
+class ProposalCreateViewTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('create_proposal')
+        self.order = self.create_order()
+
+    def propose(self, order, price):
+        return self.client.post(self.url, {'order': order.pk, 'proposed_price': price, 'estimated_duration': '02:00:00'})
+
+    def test_proposals_maintain_order_counters(self):
+        self.assertEqual(self.propose(self.order, '70.00').status_code, 201)
+        self.assertEqual(self.propose(self.order, '65.00').status_code, 201)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.proposal_count, 2)
+        self.assertEqual(self.order.min_proposed_price, Decimal('65.00'))
+        self.assertEqual(self.order.last_proposal_at, Proposal.objects.latest('created_at').created_at)
+        self.assertEqual(self.order.status, OrderStatus.WAITING_FOR_SELECTION)
+
+    def test_rejects_orders_outside_specialist_sub_services(self):
+        order = self.create_order(sub_service=self.other_sub_service)
+
+        self.assertEqual(self.propose(order, '70.00').status_code, 403)
+        self.assertFalse(Proposal.objects.exists())
+
+    def test_missing_order_is_not_found(self):
+        response = self.client.post(self.url, {'order': 0, 'proposed_price': '70.00', 'estimated_duration': '02:00:00'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_is_fixed(self):
+        # Authorize, insert proposal, update counters, stage the price,
+        # transition status and log it, plus a savepoint pair
+        with self.assertNumQueries(8):
+            self.propose(self.order, '70.00')
+        # Later proposals skip the status transition
+        with self.assertNumQueries(6):
+            self.propose(self.order, '60.00')
+
+
+class OrderProposalListViewTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.order = self.create_order()
+        self.url = reverse('order-proposals', args=[self.order.pk])
+
+    def add_proposals(self, prices_and_hours):
+        specialists = User.objects.bulk_create([
+            User(username=f'proposer-{self.order.pk}-{i}', role='specialist') for i in range(len(prices_and_hours))
+        ])
+        Profile.objects.bulk_create([Profile(user=specialist, bio='Experienced') for specialist in specialists])
+        return Proposal.objects.bulk_create([
+            Proposal(order=self.order, specialist=specialist, proposed_price=Decimal(price),
+                     estimated_duration=timedelta(hours=hours))
+            for specialist, (price, hours) in zip(specialists, prices_and_hours)
+        ])
+
+    def test_ranks_by_price_duration_and_score(self):
+        cheap_slow, pricey_fast, balanced = self.add_proposals([('40.00', 8), ('90.00', 1), ('50.00', 2)])
+
+        by_price = self.client.get(self.url, {'ordering': 'price'}).data['results']
+        by_duration = self.client.get(self.url, {'ordering': 'duration'}).data['results']
+        by_score = self.client.get(self.url).data['results']
+
+        self.assertEqual([p['id'] for p in by_price], [cheap_slow.pk, balanced.pk, pricey_fast.pk])
+        self.assertEqual([p['id'] for p in by_duration], [pricey_fast.pk, balanced.pk, cheap_slow.pk])
+        # Weighted 0.7 * price rank + 0.3 * duration rank
+        self.assertEqual([p['id'] for p in by_score], [cheap_slow.pk, balanced.pk, pricey_fast.pk])
+        self.assertAlmostEqual(by_score[0]['score'], 1.6)
+        self.assertEqual(by_score[0]['specialist']['bio'], 'Experienced')
+
+    def test_stats_cover_all_proposals(self):
+        self.add_proposals([('40.00', 1), ('90.00', 1), ('50.00', 1), ('60.00', 1)])
+
+        stats = self.client.get(self.url, {'page_size': 1}).data['stats']
+
+        self.assertEqual(stats, {'count': 4, 'min_price': '40.00', 'median_price': '55.00', 'max_price': '90.00'})
+
+    def test_other_customers_cannot_see_proposals(self):
+        other = User.objects.create_user(username='other', password='pass', role='customer')
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_query_budget_does_not_grow_with_proposals(self):
+        self.add_proposals([(f'{40 + i % 50}.00', 1 + i % 7) for i in range(2000)])
+
+        # Order lookup, page count, page rows, price aggregate, median
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {'page_size': 100})
+
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertEqual(response.data['stats']['count'], 2000)
+
+
+class FastSerializationTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('available-orders')
+        self.create_order(description='Line\u2028separator and ünïcode "quotes"', address=None)
+        order = self.create_order(address='12 Main St', suggested_price=Decimal('7.5'))
+        Order.objects.record_proposal(order.pk, Decimal('42.10'), timezone.now())
+
+    def get_both(self, path):
+        fast = self.client.get(path)
+        # The slow path is the stock ModelSerializer and DRF renderer
+        with self.settings(FAST_LIST_SERIALIZATION=False), \
+                mock.patch.object(AvailableOrdersView, 'renderer_classes', [JSONRenderer, BrowsableAPIRenderer]):
+            slow = self.client.get(path)
+        return fast, slow
+
+    def test_fast_payload_is_byte_identical(self):
+        fast, slow = self.get_both(f'{self.url}?page_size=1')
+
+        self.assertEqual(fast.content, slow.content)
+        next_fast, next_slow = self.get_both(json.loads(fast.content)['next'])
+        self.assertEqual(next_fast.content, next_slow.content)
+
+    def test_renderer_matches_stock_renderer(self):
+        moment = timezone.now().replace(microsecond=123456)
+        data = {
+            'created_at': moment, 'day': moment.date(), 'time': moment.time(), 'naive': moment.replace(tzinfo=None),
+            'price': Decimal('7.50'), 'duration': timedelta(hours=1, minutes=5), 'id': uuid.UUID(int=7),
+            1: 'int key', None: 'null key', True: 'bool key', 'text': 'ünïcode \u2028 "quoted"',
+            'nested': [{2: moment}, (1, 2.5)],
+        }
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_fast_serializer_matches_model_serializer(self):
+        rows = Order.objects.order_by('pk').values(*FastSerializer(OrderSerializer).columns)
+        orders = Order.objects.order_by('pk')
+
+        self.assertEqual(
+            FastSerializer(OrderSerializer).serialize(rows),
+            [dict(data) for data in OrderSerializer(orders, many=True).data]
+        )
+
+    @benchmark
+    def test_fast_path_outpaces_model_serializer(self):
+        # Rows per second serialized and rendered by each list path over the same orders, database reads
+        # excluded. The fast path measures about 3x the ModelSerializer path; 1.5x is the floor.
+        now = timezone.now()
+        Order.objects.bulk_create([
+            Order(customer=self.customer, sub_service=self.sub_service, description=f'Order {i}',
+                  suggested_price=Decimal('60.00') + i % 40, scheduled_date=now + timedelta(days=1),
+                  visible_until=now + timedelta(hours=1), latitude=Decimal('35.700000'),
+                  longitude=Decimal('51.400000'))
+            for i in range(2000)
+        ])
+        fast = FastSerializer(OrderSerializer)
+        rows = list(fast.values(Order.objects.order_by('pk')))
+        orders = list(Order.objects.order_by('pk'))
+
+        def rows_per_second(serialize_and_render):
+            best = min(timeit.repeat(serialize_and_render, number=1, repeat=3))
+            return len(orders) / best
+
+        model_rate = rows_per_second(lambda: JSONRenderer().render(OrderSerializer(orders, many=True).data))
+        fast_rate = rows_per_second(lambda: FastJSONRenderer().render(fast.serialize(rows)))
+
+        self.assertGreater(fast_rate, model_rate * 1.5,
+                           f'fast path {fast_rate:.0f} rows/s vs ModelSerializer {model_rate:.0f} rows/s')
+
+
+def seed_marketplace(size, customer):
+    """
+    Seed size main services with three sub-services each, size specialists
+    covering them and size * 5 open orders spread across the sub-services.
+    """
+    tag = next(SEED_COUNTER)
+    main_services = MainService.objects.bulk_create([MainService(name=f'Main {tag}-{i}') for i in range(size)])
+    sub_services = SubService.objects.bulk_create([
+        SubService(main_service=main_service, name=f'Sub {j}', base_price=Decimal('40.00') + j)
+        for main_service in main_services for j in range(3)
+    ])
+    specialists = User.objects.bulk_create([
+        User(username=f'specialist-{tag}-{i}', role='specialist', status='approved') for i in range(size)
+    ])
+    Profile.objects.bulk_create([Profile(user=specialist) for specialist in specialists])
+    Wallet.objects.bulk_create([Wallet(user=specialist) for specialist in specialists])
+    specialist_services = SpecialistService.objects.bulk_create([
+        SpecialistService(specialist=specialist, main_service=main_service)
+        for specialist, main_service in zip(specialists, main_services)
+    ])
+    through = SpecialistService.sub_service.through
+    through.objects.bulk_create([
+        through(specialistservice_id=specialist_service.pk, subservice_id=sub_service.pk)
+        for specialist_service, main_service in zip(specialist_services, main_services)
+        for sub_service in sub_services if sub_service.main_service_id == main_service.pk
+    ])
+    now = timezone.now()
+    orders = Order.objects.bulk_create([
+        Order(customer=customer, sub_service=sub_services[i % len(sub_services)], description=f'Job {i}',
+              suggested_price=Decimal('60.00'), scheduled_date=now + timedelta(days=1),
+              visible_until=now + timedelta(hours=1 + i % 12))
+        for i in range(size * 5)
+    ])
+    return {'sub_services': sub_services, 'specialists': specialists, 'orders': orders}
+
+
+SEED_COUNTER = itertools.count()
+
+
+class QueryBudgetTests(OrdersTestMixin, TestCase):
+    """
+    Pins each endpoint's query count and a generous wall-clock ceiling at
+    several data sizes, and checks the count does not grow with the data.
+
+    Set QUERY_BUDGET_REPORT to a file path to write the measurements as JSON
+    for diffing between releases.
+    """
+    sizes = (5, 50, 200)
+    report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        path = os.environ.get('QUERY_BUDGET_REPORT')
+        if path:
+            with open(path, 'w') as f:
+                json.dump(sorted(cls.report, key=lambda row: (row['endpoint'], row['size'])), f, indent=2)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('1000000.00'))
+
+    def measure(self, endpoint, size, budget, request, ceiling=2.0):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = request()
+            elapsed = time.perf_counter() - started
+        self.report.append({
+            'endpoint': endpoint, 'size': size, 'queries': len(queries), 'budget': budget,
+            'seconds': round(elapsed, 4),
+        })
+        self.assertLess(response.status_code, 300, response.content)
+        self.assertEqual(len(queries), budget, f'{endpoint} at size {size}')
+        self.assertLess(elapsed, ceiling, f'{endpoint} at size {size}')
+        return response
+
+    def for_each_size(self, check):
+        seeded = 0
+        for size in self.sizes:
+            data = seed_marketplace(size - seeded, self.customer)
+            seeded = size
+            with self.subTest(size=size):
+                check(size, data)
+
+    def test_available_orders(self):
+        def check(size, data):
+            specialist = data['specialists'][0]
+            self.client.force_authenticate(specialist)
+            self.measure('available-orders', size, 1, lambda: self.client.get(reverse('available-orders')))
+
+        self.for_each_size(check)
+
+    def test_service_catalog(self):
+        def check(size, data):
+            self.client.force_authenticate(self.customer)
+            bump_catalog_version()
+            # Cold: main services plus prefetched sub-services; warm: served from cache
+            self.measure('main-service_list:cold', size, 2, lambda: self.client.get(reverse('main-service_list')))
+            self.measure('main-service_list:warm', size, 0, lambda: self.client.get(reverse('main-service_list')))
+
+        self.for_each_size(check)
+
+    def test_proposal_create(self):
+        def check(size, data):
+            order = self.create_order()
+            self.client.force_authenticate(self.specialist)
+            self.measure('create_proposal', size, 8, lambda: self.client.post(reverse('create_proposal'), {
+                'order': order.pk, 'proposed_price': '55.00', 'estimated_duration': '01:00:00'
+            }))
+
+        self.for_each_size(check)
+
+    def test_order_proposals(self):
+        def check(size, data):
+            order = self.create_order()
+            Proposal.objects.bulk_create([
+                Proposal(order=order, specialist=specialist, proposed_price=Decimal('50.00') + i,
+                         estimated_duration=timedelta(hours=1 + i % 5))
+                for i, specialist in enumerate(data['specialists'])
+            ])
+            self.client.force_authenticate(self.customer)
+            self.measure('order-proposals', size, 5,
+                         lambda: self.client.get(reverse('order-proposals', args=[order.pk])))
+
+        self.for_each_size(check)
+
+    def test_select_and_pay(self):
+        def check(size, data):
+            order = self.create_order()
+            proposal = Proposal.objects.create(order=order, specialist=self.specialist,
+                                               proposed_price=Decimal('55.00'), estimated_duration=timedelta(hours=1))
+            self.client.force_authenticate(self.customer)
+            # Load, transition, log, stage the accepted price and a savepoint pair
+            self.measure('select-proposal', size, 7, lambda: self.client.put(
+                reverse('select-proposal', args=[order.pk]), {'proposal_id': proposal.pk}
+            ))
+            # Two transitions, the wallet ledger writes and the savepoints of their nested atomic blocks
+            self.measure('complete-order', size, 15,
+                         lambda: self.client.put(reverse('complete-order', args=[order.pk])))
+
+        self.for_each_size(check)
+
+
+class AdminChangelistTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        admin_user = User.objects.create_superuser(username='admin', password='pass', role='admin')
+        self.client.force_login(admin_user)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for url in (reverse('admin:orders_order_changelist'), reverse('admin:orders_proposal_changelist')):
+            with self.subTest(url=url):
+                self.client.get(url)
+                data = seed_marketplace(2, self.customer)
+                small = self.changelist_queries(url)
+                data = seed_marketplace(20, self.customer)
+                for order in data['orders'][:30]:
+                    Proposal.objects.create(order=order, specialist=data['specialists'][0],
+                                            proposed_price=Decimal('50.00'), estimated_duration=timedelta(hours=1))
+
+                self.assertEqual(self.changelist_queries(url), small)
+
+    def search(self, url_name, term):
+        response = self.client.get(reverse(url_name), {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return [obj.pk for obj in response.context['cl'].result_list]
+
+    def test_search_matches_ids_prefixes_and_descriptions(self):
+        other_customer = User.objects.create_user(username='Customer2', password='pass', role='customer')
+        leak = self.create_order(description='Kitchen sink leak')
+        carpet = self.create_order(sub_service=self.other_sub_service)
+        Order.objects.filter(pk=carpet.pk).update(customer=other_customer)
+        proposal = Proposal.objects.create(order=leak, specialist=self.specialist, proposed_price=Decimal('50.00'),
+                                           estimated_duration=timedelta(hours=1))
+
+        self.assertEqual(self.search('admin:orders_order_changelist', str(leak.pk)), [leak.pk])
+        self.assertEqual(self.search('admin:orders_order_changelist', 'cust'), [leak.pk])
+        # Prefixes are case-sensitive, as the index orders them
+        self.assertEqual(self.search('admin:orders_order_changelist', 'Cust'), [carpet.pk])
+        self.assertEqual(self.search('admin:orders_order_changelist', 'Carp'), [carpet.pk])
+        self.assertEqual(self.search('admin:orders_order_changelist', 'sink'), [leak.pk])
+        self.assertEqual(self.search('admin:orders_proposal_changelist', 'spec'), [proposal.pk])
+        self.assertEqual(self.search('admin:orders_proposal_changelist', str(leak.pk)), [proposal.pk])
+        self.assertEqual(self.search('admin:users_user_changelist', 'Cust'), [other_customer.pk])
+
+    def test_search_and_pages_are_served_by_indexes(self):
+        request = RequestFactory().get('/')
+        searched, _ = admin.site._registry[Order].get_search_results(request, Order.objects.order_by('-id'), 'kit')
+        searches = {
+            'order': searched.explain(),
+            'user': User.objects.filter(Q(username__prefix='kit') | Q(email__prefix='kit')).explain(),
+        }
+        for name, plan in searches.items():
+            with self.subTest(search=name):
+                # SQLite reports a full table walk as a SCAN without an index
+                self.assertNotRegex(plan, r'SCAN (orders_order|users_user)\b(?! USING)')
+        # Pages walk the primary key backwards instead of sorting the table
+        for model in (Order, Proposal):
+            with self.subTest(page=model.__name__):
+                self.assertNotIn('TEMP B-TREE', model.objects.order_by('-id')[:100].explain())
+
+    def test_estimated_count_paginator_uses_table_statistics(self):
+        seed_marketplace(10, self.customer)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator_class = type('SmallThresholdPaginator', (EstimatedCountPaginator,), {'threshold': 0})
+
+        total = Order.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator_class(Order.objects.order_by('pk'), 10).count, total)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        # Filtered changelists are still counted exactly
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator_class(Order.objects.filter(status='paid').order_by('pk'), 10).count, 0)
+
+
+class AvailableOrderSearchTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('available-orders-search')
+        self.leak = self.create_order(description='Kitchen sink leak under the cabinet', address='5 Elm St')
+        self.windows = self.create_order(description='Wash all windows, including the kitchen window')
+        self.other = self.create_order(sub_service=self.other_sub_service, description='Kitchen carpet stain')
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranks_matches_within_available_orders(self):
+        results = self.search('kitchen')['results']
+
+        self.assertEqual({order['id'] for order in results}, {self.leak.pk, self.windows.pk})
+        self.assertLessEqual(results[0]['rank'], results[1]['rank'])
+        self.assertIn('[kitchen]', results[0]['snippet'].lower())
+
+    def test_index_follows_updates_and_deletes(self):
+        Order.objects.filter(pk=self.leak.pk).update(description='Replace the bathroom faucet')
+        self.windows.delete()
+
+        self.assertEqual(self.search('kitchen')['results'], [])
+        self.assertEqual([order['id'] for order in self.search('faucet')['results']], [self.leak.pk])
+
+    def test_query_syntax_is_escaped_and_paginated(self):
+        self.assertEqual(self.search('"kitchen OR NEAR(')['results'], [])
+
+        first = self.search('kitchen', limit=1)
+        self.assertEqual(len(first['results']), 1)
+        self.assertIn('offset=1', first['next'])
+
+    def test_rebuild_command_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM orders_order_fts')
+
+        call_command('rebuild_order_search_index', '--batch-size=1', stdout=StringIO())
+
+        self.assertEqual(len(self.search('kitchen')['results']), 2)
+
+    def test_icontains_fallback(self):
+        with mock.patch('orders.search.fts_enabled', return_value=False):
+            results = self.search('sink')['results']
+
+        self.assertEqual([order['id'] for order in results], [self.leak.pk])
+        self.assertIsNone(results[0]['snippet'])
+
+
+class GeoMatchingTests(OrdersTestMixin, TestCase):
+    # Tehran, with points roughly 3 km, 8 km and 40 km away
+    centre = (Decimal('35.700000'), Decimal('51.400000'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('available-orders')
+        self.near = self.create_order(latitude=Decimal('35.720000'), longitude=Decimal('51.420000'))
+        self.mid = self.create_order(latitude=Decimal('35.760000'), longitude=Decimal('51.440000'))
+        self.far = self.create_order(latitude=Decimal('35.900000'), longitude=Decimal('51.750000'))
+        self.unlocated = self.create_order()
+
+    def ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return {order['id'] for order in response.data['results']}
+
+    def test_encode_matches_reference_geohash(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(self.near.geo_cell, geo.encode(35.72, 51.42))
+        self.assertIsNone(self.unlocated.geo_cell)
+
+    def test_covering_cells_contain_every_point_in_radius(self):
+        latitude, longitude, radius_km = 35.7, 51.4, 10
+        cells = geo.covering_cells(latitude, longitude, radius_km)
+        for bearing in range(0, 360, 15):
+            for fraction in (0.5, 0.99):
+                offset = radius_km * fraction / geo.KM_PER_DEGREE
+                point_lat = latitude + offset * math.cos(math.radians(bearing))
+                point_lon = longitude + offset * math.sin(math.radians(bearing)) / math.cos(math.radians(latitude))
+                self.assertTrue(any(geo.encode(point_lat, point_lon).startswith(cell) for cell in cells))
+
+    def test_within_radius_uses_exact_distance(self):
+        orders = Order.objects.within_radius(*self.centre, 5)
+
+        self.assertEqual(set(orders.values_list('pk', flat=True)), {self.near.pk})
+        self.assertEqual(set(Order.objects.within_radius(*self.centre, 15).values_list('pk', flat=True)),
+                         {self.near.pk, self.mid.pk})
+
+    def test_view_filters_by_point_or_service_location(self):
+        self.assertEqual(self.ids(), {self.near.pk, self.mid.pk, self.far.pk, self.unlocated.pk})
+        self.assertEqual(self.ids(lat='35.7', lon='51.4', radius_km='15'), {self.near.pk, self.mid.pk})
+
+        SpecialistService.objects.filter(specialist=self.specialist).update(
+            latitude=Decimal('35.900000'), longitude=Decimal('51.750000')
+        )
+        self.assertEqual(self.ids(radius_km='5'), {self.far.pk})
+
+    def test_view_rejects_missing_or_invalid_location(self):
+        self.assertEqual(self.client.get(self.url, {'radius_km': '5'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'lat': '95', 'lon': '51.4', 'radius_km': '5'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'lat': 'x', 'lon': '51.4', 'radius_km': '5'}).status_code, 400)
+
+    def test_bulk_writes_keep_geo_cell_in_sync(self):
+        [bulk] = Order.objects.bulk_create([Order(
+            customer=self.customer, sub_service=self.sub_service, description='Bulk', suggested_price=Decimal('60.00'),
+            scheduled_date=timezone.now() + timedelta(days=1), visible_until=timezone.now() + timedelta(hours=1),
+            latitude=Decimal('35.720000'), longitude=Decimal('51.420000'),
+        )])
+        Order.objects.filter(pk=self.far.pk).update(latitude=Decimal('35.710000'), longitude=Decimal('51.410000'))
+        self.mid.latitude, self.mid.longitude = None, None
+        Order.objects.bulk_update([self.mid], ['latitude', 'longitude'])
+
+        self.assertEqual(set(Order.objects.within_radius(*self.centre, 5).values_list('pk', flat=True)),
+                         {self.near.pk, self.far.pk, bulk.pk})
+        self.assertIsNone(Order.objects.get(pk=self.mid.pk).geo_cell)
+
+    def test_location_must_be_complete(self):
+        with self.assertRaises(ValueError):
+            Order.objects.filter(pk=self.near.pk).update(latitude=Decimal('35.0'))
+        with self.assertRaises(ValueError):
+            Order.objects.filter(pk=self.near.pk).update(latitude=F('longitude'), longitude=F('latitude'))
+        with self.assertRaises(ValidationError):
+            Order(latitude=Decimal('35.0')).clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_order(latitude=Decimal('35.0'))
+
+        self.client.force_authenticate(self.customer)
+        response = self.client.post(reverse('create_order'), {
+            'sub_service': self.sub_service.pk, 'description': 'Clean', 'suggested_price': '60.00',
+            'scheduled_date': (timezone.now() + timedelta(days=1)).isoformat(), 'latitude': '35.7',
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderRankingTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        self.visible_until = timezone.now() + timedelta(hours=24)
+        self.client = APIClient()
+        self.client.force_authenticate(self.specialist)
+        self.url = reverse('available-orders')
+
+    def create_order(self, sub_service=None, **kwargs):
+        # Identical deadlines, so only price and competition separate the orders
+        kwargs.setdefault('visible_until', self.visible_until)
+        kwargs.setdefault('scheduled_date', self.visible_until + timedelta(days=1))
+        return super().create_order(sub_service, **kwargs)
+
+    def test_score_matches_per_order_reference(self):
+        now = timezone.now()
+        for i in range(20):
+            self.create_order(
+                suggested_price=Decimal(40 + i * 7 % 30), proposal_count=i % 4,
+                visible_until=now + timedelta(hours=1 + i * 5 % 11),
+                scheduled_date=now + timedelta(days=1 + i % 6),
+                latitude=Decimal('35.7') + Decimal(i % 5) / 100, longitude=Decimal('51.4'),
+            )
+        weights = ranking.get_weights()
+        candidates = ranking.fetch_candidates(Order.objects.all())
+
+        scores = ranking.score(candidates, weights, now=now, origin=(35.7, 51.4))
+
+        def reference(order, orders):
+            def scaled(key):
+                values = [key(other) for other in orders]
+                low, high = min(values), max(values)
+                return 0 if high == low else (key(order) - low) / (high - low)
+            return (
+                weights['price_gap'] * scaled(lambda o: float((o.suggested_price - 50) / 50))
+                + weights['expiry'] * scaled(lambda o: -(o.visible_until - now).total_seconds())
+                + weights['schedule'] * scaled(lambda o: -(o.scheduled_date - now).total_seconds())
+                + weights['proposals'] * scaled(lambda o: -o.proposal_count)
+                + weights['distance'] * scaled(lambda o: -float(o.latitude))
+            )
+        orders = {order.pk: order for order in Order.objects.all()}
+        for pk, value in zip(candidates['pk'], scores):
+            self.assertAlmostEqual(value, reference(orders[pk], orders.values()), places=6)
+
+    def test_top_k_matches_full_sort(self):
+        rng = np.random.default_rng(0)
+        scores = rng.random(1000).round(2)
+        ids = np.arange(1000)
+
+        best = ranking.top_k(scores, ids, 25)
+
+        self.assertEqual(best.tolist(), sorted(ids.tolist(), key=lambda i: (-scores[i], i))[:25])
+        self.assertEqual(len(ranking.top_k(scores, ids, 5000)), 1000)
+        self.assertEqual(len(ranking.top_k(scores[:0], ids[:0], 10)), 0)
+
+    def generated_candidates(self, size, now):
+        rng = np.random.default_rng(0)
+        return {
+            'pk': np.arange(size, dtype=np.int64),
+            'suggested_price': rng.uniform(20, 500, size),
+            'sub_service__base_price': rng.uniform(20, 200, size),
+            'visible_until': now.timestamp() + rng.uniform(0, 24 * 3600, size),
+            'scheduled_date': now.timestamp() + rng.uniform(0, 7 * 24 * 3600, size),
+            'proposal_count': rng.integers(0, 20, size).astype(float),
+            # One in ten without a location
+            'latitude': np.where(rng.random(size) < 0.1, np.nan, rng.uniform(35, 36, size)),
+            'longitude': rng.uniform(51, 52, size),
+        }
+
+    def test_ranking_100k_candidates_matches_a_full_sort(self):
+        now = timezone.now()
+        candidates = self.generated_candidates(100_000, now)
+
+        scores = ranking.score(candidates, ranking.get_weights(), now=now, origin=(35.7, 51.4))
+
+        self.assertEqual(ranking.top_k(scores, candidates['pk'], 50).tolist(),
+                         np.lexsort((candidates['pk'], -scores))[:50].tolist())
+
+    @benchmark
+    def test_ranking_100k_candidates_within_budget(self):
+        # Scoring and picking the top 50 of 100k generated candidates takes about 20 ms; 100 ms is the budget
+        now = timezone.now()
+        candidates = self.generated_candidates(100_000, now)
+        weights = ranking.get_weights()
+
+        def rank():
+            scores = ranking.score(candidates, weights, now=now, origin=(35.7, 51.4))
+            return ranking.top_k(scores, candidates['pk'], 50)
+
+        elapsed = min(timeit.repeat(rank, number=1, repeat=3))
+
+        self.assertLess(elapsed, 0.1, f'ranked 100000 candidates in {elapsed * 1000:.1f} ms')
+
+    def test_ranked_view_returns_best_orders_with_scores(self):
+        cheap = self.create_order(suggested_price=Decimal('45.00'), proposal_count=3)
+        rich = self.create_order(suggested_price=Decimal('90.00'))
+        middling = self.create_order(suggested_price=Decimal('60.00'), proposal_count=1)
+        self.create_order(sub_service=self.other_sub_service, suggested_price=Decimal('500.00'))
+
+        response = self.client.get(self.url, {'ordering': 'rank', 'limit': 2})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([order['id'] for order in results], [rich.pk, middling.pk])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[0]['suggested_price'], '90.00')
+        with self.settings(FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(self.url, {'ordering': 'rank'}).data['results']
+        self.assertEqual([order['id'] for order in slow], [rich.pk, middling.pk, cheap.pk])
+
+    def test_weights_are_configurable(self):
+        few_proposals = self.create_order(suggested_price=Decimal('50.00'))
+        self.create_order(suggested_price=Decimal('90.00'), proposal_count=5)
+
+        with self.settings(ORDER_RANKING_WEIGHTS={'price_gap': 0, 'proposals': 1}):
+            results = self.client.get(self.url, {'ordering': 'rank'}).data['results']
+
+        self.assertEqual(results[0]['id'], few_proposals.pk)
+        with self.assertRaises(ValueError):
+            ranking.get_weights({'popularity': 1})
+
+
+class PriceSketchTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.url = reverse('sub-service-price-stats', args=[self.sub_service.pk])
+
+    def assert_close_to_exact(self, prices):
+        buckets = pricing.add_prices({}, prices)
+        ordered = sorted(prices)
+        for q in (0.1, 0.5, 0.9):
+            exact = float(ordered[math.floor(q * (len(ordered) - 1))])
+            estimate = float(pricing.quantile(buckets, len(prices), q))
+            # Relative accuracy plus rounding to whole cents
+            self.assertLessEqual(abs(estimate - exact), exact * pricing.RELATIVE_ACCURACY + 0.005, f'q={q}')
+
+    def test_quantiles_match_exact_within_relative_accuracy(self):
+        rng = np.random.default_rng(7)
+        for prices in (
+            rng.lognormal(mean=4, sigma=0.8, size=20000),
+            rng.uniform(10, 500, size=5000),
+            np.concatenate([rng.normal(60, 3, size=3000), rng.normal(400, 20, size=1000)]),
+        ):
+            self.assert_close_to_exact([Decimal(f'{price:.2f}') for price in prices])
+
+    def test_sketch_is_compact(self):
+        rng = np.random.default_rng(3)
+        buckets = pricing.add_prices({}, rng.lognormal(mean=4, sigma=0.8, size=20000))
+
+        self.assertLess(len(buckets), 500)
+
+    def test_proposals_and_selection_update_sketches(self):
+        order = self.create_order()
+        self.client.force_authenticate(self.specialist)
+        for price in ('40.00', '50.00', '60.00'):
+            self.client.post(reverse('create_proposal'), {
+                'order': order.pk, 'proposed_price': price, 'estimated_duration': '01:00:00'
+            })
+        self.assertEqual(self.client.get(self.url).data['proposed']['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(merge_price_observations_task(), 3)
+        self.assertEqual(self.client.get(self.url).data['proposed']['count'], 3)
+
+        self.client.force_authenticate(self.customer)
+        proposal = Proposal.objects.get(proposed_price=Decimal('50.00'))
+        self.client.put(reverse('select-proposal', args=[order.pk]), {'proposal_id': proposal.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            pricing.merge_price_observations()
+        stats = self.client.get(self.url).data
+
+        self.assertEqual(stats['proposed']['count'], 3)
+        self.assertAlmostEqual(float(stats['proposed']['p50']), 50, delta=0.5)
+        self.assertEqual(stats['accepted']['count'], 1)
+        self.assertAlmostEqual(float(stats['accepted']['p90']), 50, delta=0.5)
+        self.assertFalse(PriceObservation.objects.exists())
+
+    def test_merge_query_count_is_fixed(self):
+        order = self.create_order()
+        other_order = self.create_order(sub_service=self.other_sub_service)
+        specialists = seed_marketplace(40, self.customer)['specialists']
+        for i, specialist in enumerate(specialists):
+            proposal = Proposal.objects.create(order=(order, other_order)[i % 2], specialist=specialist,
+                                               proposed_price=Decimal('30.00') + i, estimated_duration=timedelta(hours=1))
+            pricing.record_price(proposal.order.sub_service_id, PriceKind.PROPOSED, proposal)
+
+        # Pick the batch, lock its sub-services, ensure, lock and update the sketches, drop the batch,
+        # plus a savepoint pair
+        with self.assertNumQueries(8):
+            self.assertEqual(pricing.merge_batch(), 40)
+        self.assertEqual(
+            dict(PriceSketch.objects.values_list('sub_service_id', 'count')),
+            {self.sub_service.pk: 20, self.other_sub_service.pk: 20},
+        )
+
+    def test_stats_are_cached(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['proposed'], {'count': 0, 'p10': None, 'p50': None, 'p90': None})
+        # Only the sub-service existence check
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.client.get(reverse('sub-service-price-stats', args=[0])).status_code, 404)
+
+    def test_rebuild_command_matches_incremental_updates(self):
+        order = self.create_order()
+        specialists = seed_marketplace(30, self.customer)['specialists']
+        for i, specialist in enumerate(specialists):
+            proposal = Proposal.objects.create(order=order, specialist=specialist, proposed_price=Decimal('30.00') + i,
+                                               estimated_duration=timedelta(hours=1))
+            pricing.record_price(self.sub_service.pk, PriceKind.PROPOSED, proposal)
+        pricing.merge_price_observations(batch_size=7)
+        incremental = PriceSketch.objects.get(sub_service=self.sub_service, kind=PriceKind.PROPOSED)
+        Order.objects.filter(pk=order.pk).update(selected_proposal=proposal)
+
+        call_command('rebuild_price_sketches', '--chunk-size=7', stdout=StringIO())
+
+        rebuilt = PriceSketch.objects.get(sub_service=self.sub_service, kind=PriceKind.PROPOSED)
+        self.assertEqual((rebuilt.count, rebuilt.buckets), (incremental.count, incremental.buckets))
+        self.assertEqual(PriceSketch.objects.get(sub_service=self.sub_service, kind=PriceKind.ACCEPTED).count, 1)
+
+    def test_rebuild_leaves_staged_prices_to_the_merge(self):
+        order = self.create_order()
+        specialists = seed_marketplace(10, self.customer)['specialists']
+        for i, specialist in enumerate(specialists):
+            proposal = Proposal.objects.create(order=order, specialist=specialist, proposed_price=Decimal('30.00') + i,
+                                               estimated_duration=timedelta(hours=1))
+            pricing.record_price(self.sub_service.pk, PriceKind.PROPOSED, proposal)
+        pricing.merge_batch(batch_size=4)
+
+        pricing.rebuild_price_sketches()
+        self.assertEqual(PriceSketch.objects.get(sub_service=self.sub_service, kind=PriceKind.PROPOSED).count, 4)
+        pricing.merge_price_observations()
+
+        sketch = PriceSketch.objects.get(sub_service=self.sub_service, kind=PriceKind.PROPOSED)
+        self.assertEqual(sketch.count, 10)
+        self.assertEqual(sketch.buckets, pricing.add_prices({}, Proposal.objects.values_list('proposed_price', flat=True)))
+
+
+class OrderEventHubTests(SimpleTestCase):
+    async def test_resume_replays_buffered_events_for_matching_sub_services(self):
+        events = OrderEventHub(history_size=10)
+        for i in range(6):
+            events.publish(ORDER_CREATED, i % 2, f'{{"id": {i}}}')
+
+        subscription, replay = events.subscribe([0], last_event_id=2)
+
+        self.assertEqual([event.id for event in replay], [3, 5])
+        self.assertFalse(subscription.missed)
+        events.publish(ORDER_EXPIRED, 0, '{}')
+        events.publish(ORDER_EXPIRED, 1, '{}')
+        self.assertEqual((await subscription.get()).id, 7)
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_resume_past_the_history_is_flagged(self):
+        events = OrderEventHub(history_size=3)
+        for i in range(6):
+            events.publish(ORDER_CREATED, 0, '{}')
+
+        self.assertTrue(events.subscribe([0], last_event_id=1)[0].missed)
+        self.assertFalse(events.subscribe([0], last_event_id=3)[0].missed)
+        # An id from before a restart
+        self.assertTrue(events.subscribe([0], last_event_id=50)[0].missed)
+
+    async def test_slow_subscriber_is_cut_off(self):
+        events = OrderEventHub(queue_size=2)
+        subscription, _ = events.subscribe([0])
+        for i in range(5):
+            events.publish(ORDER_CREATED, 0, '{}')
+        await asyncio.sleep(0)
+
+        self.assertEqual([(await subscription.get()).id for _ in range(2)], [1, 2])
+        self.assertIsNone(await subscription.get())
+
+
+class ASGIStream:
+    """
+    One client of the ASGI application reading a server-sent event stream.
+    """
+
+    def __init__(self, path, token=None, last_event_id=None):
+        headers = [(b'host', b'testserver')]
+        if token:
+            headers.append((b'authorization', f'Token {token}'.encode()))
+        if last_event_id is not None:
+            headers.append((b'last-event-id', str(last_event_id).encode()))
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': headers,
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        self.status = asyncio.get_running_loop().create_future()
+        self.chunks = asyncio.Queue()
+        self.buffer = ''
+        self.request_sent = False
+        self.disconnected = asyncio.Event()
+        self.task = asyncio.ensure_future(application(self.scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status.set_result(message['status'])
+        elif message.get('body'):
+            await self.chunks.put(message['body'].decode())
+
+    async def read_event(self):
+        while '\n\n' not in self.buffer:
+            self.buffer += await asyncio.wait_for(self.chunks.get(), 10)
+        block, self.buffer = self.buffer.split('\n\n', 1)
+        return dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line and not line.startswith(':'))
+
+    async def close(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 10)
+
+
+class AvailableOrderStreamTests(OrdersTestMixin, TransactionTestCase):
+    subscribers = 2000
+
+    def setUp(self):
+        self.setUpTestData()
+        hub.clear()
+        local_principals.clear()
+        cache.clear()
+        self.token = Token.objects.create(user=self.specialist).key
+        self.path = reverse('available-orders-stream')
+
+    def tearDown(self):
+        hub.clear()
+
+    async def open(self, **kwargs):
+        stream = ASGIStream(self.path, **kwargs)
+        self.assertEqual(await stream.status, 200)
+        self.assertIn('retry', await stream.read_event())
+        return stream
+
+    async def test_requires_specialist_token(self):
+        customer_token = await sync_to_async(lambda: Token.objects.create(user=self.customer).key)()
+        for token, expected in ((None, 401), ('bogus', 401), (customer_token, 403)):
+            stream = ASGIStream(self.path, token=token)
+            self.assertEqual(await stream.status, expected)
+            await stream.close()
+
+    async def test_thousands_of_subscribers_receive_matching_events(self):
+        streams = await asyncio.gather(*(self.open(token=self.token) for _ in range(self.subscribers)))
+        self.assertEqual(hub.subscriber_count, self.subscribers)
+
+        order = await sync_to_async(self.create_order)(visible_until=timezone.now() - timedelta(minutes=1))
+        await sync_to_async(self.create_order)(sub_service=self.other_sub_service)
+        await sync_to_async(expire_orders)()
+
+        created = await asyncio.gather(*(stream.read_event() for stream in streams))
+        expired = await asyncio.gather(*(stream.read_event() for stream in streams))
+        self.assertEqual({(event['event'], json.loads(event['data'])['id']) for event in created},
+                         {('order.created', order.pk)})
+        self.assertEqual({(event['event'], json.loads(event['data'])['id']) for event in expired},
+                         {('order.expired', order.pk)})
+
+        await asyncio.gather(*(stream.close() for stream in streams))
+        self.assertEqual(hub.subscriber_count, 0)
+
+    async def test_last_event_id_resumes_the_stream(self):
+        await sync_to_async(self.create_order)()
+        first_id = hub.last_id
+        second = await sync_to_async(self.create_order)()
+
+        stream = await self.open(token=self.token, last_event_id=first_id)
+        event = await stream.read_event()
+        await stream.close()
+
+        self.assertEqual((int(event['id']), json.loads(event['data'])['id']), (first_id + 1, second.pk))
+
+    async def test_idle_stream_sends_keepalives(self):
+        with mock.patch.object(AvailableOrderStreamView, 'heartbeat', 0.05):
+            stream = await self.open(token=self.token)
+            chunk = await asyncio.wait_for(stream.chunks.get(), 10)
+            await stream.close()
+
+        self.assertEqual(chunk, ': keepalive\n\n')
+
+
+class AsyncReadViewTests(OrdersTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        local_principals.clear()
+        self.token = Token.objects.create(user=self.specialist).key
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, url, token=None, **headers):
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        return await view.as_view()(self.factory.get(url, headers=headers))
+
+    async def test_available_orders_pages_match_sync_view(self):
+        now = timezone.now()
+        for i in range(7):
+            await sync_to_async(self.create_order)(visible_until=now + timedelta(hours=i % 3 + 1))
+
+        async def walk(url, link):
+            pages = []
+            while url:
+                expected = await sync_to_async(self.client.get)(url)
+                response = await self.call(AsyncAvailableOrdersView, url, self.token)
+                self.assertEqual(response.content, expected.content)
+                pages.append(url)
+                url = json.loads(response.content)[link]
+            return pages
+
+        pages = await walk(f"{reverse('available-orders')}?page_size=3", 'next')
+        self.assertEqual(len(pages), 3)
+        # And back again through the reversed cursors
+        self.assertEqual(len(await walk(pages[-1], 'previous')), 3)
+
+    async def test_available_orders_without_fast_serialization(self):
+        await sync_to_async(self.create_order)()
+        url = reverse('available-orders')
+
+        with self.settings(FAST_LIST_SERIALIZATION=False):
+            response = await self.call(AsyncAvailableOrdersView, url, self.token)
+        expected = await sync_to_async(self.client.get)(url)
+
+        self.assertEqual(response.content, expected.content)
+
+    async def test_ranked_and_radius_requests_use_the_sync_path(self):
+        await sync_to_async(self.create_order)(latitude=Decimal('35.7'), longitude=Decimal('51.4'))
+        url = f"{reverse('available-orders')}?ordering=rank"
+
+        response = await self.call(AsyncAvailableOrdersView, url, self.token)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['results']), 1)
+
+    async def test_auth_errors_match_sync_view(self):
+        customer_token = await sync_to_async(lambda: Token.objects.create(user=self.customer).key)()
+        url = reverse('available-orders')
+        for token in (None, 'bogus', customer_token):
+            response = await self.call(AsyncAvailableOrdersView, url, token)
+            sync_client = APIClient()
+            if token:
+                sync_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            expected = await sync_to_async(sync_client.get)(url)
+            self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+
+    async def test_catalog_matches_sync_view(self):
+        url = reverse('main-service_list')
+        expected = await sync_to_async(self.client.get)(url)
+        response = await self.call(AsyncMainServiceListView, url, self.token)
+
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        response = await self.call(AsyncMainServiceListView, url, self.token, **{'If-None-Match': expected['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_instrumentation_middleware_stays_async(self):
+        await sync_to_async(self.create_order)()
+        middleware = QueryInstrumentationMiddleware(AsyncAvailableOrdersView.as_view())
+        request = self.factory.get(reverse('available-orders'), headers={'Authorization': f'Token {self.token}'})
+        request.resolver_match = None
+
+        response = await middleware(request)
+
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        # Principal load (token and sub-services) plus the page
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
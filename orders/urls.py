@@ -1,12 +1,29 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import OrderCreateView, ProposalCreateView, MainServiceListView, AvailableOrdersView
+from .views import (
+    OrderCreateView, ProposalCreateView, MainServiceListView, AvailableOrdersView, SelectProposalView,
+    MarkOrderCompleteView, OrderProposalListView, AvailableOrderSearchView,
+    SubServicePriceStatsView, AvailableOrderStreamView, AsyncAvailableOrdersView, AsyncMainServiceListView,
+)
+
+# The async variants return identical payloads; ASYNC_READ_VIEWS picks which ones serve
+if settings.ASYNC_READ_VIEWS:
+    main_service_list_view, available_orders_view = AsyncMainServiceListView, AsyncAvailableOrdersView
+else:
+    main_service_list_view, available_orders_view = MainServiceListView, AvailableOrdersView
 
 urlpatterns = [
     path('create/', OrderCreateView.as_view(), name='create_order'),
     path('proposal/', ProposalCreateView.as_view(), name='create_proposal'),
-    path('services/', MainServiceListView.as_view(), name='main-service_list'),
-    path('available-orders/', AvailableOrdersView.as_view(), name='available-orders'),
+    path('services/', main_service_list_view.as_view(), name='main-service_list'),
+    path('services/<int:pk>/price-stats/', SubServicePriceStatsView.as_view(), name='sub-service-price-stats'),
+    path('available-orders/', available_orders_view.as_view(), name='available-orders'),
+    path('available-orders/stream/', AvailableOrderStreamView.as_view(), name='available-orders-stream'),
+    path('available-orders/search/', AvailableOrderSearchView.as_view(), name='available-orders-search'),
+    path('<int:pk>/proposals/', OrderProposalListView.as_view(), name='order-proposals'),
+    path('<int:pk>/select-proposal/', SelectProposalView.as_view(), name='select-proposal'),
+    path('<int:pk>/complete/', MarkOrderCompleteView.as_view(), name='complete-order'),
 
 
 ]
@@ -1,35 +1,62 @@
 # orders/utils.py
 from decimal import Decimal
 
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import F
 
-from users.models import Transaction
+from users.models import LedgerEntry, LedgerEntryKind, Transaction, Wallet
 
 ADMIN_COMMISSION_RATE = Decimal("0.30")
 SPECIALIST_SHARE_RATE = Decimal("0.70")
+CENT = Decimal("0.01")
+
+
+def process_payment(customer, specialist, order_amount, idempotency_key=None):
+    """
+    Charge order_amount to the customer's wallet and stage the specialist's share and the commission.
+
+    The debit is a conditional UPDATE, so the balance can never go negative
+    or lose a concurrent update. The specialist payout and the platform
+    commission are appended to the ledger staging table and credited by the
+    next settlement (users.ledger.settle_ledger), so payments never queue up
+    on the platform account's row. Passing an idempotency_key (one per
+    order) makes retries a no-op. Returns False if the payment was already
+    recorded under that key.
+    """
+    order_amount = Decimal(order_amount)
+    specialist_share = (order_amount * SPECIALIST_SHARE_RATE).quantize(CENT)
+    # Whatever rounding leaves goes to the platform, so the entries always balance the debit
+    commission = order_amount - specialist_share
 
-def process_payment(customer, specialist, order_amount):
     with transaction.atomic():
-        customer_wallet = customer.wallet
-        specialist_wallet = specialist.wallet
-
-        # Check if customer has enough balance
-        if customer_wallet.balance < order_amount:
+        user_ids = [customer.pk, specialist.pk]
+        wallets = dict(Wallet.objects.filter(user_id__in=user_ids).values_list('user_id', 'pk'))
+        if customer.pk not in wallets or specialist.pk not in wallets:
+            # Users from before wallets were created on sign-up get an empty one; a customer's then can't pay
+            Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in user_ids if user_id not in wallets],
+                                       ignore_conflicts=True)
+            wallets = dict(Wallet.objects.filter(user_id__in=user_ids).values_list('user_id', 'pk'))
+        customer_wallet_id = wallets[customer.pk]
+
+        # Record the debit first; the unique idempotency key rejects replays
+        try:
+            with transaction.atomic():
+                Transaction.objects.create(wallet_id=customer_wallet_id, amount=-order_amount,
+                                           description="Payment for service", idempotency_key=idempotency_key)
+        except IntegrityError:
+            return False
+
+        # Deduct from customer's wallet only if the balance covers it
+        debited = Wallet.objects.filter(pk=customer_wallet_id, balance__gte=order_amount).update(
+            balance=F('balance') - order_amount
+        )
+        if not debited:
             raise ValueError("Insufficient balance in customer's wallet")
 
-        # Calculate shares
-        admin_share = order_amount * ADMIN_COMMISSION_RATE
-        specialist_share = order_amount * SPECIALIST_SHARE_RATE
-
-        # Deduct from customer's wallet
-        customer_wallet.balance -= order_amount
-        customer_wallet.save()
-
-        # Credit to specialist's wallet
-        specialist_wallet.balance += specialist_share
-        specialist_wallet.save()
+        LedgerEntry.objects.bulk_create([
+            LedgerEntry(kind=LedgerEntryKind.PAYOUT, wallet_id=wallets[specialist.pk], amount=specialist_share,
+                        idempotency_key=idempotency_key),
+            LedgerEntry(kind=LedgerEntryKind.COMMISSION, amount=commission, idempotency_key=idempotency_key),
+        ])
 
-        # Record transactions
-        Transaction.objects.create(wallet=customer_wallet, amount=-order_amount, description="Payment for service")
-        Transaction.objects.create(wallet=specialist_wallet, amount=specialist_share, description="Earnings from service")
-        # Admin's commission could be recorded separately if needed.
+    return True
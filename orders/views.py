@@ -1,18 +1,44 @@
+import asyncio
 from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.urls import reverse
 from decimal import Decimal
 from users.models import Wallet
 from django.utils import timezone
+from django.db.models import Count, Exists, ExpressionWrapper, F, FloatField, Max, Min, OuterRef, Window
+from django.db.models.functions import Rank
+from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from services.models import MainService
+from homeserviceprovider.async_views import AsyncAPIView
+from services.models import MainService, SpecialistService, SubService
 from users.permissions import IsCustomer, IsSpecialist
-from .models import Order, Proposal
-from .serializers import OrderSerializer, ProposalSerializer, MainServiceSerializer
+from .catalog import aget_catalog, get_catalog
+from .events import hub
+from .fast_serializers import FastListModelMixin, FastSerializer
+from .models import Order, OrderStatus, PriceKind, Proposal
+from .pagination import AvailableOrdersPagination, ProposalPagination
+from .pricing import get_price_stats, record_price
+from .ranking import rank_orders
+from .renderers import FastJSONRenderer
+from .search import search_orders
+from .serializers import (
+    OrderSerializer, ProposalSerializer, MainServiceSerializer, ProposalComparisonSerializer, ProposalStatsSerializer,
+    OrderSearchResultSerializer, SubServicePriceStatsSerializer,
+)
+from .state import can_transition, transition
 from .utils import process_payment  # Utility function for handling payments
 
 
@@ -45,66 +71,310 @@ class ProposalCreateView(generics.CreateAPIView):
         specialist = self.request.user
         order_id = self.request.data.get('order')
 
+        # Load the order and check the specialist's sub-service permissions in one query
+        specialist_sub_services = SpecialistService.sub_service.through.objects.filter(
+            specialistservice__specialist=specialist, subservice_id=OuterRef('sub_service_id')
+        )
         try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
-            return Response({"error": "Order does not exist."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check specialist's sub-service permissions
-        if hasattr(specialist, 'specialist_service'):
-            specialist_sub_services = specialist.specialist_service.sub_service.all()
-            if order.sub_service not in specialist_sub_services:
-                return Response(
-                    {"error": "You are not authorized to make a proposal for this sub-service."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        else:
-            return Response(
-                {"error": "You are not registered with any sub-services."},
-                status=status.HTTP_403_FORBIDDEN
-            )
+            order = Order.objects.only('id', 'status', 'sub_service').annotate(
+                authorized=Exists(specialist_sub_services)
+            ).get(id=order_id)
+        except (Order.DoesNotExist, ValueError, TypeError):
+            raise NotFound("Order does not exist.")
 
-        # Save the proposal if authorized
-        serializer.save(specialist=specialist, order=order)
+        if not order.authorized:
+            raise PermissionDenied("You are not authorized to make a proposal for this sub-service.")
 
-        # Update order status after the first proposal
-        if order.status == 'waiting_for_proposals':
-            order.status = 'waiting_for_selection'
-            order.save()
+        with transaction.atomic():
+            # Save the proposal and fold it into the order's counters
+            proposal = serializer.save(specialist=specialist, order=order)
+            Order.objects.record_proposal(order.pk, proposal.proposed_price, proposal.created_at)
+            record_price(order.sub_service_id, PriceKind.PROPOSED, proposal)
+
+            # Update order status after the first proposal
+            if order.status == OrderStatus.WAITING_FOR_PROPOSALS:
+                transition(order.pk, OrderStatus.WAITING_FOR_SELECTION)
+
+
+class OrderProposalListView(generics.ListAPIView):
+    """
+    Lets the customer who created an order compare its proposals.
+
+    Price/duration ranks and the weighted score are window annotations computed
+    in SQL; ?ordering= accepts price, duration or score (the default). The
+    response also carries price statistics over all of the order's proposals.
+    """
+    serializer_class = ProposalComparisonSerializer
+    permission_classes = [permissions.IsAuthenticated, IsCustomer]
+    pagination_class = ProposalPagination
+    score_weights = {'price': 0.7, 'duration': 0.3}
+    orderings = {
+        'price': ('proposed_price', 'id'),
+        'duration': ('estimated_duration', 'id'),
+        'score': ('score', 'id'),
+    }
+
+    def get_order(self):
+        return get_object_or_404(Order.objects.only('id'), pk=self.kwargs['pk'], customer=self.request.user)
+
+    def get_queryset(self):
+        ordering = self.orderings.get(self.request.query_params.get('ordering'), self.orderings['score'])
+        return Proposal.objects.filter(order=self.order).select_related('specialist__profile').annotate(
+            price_rank=Window(Rank(), order_by=F('proposed_price').asc()),
+            duration_rank=Window(Rank(), order_by=F('estimated_duration').asc()),
+        ).annotate(
+            score=ExpressionWrapper(
+                F('price_rank') * self.score_weights['price'] + F('duration_rank') * self.score_weights['duration'],
+                output_field=FloatField(),
+            )
+        ).order_by(*ordering)
+
+    def get_stats(self):
+        proposals = Proposal.objects.filter(order=self.order)
+        stats = proposals.aggregate(count=Count('id'), min_price=Min('proposed_price'), max_price=Max('proposed_price'))
+        stats['median_price'] = None
+        if stats['count']:
+            # The middle one or two prices, fetched by offset rather than loading every proposal
+            count = stats['count']
+            middle = proposals.order_by('proposed_price').values_list('proposed_price', flat=True)
+            middle = list(middle[(count - 1) // 2:count // 2 + 1])
+            stats['median_price'] = sum(middle) / len(middle)
+        return ProposalStatsSerializer(stats).data
+
+    def list(self, request, *args, **kwargs):
+        self.order = self.get_order()
+        response = super().list(request, *args, **kwargs)
+        response.data['stats'] = self.get_stats()
+        return response
 
 
 class MainServiceListView(generics.ListAPIView):
     """
     Lists all main services and their sub-services.
+
+    The rendered catalog is served from cache with a strong ETag, so repeat
+    requests cost no queries and unchanged clients get a 304.
     """
-    queryset = MainService.objects.all()
+    queryset = MainService.objects.prefetch_related('sub_services')
     serializer_class = MainServiceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        return catalog_response(request, *get_catalog())
 
-class AvailableOrdersView(generics.ListAPIView):
+
+def catalog_response(request, etag, body):
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+class AsyncMainServiceListView(AsyncAPIView):
+    """
+    Async MainServiceListView, serving the same cached catalog.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        return catalog_response(request, *await aget_catalog())
+
+
+class SubServicePriceStatsView(generics.GenericAPIView):
+    """
+    Market reference for a sub-service: p10/p50/p90 of proposed and accepted prices.
+    """
+    serializer_class = SubServicePriceStatsSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        if not SubService.objects.filter(pk=kwargs['pk']).exists():
+            raise NotFound("Sub-service does not exist.")
+        return Response(self.get_serializer(get_price_stats(kwargs['pk'])).data)
+
+
+class AvailableOrdersView(FastListModelMixin, generics.ListAPIView):
     """
     Lists all orders available for specialist proposals,
     filtered by the specialist's sub-services.
+
+    ?radius_km= keeps only orders within that distance of ?lat=/?lon=, or of
+    the specialist's service location when no point is given.
+
+    ?ordering=rank instead returns the ?limit= best-scoring orders (see
+    orders.ranking), unpaginated, each with its score.
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated, IsSpecialist]
+    pagination_class = AvailableOrdersPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    fast_serializer = FastSerializer(OrderSerializer)
+    default_rank_limit = 50
+    max_rank_limit = 200
 
     def get_queryset(self):
-        specialist = self.request.user
-        current_time = timezone.now()
-
-        # Fetch specialist's sub-services
-        specialist_sub_services = specialist.specialist_service.sub_service.all() if hasattr(specialist,
-                                                                                             'specialist_service') else []
-
-        # Filter orders by sub-services, status, and visibility
-        return Order.objects.filter(
-            sub_service__in=specialist_sub_services,
-            status='waiting_for_proposals',
-            visible_until__gte=current_time,
-            selected_proposal__isnull=True
+        # Filter orders by the specialist's sub-services, status, and visibility in one query
+        queryset = Order.objects.available_for(self.request.user)
+        radius_km = self.get_radius_km()
+        if radius_km is not None:
+            queryset = queryset.within_radius(*self.get_origin(required=True), radius_km)
+        return queryset
+
+    def get_radius_km(self):
+        if self.request.query_params.get('radius_km') is None:
+            return None
+        try:
+            radius_km = float(self.request.query_params['radius_km'])
+        except ValueError:
+            raise ValidationError({"error": "radius_km must be a number."})
+        if not radius_km > 0:
+            raise ValidationError({"error": "radius_km must be positive."})
+        return radius_km
+
+    def get_origin(self, required=False):
+        """
+        (latitude, longitude) from ?lat=/?lon=, falling back to the specialist's service location.
+        """
+        params = self.request.query_params
+        if 'lat' in params or 'lon' in params:
+            try:
+                latitude, longitude = float(params['lat']), float(params['lon'])
+            except (KeyError, ValueError):
+                raise ValidationError({"error": "lat and lon must both be numbers."})
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValidationError({"error": "lat or lon is out of range."})
+            return latitude, longitude
+        if not hasattr(self, '_service_location'):
+            self._service_location = SpecialistService.objects.filter(
+                specialist=self.request.user, latitude__isnull=False, longitude__isnull=False
+            ).values_list('latitude', 'longitude').first()
+        if self._service_location is None and required:
+            raise ValidationError({"error": "lat and lon are required when the service has no location."})
+        return self._service_location
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('ordering') != 'rank':
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_rank_limit)), 1),
+                        self.max_rank_limit)
+        except ValueError:
+            raise ValidationError({"error": "limit must be an integer."})
+
+        ranked = rank_orders(self.get_queryset(), limit, origin=self.get_origin())
+        orders = Order.objects.filter(pk__in=[pk for pk, _ in ranked])
+        if self.fast_serializer is not None and getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            data = self.fast_serializer.serialize(orders.values(*self.fast_serializer.columns))
+        else:
+            data = self.get_serializer(orders, many=True).data
+        by_id = {order['id']: order for order in data}
+        results = [{**by_id[pk], 'score': score} for pk, score in ranked if pk in by_id]
+        return Response({"results": results})
+
+
+class AsyncAvailableOrdersView(AsyncAPIView):
+    """
+    Async AvailableOrdersView: the same cursor pages, fetched with the async ORM.
+
+    Radius filtering and ranking evaluate their candidates in Python, so
+    those requests are still handed to the sync view.
+    """
+    roles = ('specialist',)
+    renderer_class = FastJSONRenderer
+    fast_serializer = AvailableOrdersView.fast_serializer
+
+    async def get(self, request, *args, **kwargs):
+        if 'radius_km' in request.GET or request.GET.get('ordering') == 'rank':
+            response = await sync_to_async(AvailableOrdersView.as_view())(request, *args, **kwargs)
+            return await sync_to_async(response.render)()
+
+        paginator = AvailableOrdersPagination()
+        queryset = Order.objects.available_for(request.user)
+        if getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            rows = self.fast_serializer.values(queryset, paginator.ordering)
+            data = self.fast_serializer.serialize(await paginator.apaginate_queryset(rows, Request(request)))
+        else:
+            data = OrderSerializer(await paginator.apaginate_queryset(queryset, Request(request)), many=True).data
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+class AvailableOrderStreamView(AsyncAPIView):
+    """
+    Server-sent events for orders created or expired in the specialist's sub-services.
+
+    An async view for ASGI that authenticates with the "Authorization: Token"
+    header. Clients reconnect with Last-Event-ID to resume; an order.reset
+    event means some events were missed and the list should be refetched,
+    and order.lagged ends a stream that fell too far behind.
+    """
+    roles = ('specialist',)
+    heartbeat = 15
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            last_event_id = int(request.headers['Last-Event-ID'])
+        except (KeyError, ValueError):
+            # Start from now, but without a gap before the stream is first read
+            last_event_id = hub.last_id
+        response = StreamingHttpResponse(
+            self.stream(request.user.sub_service_ids, last_event_id), content_type='text/event-stream'
         )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, sub_service_ids, last_event_id):
+        # Subscribe on the loop that iterates the response
+        subscription, replay = hub.subscribe(sub_service_ids, last_event_id)
+        try:
+            yield f'retry: {self.heartbeat * 1000}\n\n'
+            if subscription.missed:
+                yield 'event: order.reset\ndata: {}\n\n'
+            for event in replay:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    yield 'event: order.lagged\ndata: {}\n\n'
+                    return
+                yield event.encode()
+        finally:
+            hub.unsubscribe(subscription)
+
+
+class AvailableOrderSearchView(generics.GenericAPIView):
+    """
+    Full-text search over the orders available to the specialist, best match first.
+    Accepts ?q= plus ?limit= and ?offset=.
+    """
+    serializer_class = OrderSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated, IsSpecialist]
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({"error": "limit and offset must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        orders = []
+        for order, rank, snippet in search_orders(
+            Order.objects.available_for(request.user), request.query_params.get('q', ''), limit, offset
+        ):
+            order.search_rank, order.search_snippet = rank, snippet
+            orders.append(order)
+
+        next_url = None
+        if len(orders) == limit:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', offset + limit)
+        return Response({"next": next_url, "results": self.get_serializer(orders, many=True).data})
 
 
 class SelectProposalView(generics.UpdateAPIView):
@@ -118,21 +388,24 @@ class SelectProposalView(generics.UpdateAPIView):
         order = self.get_object()
 
         # Ensure the customer selecting the proposal is the order creator
-        if request.user != order.customer:
+        if request.user.pk != order.customer_id:
             return Response({"error": "You do not have permission to select a proposal for this order."},
                             status=status.HTTP_403_FORBIDDEN)
 
         proposal_id = request.data.get('proposal_id')
 
         try:
-            selected_proposal = Proposal.objects.get(id=proposal_id)
-        except Proposal.DoesNotExist:
+            selected_proposal = Proposal.objects.only('id', 'proposed_price').get(id=proposal_id, order_id=order.pk)
+        except (Proposal.DoesNotExist, ValueError, TypeError):
             return Response({"error": "Proposal does not exist for this order."}, status=status.HTTP_404_NOT_FOUND)
 
-        order.selected_proposal = selected_proposal
-        order.status = 'waiting_for_arrival'
-        order.visible_until = timezone.now()
-        order.save()
+        # Only one concurrent selection can win the conditional update
+        with transaction.atomic():
+            if not transition(order.pk, OrderStatus.WAITING_FOR_ARRIVAL,
+                              selected_proposal=selected_proposal, visible_until=timezone.now()):
+                return Response({"error": "A proposal can no longer be selected for this order."},
+                                status=status.HTTP_409_CONFLICT)
+            record_price(order.sub_service_id, PriceKind.ACCEPTED, selected_proposal)
 
         return Response({"status": "Proposal selected successfully, and order updated."}, status=status.HTTP_200_OK)
 
@@ -141,34 +414,32 @@ class MarkOrderCompleteView(generics.UpdateAPIView):
     """
     Allows only the customer who created the order to mark it as completed, triggering payment and updating status.
     """
-    queryset = Order.objects.all()
+    queryset = Order.objects.select_related('selected_proposal__specialist')
     permission_classes = [permissions.IsAuthenticated, IsCustomer]
 
     def update(self, request, *args, **kwargs):
         order = self.get_object()
 
         # Ensure only the customer who created the order can mark it as completed
-        if request.user != order.customer:
+        if request.user.pk != order.customer_id:
             return Response({"error": "You do not have permission to mark this order as completed."},
                             status=status.HTTP_403_FORBIDDEN)
 
         # Only proceed if the order is currently in "waiting_for_arrival" or "started" status
-        if order.status not in ['waiting_for_arrival', 'started']:
+        if not can_transition(order.status, OrderStatus.COMPLETED):
             return Response({"error": "Order cannot be marked as completed at this stage."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Change the order status to 'completed'
-        order.status = 'completed'
-        order.save()
-
-        # Process payment once completed
+        # Complete, pay and mark paid atomically; a failed payment rolls the completion back
         try:
-            process_payment(order.customer, order.selected_proposal.specialist, order.suggested_price)
-            order.status = 'paid'
-            order.save()
+            with transaction.atomic():
+                if not transition(order.pk, OrderStatus.COMPLETED):
+                    return Response({"error": "Order cannot be marked as completed at this stage."},
+                                    status=status.HTTP_409_CONFLICT)
+                process_payment(request.user, order.selected_proposal.specialist, order.suggested_price,
+                                idempotency_key=f"order-{order.pk}")
+                transition(order.pk, OrderStatus.PAID)
         except ValueError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"status": "Order marked as completed and payment processed."}, status=status.HTTP_200_OK)
-
-
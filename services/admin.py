@@ -1,4 +1,5 @@
 from django.contrib import admin
+from homeserviceprovider import lookups  # noqa: F401 (registers __prefix)
 from .models import MainService, SubService, SpecialistService
 
 @admin.register(MainService)
@@ -9,11 +10,14 @@ class MainServiceAdmin(admin.ModelAdmin):
 class SubServiceAdmin(admin.ModelAdmin):
     list_display = ('name', 'main_service', 'base_price')
     list_filter = ('main_service',)
+    list_select_related = ('main_service',)
     fields = ('main_service', 'name', 'description', 'base_price')
 
 @admin.register(SpecialistService)
 class SpecialistServiceAdmin(admin.ModelAdmin):
     list_display = ('specialist', 'main_service')
     list_filter = ('main_service',)
-    search_fields = ('specialist__username', 'main_service__name')
+    list_select_related = ('specialist', 'main_service')
+    search_fields = ('specialist__username__prefix', 'main_service__name__prefix')
+    raw_id_fields = ('specialist',)
     filter_horizontal = ('sub_service',)  # This should work if sub_services is correctly a ManyToManyField
@@ -1,5 +1,6 @@
+from decimal import Decimal
 from django.db import models
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.conf import settings
 
 
@@ -12,7 +13,8 @@ class MainService(models.Model):
 
 class SubService(models.Model):
     main_service = models.ForeignKey(MainService, on_delete=models.CASCADE, related_name='sub_services')
-    name = models.CharField(max_length=100)
+    # Indexed for the admin's prefix search
+    name = models.CharField(max_length=100, db_index=True)
     description = models.TextField(blank=True, null=True)
     base_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     expiration_hours = models.PositiveIntegerField(default=24)
@@ -27,6 +29,14 @@ class SpecialistService(models.Model):
     )
     main_service = models.ForeignKey(MainService, on_delete=models.CASCADE)
     sub_service = models.ManyToManyField(SubService, related_name='specialist_services')
+    latitude = models.DecimalField(
+        max_digits=9, decimal_places=6, blank=True, null=True,
+        validators=[MinValueValidator(Decimal('-90')), MaxValueValidator(Decimal('90'))]
+    )
+    longitude = models.DecimalField(
+        max_digits=9, decimal_places=6, blank=True, null=True,
+        validators=[MinValueValidator(Decimal('-180')), MaxValueValidator(Decimal('180'))]
+    )
 
     def __str__(self):
         return f"{self.specialist.username} - {self.main_service.name}"
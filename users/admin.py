@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import User, Profile
+from homeserviceprovider import lookups  # noqa: F401 (registers __prefix)
+from .models import LedgerEntry, PlatformAccount, User, Profile, Transaction
+from homeserviceprovider.paginators import EstimatedCountPaginator
 from services.models import SpecialistService
 
 # Inline Profile model for User
@@ -21,10 +23,47 @@ class SpecialistServiceInline(admin.StackedInline):
 class UserAdmin(admin.ModelAdmin):
     inlines = (ProfileInline, SpecialistServiceInline,)
     list_display = ('username', 'email', 'role', 'is_active', 'is_staff')
-    search_fields = ('username', 'email')
+    search_fields = ('username__prefix', 'email__prefix')
     list_filter = ('role', 'is_active', 'is_staff')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'bio')
-    search_fields = ('user__username', 'bio')
+    list_select_related = ('user',)
+    search_fields = ('user__username__prefix',)
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'wallet_user', 'amount', 'description', 'timestamp')
+    list_select_related = ('wallet__user',)
+    search_fields = ('=wallet__user__username', '=idempotency_key')
+    raw_id_fields = ('wallet',)
+    ordering = ('-id',)
+    readonly_fields = ('timestamp',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='User', ordering='wallet__user__username')
+    def wallet_user(self, obj):
+        return obj.wallet.user.username
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'wallet', 'amount', 'created_at', 'settled_at', 'failed_at')
+    list_filter = ('kind', ('failed_at', admin.EmptyFieldListFilter))
+    search_fields = ('=idempotency_key',)
+    raw_id_fields = ('wallet',)
+    ordering = ('-id',)
+    readonly_fields = ('created_at', 'settled_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(PlatformAccount)
+class PlatformAccountAdmin(admin.ModelAdmin):
+    list_display = ('name', 'balance')
+    readonly_fields = ('balance',)
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from services.models import SpecialistService
+from .models import User
+
+PRINCIPAL_CACHE_KEY = 'users:principal:{key}:{generation}'
+PRINCIPAL_GENERATION_KEY = 'users:principal-generation:{key}'
+PRINCIPAL_TIMEOUT = 300
+PRINCIPAL_GENERATION_TIMEOUT = 60 * 60 * 24
+LOCAL_CACHE_SIZE = 10000
+LOCAL_CACHE_TTL = 5
+
+# The password hash stays out of the cache; it is loaded lazily if ever accessed
+PRINCIPAL_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU with a per-entry TTL, used in front of the shared cache.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Bumped by every delete, so a value read before an invalidation is not stored after it
+        self.epoch = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, epoch=None):
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.epoch += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+
+
+local_principals = LRUCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+
+
+def load_principal(key):
+    """
+    Build the compact principal for a token: the user's row and their sub-service ids.
+    """
+    try:
+        token = Token.objects.select_related('user').only(
+            'key', *(f'user__{name}' for name in PRINCIPAL_FIELDS)
+        ).get(key=key)
+    except Token.DoesNotExist:
+        return None
+    user = token.user
+    sub_service_ids = []
+    if user.is_specialist:
+        sub_service_ids = list(SpecialistService.sub_service.through.objects.filter(
+            specialistservice__specialist_id=user.pk
+        ).values_list('subservice_id', flat=True))
+    return {
+        'user': [getattr(user, name) for name in PRINCIPAL_FIELDS],
+        'sub_service_ids': sub_service_ids,
+    }
+
+
+def principal_generation(key):
+    """
+    The token's current cache generation; invalidation moves it on, orphaning what was cached under the old one.
+    """
+    generation_key = PRINCIPAL_GENERATION_KEY.format(key=key)
+    generation = cache.get(generation_key)
+    if generation is None:
+        # Clock-based, so a generation lost to eviction never restarts below one still cached
+        generation = time.time_ns()
+        cache.add(generation_key, generation, PRINCIPAL_GENERATION_TIMEOUT)
+        generation = cache.get(generation_key, generation)
+    return generation
+
+
+def get_principal(key):
+    principal = local_principals.get(key)
+    if principal is None:
+        epoch = local_principals.epoch
+        cache_key = PRINCIPAL_CACHE_KEY.format(key=key, generation=principal_generation(key))
+        principal = cache.get(cache_key)
+        if principal is None:
+            principal = load_principal(key)
+            if principal is None:
+                return None
+            # Stored under the generation read before loading: if an invalidation
+            # ran meanwhile, nobody looks this entry up again
+            cache.set(cache_key, principal, PRINCIPAL_TIMEOUT)
+        local_principals.set(key, principal, epoch)
+    return principal
+
+
+def invalidate_principal(key):
+    try:
+        cache.incr(PRINCIPAL_GENERATION_KEY.format(key=key))
+    except ValueError:
+        # No generation, so nothing was cached for this token
+        pass
+    local_principals.delete(key)
+
+
+def invalidate_user_principal(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_principal(key)
+
+
+def principal_user(principal):
+    """
+    Rebuild the authenticated user from a principal, as TokenAuthentication would check it.
+    """
+    if principal is None:
+        raise AuthenticationFailed(_('Invalid token.'))
+    user = User.from_db('default', PRINCIPAL_FIELDS, principal['user'])
+    user.sub_service_ids = principal['sub_service_ids']
+    if not user.is_active:
+        raise AuthenticationFailed(_('User inactive or deleted.'))
+    return user
+
+
+async def aauthenticate(request):
+    """
+    Async counterpart of CachedTokenAuthentication for plain async views.
+
+    Returns the user for the request's "Authorization: Token <key>" header,
+    or None without one, and raises AuthenticationFailed like the sync class.
+    Principals already in the process-local cache cost no thread hop.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return None
+    if len(auth) != 2:
+        raise AuthenticationFailed(_('Invalid token header.'))
+    principal = local_principals.get(auth[1])
+    if principal is None:
+        principal = await sync_to_async(get_principal)(auth[1])
+    return principal_user(principal)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that resolves tokens from cache instead of the database.
+
+    The authenticated user is rebuilt from the cached row and carries the
+    specialist's sub_service_ids, so hot endpoints need no auth queries at all.
+    Entries are invalidated by signals on Token, User and the specialist's
+    sub-services, which requires a cache shared by every process; other
+    processes may still serve a stale principal from their local cache for at
+    most LOCAL_CACHE_TTL seconds.
+    """
+
+    def authenticate_credentials(self, key):
+        user = principal_user(get_principal(key))
+        return (user, Token(key=key, user=user))
@@ -0,0 +1,45 @@
+"""
+Streaming exports of wallet transaction history.
+
+Rows are read with .iterator(chunk_size=...) and encoded one line at a
+time, so an export holds one chunk of rows in memory however long the
+history is.
+"""
+import csv
+import json
+
+EXPORT_FIELDS = ('id', 'timestamp', 'amount', 'description')
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File-like object whose write() hands back the line csv.writer produced.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    return queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for pk, timestamp, amount, description in export_rows(queryset, chunk_size):
+        yield writer.writerow((pk, timestamp.isoformat(), amount, description))
+
+
+def jsonl_lines(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    for pk, timestamp, amount, description in export_rows(queryset, chunk_size):
+        yield json.dumps({
+            'id': pk, 'timestamp': timestamp.isoformat(), 'amount': str(amount), 'description': description,
+        }) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', csv_lines),
+    'jsonl': ('application/x-ndjson', jsonl_lines),
+}
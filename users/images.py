@@ -0,0 +1,70 @@
+import os
+from io import BytesIO
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import FileExtensionValidator
+from PIL import Image, UnidentifiedImageError
+
+MAX_PROFILE_PICTURE_SIZE = 400 * 1024
+MAX_PROFILE_PICTURE_PIXELS = 4096 * 4096
+PROFILE_PICTURE_FORMATS = ('PNG', 'JPEG')
+# Uploads are served back from MEDIA by name, so the name must not make them e.g. HTML
+PROFILE_PICTURE_EXTENSIONS = ('png', 'jpg', 'jpeg')
+THUMBNAIL_SIZES = (64, 128, 256)
+
+
+def read_image_size(file):
+    """
+    Return (width, height) from the image header without decoding any pixels.
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as img:
+            if img.format not in PROFILE_PICTURE_FORMATS:
+                raise ValidationError("Profile picture must be a PNG or JPEG image.")
+            return img.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise ValidationError("Upload a valid image.")
+    finally:
+        file.seek(0)
+
+
+def validate_profile_picture(file):
+    FileExtensionValidator(PROFILE_PICTURE_EXTENSIONS)(file)
+    # Reject oversized uploads before touching the image data at all
+    if file.size > MAX_PROFILE_PICTURE_SIZE:
+        raise ValidationError("Profile picture must be under 400 KB.")
+    width, height = read_image_size(file)
+    if width * height > MAX_PROFILE_PICTURE_PIXELS:
+        raise ValidationError("Profile picture dimensions are too large.")
+    if width != height:
+        raise ValidationError("Profile picture must have a 1:1 aspect ratio.")
+
+
+def thumbnail_name(profile, size):
+    return os.path.join('profile_pics', 'thumbs', f'{profile.pk}_{size}.webp')
+
+
+def generate_thumbnails(profile):
+    """
+    Render the profile picture as square WebP thumbnails and return {size: storage name}.
+    """
+    picture = profile.profile_picture
+    storage = picture.storage
+    with picture.open('rb'), Image.open(picture) as img:
+        if img.width * img.height > MAX_PROFILE_PICTURE_PIXELS:
+            raise ValidationError("Profile picture dimensions are too large.")
+        # Let JPEG decode at reduced scale when the source is much larger than the biggest thumbnail
+        img.draft('RGB', (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        thumbnails = {}
+        for size in sorted(THUMBNAIL_SIZES, reverse=True):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            img.save(buffer, 'WEBP', quality=85)
+            name = thumbnail_name(profile, size)
+            storage.delete(name)
+            thumbnails[str(size)] = storage.save(name, ContentFile(buffer.getvalue()))
+    return thumbnails
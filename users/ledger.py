@@ -0,0 +1,219 @@
+"""
+Wallet balances recomputed from the transaction history.
+
+Transaction rows are append-only, so a wallet's balance after transaction N
+is its latest checkpoint at or before N plus the sum of the transactions in
+between. create_checkpoints() periodically moves each busy wallet's
+checkpoint forward, keeping that tail bounded; reconcile() compares the
+recomputed balances with the stored Wallet.balance column.
+
+Payments stage the specialist's payout and the platform's commission as
+LedgerEntry rows. settle_ledger() applies them in batches: one Transaction
+per payout, one UPDATE for all the wallets in a batch and one for the
+platform account, however many payments the batch covers. An entry that
+can't be applied is set aside as failed rather than holding up the rest.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import LedgerEntry, LedgerEntryKind, PlatformAccount, Transaction, Wallet, WalletCheckpoint
+
+# Wallets get a new checkpoint once this many transactions follow their last one
+CHECKPOINT_INTERVAL = 1000
+# Transactions this recent may still have uncommitted neighbours with lower ids, so checkpoints stop short of them
+CHECKPOINT_SETTLE_TIME = timedelta(minutes=5)
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+# Platform account credited with the commission on every payment
+COMMISSION_ACCOUNT = 'commission'
+# Ledger entries applied per settlement transaction
+SETTLEMENT_BATCH_SIZE = 1000
+
+
+@dataclass
+class Drift:
+    wallet_id: int
+    stored: Decimal
+    expected: Decimal
+
+    @property
+    def difference(self):
+        return self.stored - self.expected
+
+
+def balance_at(wallet_id, transaction_id=None):
+    """
+    The wallet's balance right after transaction_id, or after its latest transaction.
+    """
+    checkpoints = WalletCheckpoint.objects.filter(wallet_id=wallet_id)
+    tail = Transaction.objects.filter(wallet_id=wallet_id)
+    if transaction_id is not None:
+        checkpoints = checkpoints.filter(last_transaction_id__lte=transaction_id)
+        tail = tail.filter(id__lte=transaction_id)
+    checkpoint = checkpoints.order_by('-last_transaction_id').values_list('last_transaction_id', 'balance').first()
+    since, balance = checkpoint or (0, ZERO)
+    return balance + tail.filter(id__gt=since).aggregate(total=Coalesce(Sum('amount'), Value(ZERO)))['total']
+
+
+def balance_as_of(wallet_id, moment):
+    """
+    The wallet's balance at a point in time.
+    """
+    last = Transaction.objects.filter(wallet_id=wallet_id, timestamp__lte=moment).order_by(
+        '-timestamp', '-id'
+    ).values_list('id', flat=True).first()
+    return balance_at(wallet_id, last or 0)
+
+
+def ledger_tails(wallet_ids, upto=None):
+    """
+    {wallet_id: (stored_balance, checkpoint_balance, checkpoint_id, tail_sum, tail_count, tail_last_id)},
+    counting tail transactions up to transaction id upto. Wallets without checkpoints start from zero.
+
+    Everything is read in one statement, so a payment or checkpoint committed
+    meanwhile is either wholly in the result or wholly out of it.
+    """
+    latest = WalletCheckpoint.objects.filter(wallet=OuterRef('pk')).order_by('-last_transaction_id')
+    tail = Transaction.objects.filter(wallet=OuterRef('pk'), id__gt=OuterRef('checkpoint_id'))
+    if upto is not None:
+        tail = tail.filter(id__lte=upto)
+    tail = tail.order_by().values('wallet_id')
+    wallets = Wallet.objects.filter(pk__in=wallet_ids).annotate(
+        checkpoint_balance=Coalesce(Subquery(latest.values('balance')[:1]), Value(ZERO)),
+        checkpoint_id=Coalesce(Subquery(latest.values('last_transaction_id')[:1]), Value(0)),
+        tail_sum=Coalesce(Subquery(tail.annotate(total=Sum('amount')).values('total')), Value(ZERO)),
+        tail_count=Coalesce(Subquery(tail.annotate(count=Count('id')).values('count')), Value(0)),
+        tail_last_id=Subquery(tail.annotate(last_id=Max('id')).values('last_id')),
+    )
+    # Computed columns come back unrounded, and as floats on SQLite
+    return {
+        wallet_id: (stored, checkpoint_balance.quantize(CENT), checkpoint_id, tail_sum.quantize(CENT), count, last_id)
+        for wallet_id, stored, checkpoint_balance, checkpoint_id, tail_sum, count, last_id in wallets.values_list(
+            'pk', 'balance', 'checkpoint_balance', 'checkpoint_id', 'tail_sum', 'tail_count', 'tail_last_id'
+        )
+    }
+
+
+def create_checkpoints(wallet_ids, interval=CHECKPOINT_INTERVAL, now=None):
+    """
+    Checkpoint every wallet in wallet_ids with at least interval settled transactions since its last checkpoint.
+    Returns the number of checkpoints written.
+    """
+    settled = (now or timezone.now()) - CHECKPOINT_SETTLE_TIME
+    # Walks the primary key backwards, so only the unsettled transactions are skipped
+    upto = Transaction.objects.filter(timestamp__lte=settled).order_by('-id').values_list('id', flat=True).first()
+    if upto is None:
+        return 0
+    checkpoints = [
+        WalletCheckpoint(wallet_id=wallet_id, last_transaction_id=last_id, balance=balance + total)
+        for wallet_id, (_, balance, _, total, count, last_id) in ledger_tails(wallet_ids, upto=upto).items()
+        if count >= interval
+    ]
+    with transaction.atomic():
+        WalletCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
+    return len(checkpoints)
+
+
+def reconcile(wallet_ids):
+    """
+    Drift for every wallet in wallet_ids whose stored balance disagrees with its transactions.
+    """
+    drifts = []
+    for wallet_id, (stored, balance, _, total, _, _) in ledger_tails(wallet_ids).items():
+        expected = balance + total
+        if stored != expected:
+            drifts.append(Drift(wallet_id, stored, expected))
+    return drifts
+
+
+def wallet_id_chunks(chunk_size, start_pk=0):
+    """
+    Consecutive lists of wallet ids, chunk_size at a time.
+    """
+    last_pk = start_pk
+    while True:
+        chunk = list(
+            Wallet.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1]
+
+
+def apply_entries(entries, now):
+    """
+    Credit the (pk, kind, wallet_id, amount, idempotency_key) entries and mark them settled.
+    """
+    payouts = defaultdict(Decimal)
+    commission = ZERO
+    transactions = []
+    for pk, kind, wallet_id, amount, idempotency_key in entries:
+        if kind == LedgerEntryKind.PAYOUT:
+            payouts[wallet_id] += amount
+            transactions.append(Transaction(wallet_id=wallet_id, amount=amount,
+                                            description="Earnings from service", idempotency_key=idempotency_key))
+        else:
+            commission += amount
+
+    Transaction.objects.bulk_create(transactions)
+    if payouts:
+        Wallet.objects.filter(pk__in=payouts).update(balance=F('balance') + Case(
+            *(When(pk=wallet_id, then=Value(total)) for wallet_id, total in payouts.items()),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ))
+    if commission:
+        credited = PlatformAccount.objects.filter(name=COMMISSION_ACCOUNT).update(balance=F('balance') + commission)
+        if not credited:
+            # Only the first settlement ever gets here; get_or_create settles a race between two of them
+            PlatformAccount.objects.get_or_create(name=COMMISSION_ACCOUNT)
+            PlatformAccount.objects.filter(name=COMMISSION_ACCOUNT).update(balance=F('balance') + commission)
+    LedgerEntry.objects.filter(pk__in=[entry[0] for entry in entries]).update(settled_at=now)
+
+
+def settle_batch(batch_size=SETTLEMENT_BATCH_SIZE, now=None):
+    """
+    Apply up to batch_size pending ledger entries. Returns the number settled or set aside as failed.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Concurrent settlements take disjoint batches where the database can skip locked rows
+        entries = list(
+            LedgerEntry.objects.select_for_update(skip_locked=True)
+            .filter(settled_at__isnull=True, failed_at__isnull=True).order_by('pk')
+            .values_list('pk', 'kind', 'wallet_id', 'amount', 'idempotency_key')[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        try:
+            with transaction.atomic():
+                apply_entries(entries, now)
+        except (DataError, IntegrityError):
+            # Find the entries at fault one by one, so they don't block every batch after this one
+            for entry in entries:
+                try:
+                    with transaction.atomic():
+                        apply_entries([entry], now)
+                except (DataError, IntegrityError):
+                    LedgerEntry.objects.filter(pk=entry[0]).update(failed_at=now)
+    return len(entries)
+
+
+def settle_ledger(batch_size=SETTLEMENT_BATCH_SIZE):
+    """
+    Settle every pending ledger entry, one batch per transaction. Returns the number settled.
+    """
+    settled = 0
+    while count := settle_batch(batch_size):
+        settled += count
+        if count < batch_size:
+            break
+    return settled
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.utils import create_missing_wallets
+
+
+class Command(BaseCommand):
+    help = "Create an empty wallet for every user from before wallets were created on sign-up."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Wallets inserted per query.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        created = create_missing_wallets(chunk_size=options['chunk_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Created {created} wallets in {elapsed:.1f}s.")
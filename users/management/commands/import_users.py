@@ -0,0 +1,140 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from services.models import SpecialistService, SubService
+from users.models import Profile, User, Wallet
+
+ROLES = ('customer', 'specialist')
+
+
+def _setup_worker():
+    # Spawned (non-forked) workers need their own app registry to hash passwords
+    django.setup()
+
+
+def read_rows(path):
+    """
+    Stream rows from a CSV or JSONL file; CSV sub_services are separated by ';'.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                row['sub_services'] = [value for value in (row.get('sub_services') or '').split(';') if value]
+                yield row
+
+
+class Command(BaseCommand):
+    help = "Bulk import customers and specialists from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or .jsonl file with username, email, password, role, "
+                                         "main_service, sub_services and bio columns.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows inserted per transaction.")
+        parser.add_argument('--workers', type=int, default=None, help="Password hashing processes.")
+
+    def handle(self, *args, **options):
+        # In-memory catalog: sub-service id -> main service id
+        self.catalog = dict(SubService.objects.values_list('id', 'main_service_id'))
+        self.main_service_ids = set(self.catalog.values())
+        chunk_size = options['chunk_size']
+
+        imported = skipped = 0
+        started = time.monotonic()
+        rows = enumerate(read_rows(options['path']), start=1)
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_setup_worker) as executor:
+            while chunk := list(islice(rows, chunk_size)):
+                valid = []
+                for line, row in chunk:
+                    try:
+                        valid.append(self.clean_row(row))
+                    except CommandError as exc:
+                        self.stderr.write(f"Row {line}: {exc}")
+                valid = self.drop_existing(valid)
+                skipped += len(chunk) - len(valid)
+                imported += self.import_chunk(valid, executor, chunk_size)
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(f"Imported {imported} users, skipped {skipped} ({rate:.0f} rows/s).")
+
+    def clean_row(self, row):
+        for field in ('username', 'email', 'password'):
+            if not row.get(field):
+                raise CommandError(f"'{field}' is required.")
+        role = row.get('role') or 'specialist'
+        if role not in ROLES:
+            raise CommandError(f"Unknown role '{role}'.")
+
+        main_service = sub_services = None
+        if role == 'specialist':
+            try:
+                main_service = int(row.get('main_service') or 0)
+                sub_services = list(dict.fromkeys(int(value) for value in row.get('sub_services') or []))
+            except (TypeError, ValueError):
+                raise CommandError("Service ids must be integers.")
+            if main_service not in self.main_service_ids:
+                raise CommandError("Specialists must select an existing main service.")
+            if not sub_services:
+                raise CommandError("Select at least one sub-service.")
+            if any(self.catalog.get(sub_service) != main_service for sub_service in sub_services):
+                raise CommandError("All sub-services must match the main service.")
+
+        return {
+            'username': row['username'], 'email': row['email'], 'password': row['password'], 'role': role,
+            'main_service': main_service, 'sub_services': sub_services, 'bio': row.get('bio') or None,
+        }
+
+    def drop_existing(self, rows):
+        usernames = set()
+        existing = set(User.objects.filter(username__in=[row['username'] for row in rows])
+                       .values_list('username', flat=True))
+        unique = []
+        for row in rows:
+            if row['username'] in existing or row['username'] in usernames:
+                self.stderr.write(f"User '{row['username']}' already exists.")
+                continue
+            usernames.add(row['username'])
+            unique.append(row)
+        return unique
+
+    def import_chunk(self, rows, executor, chunk_size):
+        if not rows:
+            return 0
+        hashes = executor.map(make_password, [row['password'] for row in rows],
+                              chunksize=max(len(rows) // 32, 1))
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=row['username'], email=row['email'], password=password, role=row['role'],
+                     status='pending_approval' if row['role'] == 'specialist' else 'approved')
+                for row, password in zip(rows, hashes)
+            ], batch_size=chunk_size)
+            Profile.objects.bulk_create(
+                [Profile(user=user, bio=row['bio']) for user, row in zip(users, rows)], batch_size=chunk_size
+            )
+            # bulk_create() skips the post_save hook that gives other users their wallet
+            Wallet.objects.bulk_create([Wallet(user=user) for user in users], batch_size=chunk_size)
+
+            specialists = [(user, row) for user, row in zip(users, rows) if row['role'] == 'specialist']
+            specialist_services = SpecialistService.objects.bulk_create([
+                SpecialistService(specialist=user, main_service_id=row['main_service']) for user, row in specialists
+            ], batch_size=chunk_size)
+            through = SpecialistService.sub_service.through
+            through.objects.bulk_create([
+                through(specialistservice_id=specialist_service.pk, subservice_id=sub_service)
+                for specialist_service, (user, row) in zip(specialist_services, specialists)
+                for sub_service in row['sub_services']
+            ], batch_size=chunk_size)
+        return len(users)
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from users.ledger import reconcile, wallet_id_chunks
+
+
+def _setup_worker(database_name):
+    # Never share a connection inherited from the parent; each worker opens its own
+    connections.close_all()
+    # Spawned workers need their own app registry, pointed at the database the parent uses
+    django.setup()
+    settings.DATABASES['default']['NAME'] = database_name
+
+
+def reconcile_chunk(wallet_ids):
+    return len(wallet_ids), [(drift.wallet_id, drift.stored, drift.expected) for drift in reconcile(wallet_ids)]
+
+
+class Command(BaseCommand):
+    help = "Check every wallet balance against its latest checkpoint and the transactions since."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Wallets checked per task.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes; 0 checks every chunk in this process.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        chunks = wallet_id_chunks(options['chunk_size'])
+        if options['workers'] == 0:
+            checked, drifted = self.report(map(reconcile_chunk, chunks))
+        else:
+            database_name = connection.settings_dict['NAME']
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_setup_worker,
+                                     initargs=(database_name,)) as executor:
+                # Forked workers start with the first task; start them before the chunk queries reopen a connection
+                executor.submit(int).result()
+                checked, drifted = self.report(executor.map(reconcile_chunk, chunks))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Checked {checked} wallets, {drifted} drifted, in {elapsed:.1f}s.")
+        if drifted:
+            raise CommandError(f"{drifted} wallet balances do not match their transactions.")
+
+    def report(self, results):
+        checked = drifted = 0
+        for count, drifts in results:
+            checked += count
+            drifted += len(drifts)
+            for wallet_id, stored, expected in drifts:
+                self.stdout.write(f"Wallet #{wallet_id}: stored {stored}, expected {expected} "
+                                  f"(drift {stored - expected}).")
+        return checked, drifted
@@ -4,7 +4,8 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.core.validators import FileExtensionValidator
-from PIL import Image
+
+from .images import PROFILE_PICTURE_EXTENSIONS, validate_profile_picture
 
 
 class User(AbstractUser):
@@ -23,6 +24,12 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='inactive')
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Backs the admin's prefix search; username is indexed by its unique constraint
+            models.Index(fields=['email'], name='user_email_idx'),
+        ]
+
     @property
     def is_specialist(self):
         return self.role == 'specialist'
@@ -40,21 +47,19 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     profile_picture = models.ImageField(
         upload_to='profile_pics/',
-        validators=[FileExtensionValidator(['png', 'jpg', 'jpeg'])],
+        validators=[FileExtensionValidator(PROFILE_PICTURE_EXTENSIONS)],
         blank=True,
         null=True
     )
     bio = models.TextField(blank=True, null=True)
+    # Size -> storage name of the generated WebP thumbnails, plus the 'source' picture they were made from
+    thumbnails = models.JSONField(default=dict, blank=True)
 
     def clean(self):
         if self.user.is_specialist and not self.profile_picture:
             raise ValidationError('Specialists must have a profile picture.')
         if self.profile_picture:
-            img = Image.open(self.profile_picture)
-            if img.width != img.height:
-                raise ValidationError("Profile picture must have a 1:1 aspect ratio.")
-            if self.profile_picture.size > 400 * 1024:
-                raise ValidationError("Profile picture must be under 400 KB.")
+            validate_profile_picture(self.profile_picture)
 
 
 class Wallet(models.Model):
@@ -70,6 +75,80 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
     description = models.CharField(max_length=255)
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'idempotency_key'], name='unique_wallet_idempotency_key'),
+        ]
+        indexes = [
+            # Keyset pagination and export of a wallet's history, newest first
+            models.Index(fields=['wallet', 'timestamp', 'id'], name='transaction_history_idx'),
+        ]
+
+    def __str__(self):
+        return f"Transaction for wallet #{self.wallet_id} - Amount: {self.amount} on {self.timestamp}"
+
+
+class WalletCheckpoint(models.Model):
+    """
+    A wallet's balance as of one of its transactions, so balances can be
+    recomputed from the nearest checkpoint instead of the whole history.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='checkpoints')
+    last_transaction_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'last_transaction_id'], name='unique_wallet_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f"Wallet #{self.wallet_id} at transaction #{self.last_transaction_id}: {self.balance}"
+
+
+class PlatformAccount(models.Model):
+    """
+    A ledger account held by the platform itself, such as its commission income.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    def __str__(self):
+        return f"Platform account '{self.name}' - Balance: {self.balance}"
+
+
+class LedgerEntryKind(models.TextChoices):
+    PAYOUT = 'payout', 'Specialist payout'
+    COMMISSION = 'commission', 'Platform commission'
+
+
+class LedgerEntry(models.Model):
+    """
+    A credit staged by a payment and applied to its account by the next settlement.
+
+    Entries are only ever inserted and then marked settled, so payments never
+    contend for the platform account's row or a busy specialist's wallet.
+    """
+    kind = models.CharField(max_length=20, choices=LedgerEntryKind.choices)
+    # The specialist credited by a payout; commission goes to the platform account
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_entries')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+    # Set aside by a settlement that could not apply it; cleared to retry
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Settlement scans only the entries still waiting for it
+            models.Index(fields=['id'], condition=models.Q(settled_at__isnull=True, failed_at__isnull=True),
+                         name='ledger_entry_pending_idx'),
+        ]
 
     def __str__(self):
-        return f"Transaction for {self.wallet.user.username} - Amount: {self.amount} on {self.timestamp}"
+        state = 'settled' if self.settled_at else 'failed' if self.failed_at else 'pending'
+        return f"{self.get_kind_display()} of {self.amount} ({state})"
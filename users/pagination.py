@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TransactionHistoryPagination(CursorPagination):
+    """
+    Keyset pagination over a wallet's transactions, newest first, matching
+    the (wallet, timestamp, id) history index.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -1,15 +1,31 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 from services.models import MainService, SubService, SpecialistService
-from .models import Profile
+from .images import validate_profile_picture
+from .models import Profile, Transaction
 
 User = get_user_model()
 
 
+class ProfilePictureField(serializers.FileField):
+    """
+    Validates profile pictures from their name, size and image header only, before any decoding.
+    """
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        try:
+            validate_profile_picture(file)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+        return file
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
-    profile_picture = serializers.ImageField(write_only=True, required=False)
+    profile_picture = ProfilePictureField(write_only=True, required=False)
     bio = serializers.CharField(write_only=True, required=False)
 
     # New fields for main service and sub-services
@@ -72,13 +88,8 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             status=validated_data['status'],
         )
 
-        # Create the Profile and assign bio and profile_picture
-        profile = Profile.objects.create(user=user)
-        if profile_picture:
-            profile.profile_picture = profile_picture
-        if bio:
-            profile.bio = bio
-        profile.save()  # Save after assigning the fields
+        # Create the Profile with bio and profile_picture in a single insert
+        Profile.objects.create(user=user, profile_picture=profile_picture, bio=bio or None)
 
         # Assign services if the user is a specialist
         if user.role == 'specialist':
@@ -90,6 +101,21 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
+    profile_picture = ProfilePictureField(required=False, allow_null=True)
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Profile
-        fields = ['profile_picture', 'bio']
\ No newline at end of file
+        fields = ['profile_picture', 'bio', 'thumbnails']
+
+    def get_thumbnails(self, profile):
+        # Only thumbnails rendered from the current picture; clients fall back to the original until then
+        if not profile.profile_picture or profile.thumbnails.get('source') != profile.profile_picture.name:
+            return {}
+        storage = profile.profile_picture.storage
+        return {size: storage.url(name) for size, name in profile.thumbnails.items() if size != 'source'}
+
+class TransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = ['id', 'amount', 'description', 'timestamp']
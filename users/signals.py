@@ -0,0 +1,60 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from services.models import SpecialistService
+from .authentication import invalidate_principal, invalidate_user_principal
+from .models import Profile, User, Wallet
+from .tasks import generate_profile_thumbnails
+
+# Cached principals are dropped after commit, so a concurrent request can't re-cache pre-commit state
+
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_token_principal(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_principal, instance.key))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_user_principal, instance.pk))
+
+
+@receiver(post_save, sender=User)
+def create_user_wallet(sender, instance, created, raw=False, **kwargs):
+    # Every user has a wallet from sign-up, so reading one never has to create it
+    if created and not raw:
+        Wallet.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=SpecialistService)
+def invalidate_specialist_service(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_user_principal, instance.specialist_id))
+
+
+@receiver(m2m_changed, sender=SpecialistService.sub_service.through)
+def invalidate_specialist_sub_services(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            transaction.on_commit(partial(invalidate_user_principal, instance.specialist_id))
+        return
+
+    # Changed from the SubService side: pk_set holds specialist service ids, or None on clear
+    if action == 'pre_clear':
+        specialist_ids = instance.specialist_services.values_list('specialist_id', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        specialist_ids = SpecialistService.objects.filter(pk__in=pk_set).values_list('specialist_id', flat=True)
+    else:
+        return
+    for specialist_id in specialist_ids:
+        transaction.on_commit(partial(invalidate_user_principal, specialist_id))
+
+
+@receiver(post_save, sender=Profile)
+def schedule_profile_thumbnails(sender, instance, **kwargs):
+    # Thumbnails are rendered off the request path; the task's own update() doesn't re-trigger this
+    if instance.profile_picture and instance.thumbnails.get('source') != instance.profile_picture.name:
+        transaction.on_commit(partial(generate_profile_thumbnails.delay, instance.pk))
@@ -0,0 +1,25 @@
+from celery import shared_task
+
+from .images import generate_thumbnails
+from .ledger import CHECKPOINT_INTERVAL, create_checkpoints, settle_ledger, wallet_id_chunks
+from .models import Profile
+
+
+@shared_task
+def generate_profile_thumbnails(profile_id):
+    profile = Profile.objects.filter(pk=profile_id).only('id', 'profile_picture').first()
+    if profile is None or not profile.profile_picture:
+        return
+    thumbnails = generate_thumbnails(profile)
+    thumbnails['source'] = profile.profile_picture.name
+    Profile.objects.filter(pk=profile_id, profile_picture=profile.profile_picture.name).update(thumbnails=thumbnails)
+
+
+@shared_task
+def create_wallet_checkpoints_task(chunk_size=1000, interval=CHECKPOINT_INTERVAL):
+    return sum(create_checkpoints(wallet_ids, interval) for wallet_ids in wallet_id_chunks(chunk_size))
+
+
+@shared_task
+def settle_ledger_task():
+    return settle_ledger()
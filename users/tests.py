@@ -0,0 +1,666 @@
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.sql.compiler import SQLCompiler
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from orders.models import Order
+from services.models import MainService, SubService, SpecialistService
+from .authentication import invalidate_user_principal, load_principal, local_principals
+from .images import MAX_PROFILE_PICTURE_SIZE, validate_profile_picture
+from .management.commands.reconcile_wallets import _setup_worker
+from .ledger import balance_as_of, balance_at, create_checkpoints, reconcile
+from . import views
+from .models import Profile, Transaction, User, Wallet, WalletCheckpoint
+from .serializers import ProfileSerializer
+from .tasks import create_wallet_checkpoints_task, generate_profile_thumbnails
+from .utils import recharge, recharge_key
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        main_service = MainService.objects.create(name='Cleaning')
+        cls.windows = SubService.objects.create(main_service=main_service, name='Windows', base_price=Decimal('50.00'))
+        cls.carpets = SubService.objects.create(main_service=main_service, name='Carpets', base_price=Decimal('80.00'))
+        customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        cls.specialist = User.objects.create_user(username='specialist', password='pass', role='specialist')
+        cls.specialist_service = SpecialistService.objects.create(specialist=cls.specialist, main_service=main_service)
+        cls.specialist_service.sub_service.set([cls.windows])
+        for sub_service in (cls.windows, cls.carpets):
+            Order.objects.create(
+                customer=customer, sub_service=sub_service, description='Clean', suggested_price=Decimal('60.00'),
+                scheduled_date=timezone.now() + timedelta(days=1), visible_until=timezone.now() + timedelta(hours=1)
+            )
+        cls.token = Token.objects.create(user=cls.specialist)
+
+    def setUp(self):
+        cache.clear()
+        local_principals.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('available-orders')
+
+    def test_cached_principal_skips_auth_queries(self):
+        self.client.get(self.url)
+
+        # Only the matching query itself remains
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_invalid_token_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_sub_service_changes_invalidate_principal(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.specialist_service.sub_service.add(self.carpets)
+
+        self.assertEqual(len(self.client.get(self.url).data['results']), 2)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.specialist.is_active = False
+            self.specialist.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_invalidation_during_load_is_not_cached_over(self):
+        load = load_principal
+
+        def racing_load(key):
+            principal = load(key)
+            # The user is deactivated, and the cache invalidated, while this request is still loading
+            User.objects.filter(pk=self.specialist.pk).update(is_active=False)
+            invalidate_user_principal(self.specialist.pk)
+            return principal
+
+        with mock.patch('users.authentication.load_principal', racing_load):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+def make_image(size, fmt='PNG', mode='RGB', name='picture.png'):
+    buffer = BytesIO()
+    Image.new(mode, size).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_oversized_upload_is_rejected_before_decoding(self):
+        upload = SimpleUploadedFile('picture.png', b'\0' * (MAX_PROFILE_PICTURE_SIZE + 1))
+
+        with mock.patch('users.images.Image.open') as image_open:
+            with self.assertRaisesMessage(ValidationError, 'under 400 KB'):
+                validate_profile_picture(upload)
+        image_open.assert_not_called()
+
+    def test_rejects_non_square_and_decompression_bombs(self):
+        with self.assertRaisesMessage(ValidationError, '1:1 aspect ratio'):
+            validate_profile_picture(make_image((40, 30)))
+        with self.assertRaisesMessage(ValidationError, 'too large'):
+            validate_profile_picture(make_image((5000, 5000), mode='1'))
+        with self.assertRaisesMessage(ValidationError, 'valid image'):
+            validate_profile_picture(SimpleUploadedFile('picture.png', b'not an image'))
+
+    def test_rejects_image_with_non_image_extension(self):
+        with self.assertRaisesMessage(ValidationError, 'File extension “html” is not allowed.'):
+            validate_profile_picture(make_image((300, 300), name='evil.html'))
+
+        user = User.objects.create_user(username='customer', password='pass', role='customer')
+        client = APIClient()
+        client.force_authenticate(user)
+        Profile.objects.create(user=user)
+        response = client.patch(reverse('profile'), {'profile_picture': make_image((300, 300), name='evil.html')},
+                                format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('profile_picture', response.data)
+        self.assertFalse(os.listdir(self.media_root))
+
+    def test_registration_schedules_thumbnails(self):
+        main_service = MainService.objects.create(name='Cleaning')
+        sub_service = SubService.objects.create(main_service=main_service, name='Windows', base_price=Decimal('50'))
+
+        with mock.patch('users.signals.generate_profile_thumbnails') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = APIClient().post(reverse('register'), {
+                    'username': 'specialist', 'email': 'specialist@example.com', 'password': 'pass',
+                    'role': 'specialist', 'main_service': main_service.pk, 'sub_services': [sub_service.pk],
+                    'profile_picture': make_image((300, 300)),
+                }, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        profile = Profile.objects.get(user__username='specialist')
+        task.delay.assert_called_once_with(profile.pk)
+
+    def test_generates_webp_thumbnails(self):
+        user = User.objects.create_user(username='customer', password='pass', role='customer')
+        with mock.patch('users.signals.generate_profile_thumbnails'):
+            profile = Profile.objects.create(user=user, profile_picture=make_image((600, 600), 'JPEG', name='p.jpg'))
+
+        generate_profile_thumbnails(profile.pk)
+
+        profile.refresh_from_db()
+        thumbnails = ProfileSerializer(profile).data['thumbnails']
+        self.assertEqual(set(thumbnails), {'64', '128', '256'})
+        with Image.open(profile.profile_picture.storage.open(profile.thumbnails['128'])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (128, 128)))
+
+
+class ImportUsersCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cleaning = MainService.objects.create(name='Cleaning')
+        cls.plumbing = MainService.objects.create(name='Plumbing')
+        cls.windows = SubService.objects.create(main_service=cls.cleaning, name='Windows', base_price=Decimal('50'))
+        cls.carpets = SubService.objects.create(main_service=cls.cleaning, name='Carpets', base_price=Decimal('80'))
+        cls.pipes = SubService.objects.create(main_service=cls.plumbing, name='Pipes', base_price=Decimal('90'))
+
+    def write_input(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_users', path, '--workers=2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_csv_specialists_and_customers(self):
+        path = self.write_input('.csv', (
+            'username,email,password,role,main_service,sub_services,bio\n'
+            f'alice,alice@example.com,secret1,specialist,{self.cleaning.pk},{self.windows.pk};{self.carpets.pk},Hi\n'
+            f'bob,bob@example.com,secret2,customer,,,\n'
+            f'carol,carol@example.com,secret3,specialist,{self.cleaning.pk},{self.pipes.pk},\n'
+        ))
+
+        out, err = self.run_import(path, '--chunk-size=2')
+
+        self.assertIn('Imported 2 users, skipped 1', out)
+        self.assertIn('Row 3: All sub-services must match the main service.', err)
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('secret1'))
+        self.assertEqual(alice.status, 'pending_approval')
+        self.assertEqual(alice.profile.bio, 'Hi')
+        self.assertEqual(set(alice.specialist_service.sub_service.all()), {self.windows, self.carpets})
+        self.assertEqual(User.objects.get(username='bob').status, 'approved')
+
+    def test_imports_jsonl_and_skips_existing_users(self):
+        User.objects.create_user(username='alice', password='pass', role='customer')
+        path = self.write_input('.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'username': 'alice', 'email': 'a@example.com', 'password': 'x', 'role': 'customer'},
+            {'username': 'dave', 'email': 'd@example.com', 'password': 'x', 'role': 'specialist',
+             'main_service': self.plumbing.pk, 'sub_services': [self.pipes.pk]},
+        ]))
+
+        out, err = self.run_import(path)
+
+        self.assertIn('Imported 1 users, skipped 1', out)
+        self.assertIn("User 'alice' already exists.", err)
+        self.assertEqual(list(User.objects.get(username='dave').specialist_service.sub_service.all()), [self.pipes])
+        self.assertEqual(User.objects.get(username='dave').wallet.balance, Decimal('0.00'))
+
+
+class AsyncWalletViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        Wallet.objects.filter(user=cls.customer).update(balance=Decimal('42.50'))
+
+    async def test_async_wallet_matches_sync_view(self):
+        async def auser():
+            return self.customer
+
+        request = AsyncRequestFactory().get('/api/users/wallet/')
+        request.user, request.auser = self.customer, auser
+        sync_request = RequestFactory().get('/api/users/wallet/')
+        sync_request.user = self.customer
+
+        response = await views.awallet(request)
+        expected = await sync_to_async(views.wallet)(sync_request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+        self.assertIn(b'$42.50', response.content)
+
+
+class TransactionHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='specialist', password='pass', role='specialist')
+        cls.wallet = Wallet.objects.get(user=cls.user)
+        other = User.objects.create_user(username='other', password='pass', role='customer')
+        Transaction.objects.create(wallet=other.wallet, amount=Decimal('1.00'),
+                                   description='Not yours')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_transactions(self, count, start=None):
+        start = start or timezone.now() - timedelta(days=count)
+        transactions = Transaction.objects.bulk_create([
+            Transaction(wallet=self.wallet, amount=Decimal(i % 500) + Decimal('0.25'), description=f'Payment, #{i}')
+            for i in range(count)
+        ])
+        # Days apart, with ties so the id tiebreaker matters
+        for i, transaction in enumerate(transactions):
+            transaction.timestamp = start + timedelta(days=i // 2)
+        Transaction.objects.bulk_update(transactions, ['timestamp'], batch_size=1000)
+        return transactions
+
+    def export(self, file_format):
+        response = self.client.get(reverse('transaction-export', args=[file_format]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_history_walks_every_transaction_newest_first(self):
+        transactions = self.add_transactions(11)
+
+        seen = []
+        url = f"{reverse('transaction-history')}?page_size=4"
+        while url:
+            response = self.client.get(url)
+            seen.extend(transaction['id'] for transaction in response.data['results'])
+            url = response.data['next']
+
+        expected = sorted(transactions, key=lambda transaction: (transaction.timestamp, transaction.id), reverse=True)
+        self.assertEqual(seen, [transaction.id for transaction in expected])
+
+    def test_csv_and_jsonl_exports(self):
+        transactions = self.add_transactions(3)
+
+        rows = list(csv.reader(b''.join(self.export('csv').streaming_content).decode().splitlines()))
+        lines = b''.join(self.export('jsonl').streaming_content).decode().splitlines()
+
+        self.assertEqual(rows[0], ['id', 'timestamp', 'amount', 'description'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [transaction.id for transaction in transactions])
+        self.assertEqual(rows[1][3], 'Payment, #0')
+        self.assertEqual(json.loads(lines[-1])['amount'], '2.25')
+        self.assertEqual(self.client.get(reverse('transaction-export', args=['xml'])).status_code, 404)
+
+    def test_export_memory_stays_flat_as_history_grows(self):
+        # Scaled down from a million rows: peak memory must not track the row count
+        def peak_while_exporting():
+            tracemalloc.start()
+            try:
+                size = sum(len(chunk) for chunk in self.export('csv').streaming_content)
+                return size, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.add_transactions(5000)
+        small_size, small_peak = peak_while_exporting()
+        self.add_transactions(20000, start=timezone.now())
+        large_size, large_peak = peak_while_exporting()
+
+        self.assertGreater(large_size, small_size * 4)
+        self.assertLess(large_peak, small_peak * 1.5)
+
+    def test_str_does_not_query(self):
+        transaction = Transaction.objects.filter(wallet=self.wallet).first() or self.add_transactions(1)[0]
+
+        with self.assertNumQueries(0):
+            str(transaction)
+
+
+class WalletLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='customer', password='pass', role='customer')
+        cls.wallet = Wallet.objects.get(user=cls.user)
+
+    def add_transactions(self, amounts, wallet=None):
+        wallet = wallet or self.wallet
+        transactions = Transaction.objects.bulk_create([
+            Transaction(wallet=wallet, amount=Decimal(amount), description='Payment') for amount in amounts
+        ])
+        Wallet.objects.filter(pk=wallet.pk).update(balance=sum(
+            Transaction.objects.filter(wallet=wallet).values_list('amount', flat=True), Decimal('0.00')
+        ))
+        return transactions
+
+    def checkpoint(self, interval=1):
+        return create_checkpoints([self.wallet.pk], interval=interval, now=timezone.now() + timedelta(hours=1))
+
+    def test_balance_is_checkpoint_plus_tail(self):
+        first = self.add_transactions(['100.00', '-30.50', '12.25'])
+        self.assertEqual(self.checkpoint(), 1)
+        second = self.add_transactions(['-1.75', '40.00'])
+
+        checkpoint = WalletCheckpoint.objects.get(wallet=self.wallet)
+        self.assertEqual((checkpoint.last_transaction_id, checkpoint.balance), (first[-1].pk, Decimal('81.75')))
+        self.assertEqual(balance_at(self.wallet.pk), Decimal('120.00'))
+        # Historical balances before and after the checkpoint
+        self.assertEqual(balance_at(self.wallet.pk, first[0].pk), Decimal('100.00'))
+        self.assertEqual(balance_at(self.wallet.pk, second[0].pk), Decimal('80.00'))
+        self.assertEqual(balance_as_of(self.wallet.pk, timezone.now() - timedelta(days=1)), Decimal('0.00'))
+
+    def test_checkpoint_bounds_the_tail_sum(self):
+        self.add_transactions(['1.00'] * 20)
+        self.assertEqual(self.checkpoint(interval=50), 0)
+        self.assertEqual(self.checkpoint(interval=20), 1)
+        # Nothing new since the last checkpoint
+        self.assertEqual(self.checkpoint(), 0)
+        tail = self.add_transactions(['2.00'])
+
+        with self.assertNumQueries(2):
+            self.assertEqual(balance_at(self.wallet.pk), Decimal('22.00'))
+        self.assertEqual(balance_at(self.wallet.pk, tail[0].pk - 1), Decimal('20.00'))
+
+    def test_checkpoints_skip_unsettled_transactions(self):
+        self.add_transactions(['5.00'])
+
+        self.assertEqual(create_checkpoints([self.wallet.pk], interval=1), 0)
+        self.assertEqual(self.checkpoint(), 1)
+
+    def test_reconcile_reports_drift(self):
+        other = User.objects.create_user(username='other', password='pass').wallet
+        self.add_transactions(['10.00', '5.00'])
+        self.add_transactions(['7.00'], wallet=other)
+        self.checkpoint()
+        self.assertEqual(reconcile([self.wallet.pk, other.pk]), [])
+
+        Wallet.objects.filter(pk=other.pk).update(balance=Decimal('9.00'))
+        [drift] = reconcile([self.wallet.pk, other.pk])
+
+        self.assertEqual((drift.wallet_id, drift.stored, drift.expected), (other.pk, Decimal('9.00'), Decimal('7.00')))
+        self.assertEqual(drift.difference, Decimal('2.00'))
+
+    def test_checkpoint_task_walks_every_wallet(self):
+        self.add_transactions(['3.00'] * 3)
+        User.objects.create_user(username='idle', password='pass')
+        with mock.patch('users.ledger.CHECKPOINT_SETTLE_TIME', timedelta(hours=-1)):
+            self.assertEqual(create_wallet_checkpoints_task(chunk_size=1, interval=2), 1)
+
+
+class LedgerSnapshotTests(TransactionTestCase):
+    def setUp(self):
+        self.wallet = User.objects.create_user(username='customer', password='pass', role='customer').wallet
+        Transaction.objects.bulk_create([
+            Transaction(wallet=self.wallet, amount=Decimal('5.00'), description='Payment') for _ in range(3)
+        ])
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('15.00'))
+
+    def commit_after_each_query(self, write):
+        """
+        Commit write from another connection after every query read outside a transaction, as a concurrent
+        request would. Inside a transaction SQLite would make write wait for it.
+        """
+        execute_sql = SQLCompiler.execute_sql
+        reader = threading.current_thread()
+
+        def execute_then_write(compiler, *args, **kwargs):
+            result = execute_sql(compiler, *args, **kwargs)
+            if threading.current_thread() is reader and not compiler.connection.in_atomic_block:
+                thread = threading.Thread(target=lambda: (write(), connections.close_all()))
+                thread.start()
+                thread.join()
+            return result
+        return mock.patch.object(SQLCompiler, 'execute_sql', execute_then_write)
+
+    def test_payment_committed_mid_reconcile_is_not_drift(self):
+        def pay():
+            with transaction.atomic():
+                Transaction.objects.create(wallet=self.wallet, amount=Decimal('-1.00'), description='Payment')
+                Wallet.objects.filter(pk=self.wallet.pk).update(balance=F('balance') - Decimal('1.00'))
+
+        with self.commit_after_each_query(pay):
+            self.assertEqual(reconcile([self.wallet.pk]), [])
+        self.assertEqual(reconcile([self.wallet.pk]), [])
+
+    def test_checkpoint_committed_mid_run_is_not_mixed_up(self):
+        # A concurrent run checkpoints the wallet one transaction back once this one has started reading
+        reads = itertools.count()
+
+        def checkpoint():
+            if next(reads) != 1:
+                return
+            second = Transaction.objects.filter(wallet=self.wallet).order_by('id').values_list('id', flat=True)[1]
+            WalletCheckpoint.objects.bulk_create([
+                WalletCheckpoint(wallet=self.wallet, last_transaction_id=second, balance=Decimal('10.00'))
+            ], ignore_conflicts=True)
+
+        with self.commit_after_each_query(checkpoint):
+            created = create_checkpoints([self.wallet.pk], interval=1, now=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(created, 1)
+        self.assertEqual(
+            list(WalletCheckpoint.objects.order_by('last_transaction_id').values_list('balance', flat=True)),
+            [Decimal('10.00'), Decimal('15.00')],
+        )
+        self.assertEqual(balance_at(self.wallet.pk), Decimal('15.00'))
+
+
+class ReconcileWalletsCommandTests(TransactionTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.wallets = [
+            User.objects.create_user(username=f'user{i}', password='pass').wallet
+            for i in range(5)
+        ]
+        for wallet in cls.wallets:
+            Transaction.objects.bulk_create([
+                Transaction(wallet=wallet, amount=Decimal('2.50'), description='Payment') for _ in range(4)
+            ])
+        Wallet.objects.update(balance=Decimal('10.00'))
+
+    def setUp(self):
+        self.setUpTestData()
+
+    def test_reconciles_in_parallel_chunks(self):
+        out = StringIO()
+        call_command('reconcile_wallets', chunk_size=2, workers=2, stdout=out)
+        self.assertIn('Checked 5 wallets, 0 drifted', out.getvalue())
+
+        drifted = self.wallets[3]
+        Wallet.objects.filter(pk=drifted.pk).update(balance=Decimal('12.00'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('reconcile_wallets', chunk_size=2, workers=2, stdout=out)
+        self.assertIn(f'Wallet #{drifted.pk}: stored 12.00, expected 10.00 (drift 2.00).', out.getvalue())
+
+    def test_reconciles_inline(self):
+        out = StringIO()
+        call_command('reconcile_wallets', chunk_size=3, workers=0, stdout=out)
+        self.assertIn('Checked 5 wallets, 0 drifted', out.getvalue())
+
+    def test_workers_drop_inherited_connections(self):
+        connection = connections['default']
+        connection.ensure_connection()
+
+        with mock.patch('django.setup'):
+            _setup_worker(connection.settings_dict['NAME'])
+
+        self.assertIsNone(connection.connection)
+
+
+class RechargeWalletTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+
+    def recharge(self, amount, idempotency_key='form-1'):
+        return self.client.post(reverse('recharge_wallet'), {'amount': amount, 'idempotency_key': idempotency_key})
+
+    def test_users_get_a_wallet_on_creation(self):
+        self.assertEqual(Wallet.objects.get(user=self.customer).balance, Decimal('0.00'))
+
+    def test_form_carries_an_idempotency_key(self):
+        first = self.client.get(reverse('recharge_wallet'))
+        second = self.client.get(reverse('recharge_wallet'))
+
+        self.assertNotEqual(first.context['idempotency_key'], second.context['idempotency_key'])
+        self.assertContains(first, f'name="idempotency_key" value="{first.context["idempotency_key"]}"')
+
+    def test_recharge_credits_once_and_records_a_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertRedirects(self.recharge('25.50'), reverse('wallet'), fetch_redirect_response=False)
+        self.assertTrue(cache.get(recharge_key(self.customer.pk, 'form-1')))
+        response = self.recharge('25.50')
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)][-1],
+                         "This recharge was already processed.")
+
+        wallet = Wallet.objects.get(user=self.customer)
+        self.assertEqual(wallet.balance, Decimal('25.50'))
+        transaction = wallet.transactions.get()
+        self.assertEqual((transaction.amount, transaction.idempotency_key), (Decimal('25.50'), 'form-1'))
+
+        # The unique key still rejects the replay once the cached key has expired
+        cache.clear()
+        self.assertFalse(recharge(self.customer, Decimal('25.50'), 'form-1'))
+        self.assertTrue(recharge(self.customer, Decimal('4.50'), 'form-2'))
+        self.assertEqual(Wallet.objects.get(user=self.customer).balance, Decimal('30.00'))
+
+    def test_invalid_amounts_are_rejected(self):
+        for amount in ('', 'abc', '-5', '0', '1.234', 'NaN', 'Infinity', '100000000.00'):
+            with self.subTest(amount=amount):
+                response = self.recharge(amount)
+                self.assertRedirects(response, reverse('recharge_wallet'), fetch_redirect_response=False)
+        response = self.client.post(reverse('recharge_wallet'), {'idempotency_key': 'form-1'})
+        self.assertRedirects(response, reverse('recharge_wallet'), fetch_redirect_response=False)
+
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_overflowing_recharge_can_be_retried(self):
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('99999990.00'))
+
+        with self.assertRaises(ValueError):
+            recharge(self.customer, Decimal('10.00'), 'form-1')
+
+        self.assertFalse(Transaction.objects.exists())
+        self.assertTrue(recharge(self.customer, Decimal('9.99'), 'form-1'))
+
+    def test_recharge_that_never_commits_can_be_retried(self):
+        with self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                recharge(self.customer, Decimal('10.00'), 'form-1')
+                raise RuntimeError("worker died")
+
+        self.assertIsNone(cache.get(recharge_key(self.customer.pk, 'form-1')))
+        self.assertTrue(recharge(self.customer, Decimal('10.00'), 'form-1'))
+
+    def test_out_of_range_amount_is_rejected_before_any_write(self):
+        for amount in (Decimal('0.00'), Decimal('-1.00'), Decimal('100000000.00')):
+            with self.subTest(amount=amount), self.assertNumQueries(0):
+                with self.assertRaises(ValueError):
+                    recharge(self.customer, amount, 'form-1')
+
+    def test_backfill_gives_older_users_a_wallet(self):
+        Wallet.objects.filter(user=self.customer).delete()
+        User.objects.bulk_create([User(username=f'legacy{i}') for i in range(3)])
+        out = StringIO()
+
+        call_command('create_missing_wallets', chunk_size=2, stdout=out)
+
+        self.assertIn('Created 4 wallets', out.getvalue())
+        self.assertFalse(User.objects.filter(wallet__isnull=True).exists())
+        self.assertEqual(Wallet.objects.get(user=self.customer).balance, Decimal('0.00'))
+
+    def test_viewing_the_wallet_never_writes(self):
+        Wallet.objects.filter(user=self.customer).delete()
+
+        response = self.client.get(reverse('wallet'))
+
+        self.assertEqual(response.context['balance'], Decimal('0.00'))
+        self.assertFalse(Wallet.objects.filter(user=self.customer).exists())
+
+
+class RechargeWalletConcurrencyTests(TransactionTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+
+    def setUp(self):
+        self.setUpTestData()
+        cache.clear()
+
+    def submit_concurrently(self, keys):
+        barrier = threading.Barrier(len(keys))
+        statuses = []
+
+        def submit(idempotency_key):
+            client = self.client_class()
+            client.force_login(self.customer)
+            barrier.wait()
+            try:
+                response = client.post(reverse('recharge_wallet'),
+                                       {'amount': '10.00', 'idempotency_key': idempotency_key})
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [302] * len(keys))
+
+    def test_double_submit_credits_once(self):
+        self.submit_concurrently(['form-1'] * 8)
+
+        wallet = Wallet.objects.get(user=self.customer)
+        self.assertEqual(wallet.balance, Decimal('10.00'))
+        self.assertEqual(wallet.transactions.count(), 1)
+
+    def test_concurrent_recharges_all_land(self):
+        self.submit_concurrently([f'form-{i}' for i in range(8)])
+
+        wallet = Wallet.objects.get(user=self.customer)
+        self.assertEqual(wallet.balance, Decimal('80.00'))
+        self.assertEqual(wallet.transactions.count(), 8)
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
 
-from .views import UserRegistrationView, ProfileView, SpecialistOnlyView, CustomerOnlyView
+from .views import (
+    UserRegistrationView, ProfileView, SpecialistOnlyView, CustomerOnlyView, TransactionHistoryView,
+    TransactionExportView,
+)
 from . import views
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
@@ -10,4 +14,7 @@ urlpatterns = [
     path('customers/', CustomerOnlyView.as_view(), name='customers-only'),
     path('api-token-auth/', obtain_auth_token, name='api-token-auth'),
     path("recharge-wallet/", views.recharge_wallet, name="recharge_wallet"),
+    path('transactions/', TransactionHistoryView.as_view(), name='transaction-history'),
+    path('transactions/export.<str:file_format>', TransactionExportView.as_view(), name='transaction-export'),
+    path("wallet/", views.awallet if settings.ASYNC_READ_VIEWS else views.wallet, name="wallet"),
 ]
@@ -0,0 +1,74 @@
+# users/utils.py
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Transaction, User, Wallet
+
+# Repeats of a committed recharge key within this window are turned away before touching the database
+RECHARGE_IDEMPOTENCY_TTL = 60 * 60 * 24
+# Largest balance Wallet.balance (max_digits=10, decimal_places=2) can hold
+MAX_BALANCE = Decimal("99999999.99")
+ZERO = Decimal("0.00")
+
+
+def recharge_key(user_id, idempotency_key):
+    return f'users:recharge:{user_id}:{idempotency_key}'
+
+
+def recharge(user, amount, idempotency_key):
+    """
+    Credit amount to the user's wallet and record it as a Transaction.
+
+    The unique (wallet, idempotency_key) constraint decides whether a
+    submission is new, so concurrent double submits credit the wallet once.
+    Once a key's recharge has committed it is also noted in the cache, so a
+    later resubmission is turned away without a query. A recharge that never
+    commits leaves nothing behind, and the same submission may be retried.
+    The credit is a single conditional UPDATE, so concurrent recharges and
+    payments never lose each other's changes.
+    Returns False if the recharge was already made under that key.
+    """
+    if not ZERO < amount <= MAX_BALANCE:
+        raise ValueError("Recharge amount is out of range")
+    key = recharge_key(user.pk, idempotency_key)
+    if cache.get(key):
+        return False
+    with transaction.atomic():
+        transaction.on_commit(lambda: cache.set(key, True, RECHARGE_IDEMPOTENCY_TTL))
+        # Users from before wallets were created on sign-up get theirs on first recharge
+        wallet, created = Wallet.objects.only('id').get_or_create(user=user)
+        try:
+            with transaction.atomic():
+                Transaction.objects.create(wallet=wallet, amount=amount, description="Wallet recharge",
+                                           idempotency_key=idempotency_key)
+        except IntegrityError:
+            return False
+
+        credited = Wallet.objects.filter(pk=wallet.pk, balance__lte=MAX_BALANCE - amount).update(
+            balance=F('balance') + amount
+        )
+        if not credited:
+            raise ValueError("Recharge would exceed the maximum wallet balance")
+    return True
+
+
+def create_missing_wallets(chunk_size=1000):
+    """
+    Give every user from before wallets were created on sign-up an empty wallet.
+    Returns the number of users found without one.
+    """
+    created = 0
+    last_pk = 0
+    while True:
+        user_ids = list(User.objects.filter(pk__gt=last_pk, wallet__isnull=True).order_by('pk').values_list(
+            'pk', flat=True
+        )[:chunk_size])
+        if not user_ids:
+            return created
+        # A wallet created meanwhile by sign-up or a recharge is left as it is
+        created += len(Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in user_ids],
+                                                  ignore_conflicts=True))
+        last_pk = user_ids[-1]
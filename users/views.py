@@ -1,15 +1,24 @@
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from uuid import uuid4
 
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.utils import timezone
 from rest_framework import generics, permissions
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.reverse import reverse
+from rest_framework.views import APIView
 from django.contrib import messages
-from .models import User, Wallet
+from .exports import EXPORT_FORMATS
+from .models import Transaction, User, Wallet
+from .pagination import TransactionHistoryPagination
 from .permissions import IsCustomer, IsSpecialist
-from .serializers import UserRegistrationSerializer, ProfileSerializer
+from .serializers import UserRegistrationSerializer, ProfileSerializer, TransactionSerializer
+from .utils import MAX_BALANCE, recharge
 
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
 
 
 class UserRegistrationView(generics.CreateAPIView):
@@ -55,29 +64,75 @@ class CustomerOnlyView(generics.ListAPIView):
         # Filters profiles to return only those for customer users
         return User.objects.filter(role='customer')
 
+class TransactionHistoryView(generics.ListAPIView):
+    """
+    The authenticated user's wallet transactions, newest first, keyset-paginated.
+    """
+    serializer_class = TransactionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = TransactionHistoryPagination
+
+    def get_queryset(self):
+        return Transaction.objects.filter(wallet__user=self.request.user)
+
+
+class TransactionExportView(APIView):
+    """
+    Streams the authenticated user's whole transaction history as CSV or JSON Lines.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, file_format):
+        if file_format not in EXPORT_FORMATS:
+            raise Http404("Unsupported export format.")
+        content_type, lines = EXPORT_FORMATS[file_format]
+        transactions = Transaction.objects.filter(wallet__user=request.user).order_by('timestamp', 'id')
+        response = StreamingHttpResponse(lines(transactions), content_type=content_type)
+        filename = f"transactions-{timezone.now():%Y%m%d}.{file_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 @login_required
 def recharge_wallet(request):
     if request.method == "POST":
         try:
             amount = Decimal(request.POST.get('amount'))
-            if amount <= 0:
+            if not 0 < amount <= MAX_BALANCE or amount != amount.quantize(CENT):
                 messages.error(request, "Please enter a valid amount.")
                 return redirect(reverse("recharge_wallet"))
-
-            # Update the customer's wallet balance
-            wallet, created = Wallet.objects.get_or_create(user=request.user)
-            wallet.balance += amount
-            wallet.save()
-
-            messages.success(request, f"Successfully added ${amount} to your wallet!")
-            return redirect(reverse("wallet"))
-        except (ValueError, Decimal.InvalidOperation):
+        except (TypeError, ValueError, InvalidOperation):
             messages.error(request, "Invalid amount. Please enter a valid number.")
+            return redirect(reverse("recharge_wallet"))
 
-    return render(request, "users/recharge_wallet.html")
+        # Each rendered form carries its own key, so submitting it twice credits the wallet once
+        idempotency_key = request.POST.get('idempotency_key') or uuid4().hex
+        if len(idempotency_key) > 64:
+            messages.error(request, "Invalid recharge request. Please try again.")
+            return redirect(reverse("recharge_wallet"))
+        try:
+            if recharge(request.user, amount, idempotency_key):
+                messages.success(request, f"Successfully added ${amount} to your wallet!")
+            else:
+                messages.info(request, "This recharge was already processed.")
+        except ValueError as exc:
+            messages.error(request, str(exc))
+            return redirect(reverse("recharge_wallet"))
+        return redirect(reverse("wallet"))
+
+    return render(request, "users/recharge_wallet.html", {"idempotency_key": uuid4().hex})
 
 
 @login_required
 def wallet(request):
-    wallet, created = Wallet.objects.get_or_create(user=request.user)
-    return render(request, "users/wallet.html", {"balance": wallet.balance})
\ No newline at end of file
+    # Wallets are created with their user, so viewing one never writes
+    balance = Wallet.objects.filter(user=request.user).values_list('balance', flat=True).first()
+    return render(request, "users/wallet.html", {"balance": ZERO if balance is None else balance})
+
+
+@login_required
+async def awallet(request):
+    # Async wallet(): the session user and wallet are loaded without leaving the event loop
+    user = await request.auser()
+    balance = await Wallet.objects.filter(user=user).values_list('balance', flat=True).afirst()
+    return render(request, "users/wallet.html", {"balance": ZERO if balance is None else balance})